@@ -1,21 +1,54 @@
 import random
+import copy
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from threading import Thread
+from threading import Thread, Event
+from types import SimpleNamespace
 import time
 from database import DatabaseManager
 from battle_engine import BattleEngine
+from models import AICountry, User
+from scheduler import DecisionScheduler
+from target_selector import TargetSelector
+from unit_table import get_unit_table
+import metrics
+from profiler import profile
 import config
 
+# متن اعلان حمله برای مدافع (نتیجه از دید مهاجم)
+ATTACK_RESULTS = {
+    "win": "شکست سنگین خوردید",
+    "minor_win": "شکست خوردید",
+    "draw": "نبرد مساوی شد",
+    "minor_loss": "حمله را دفع کردید",
+    "heavy_loss": "حمله را با قدرت دفع کردید"
+}
+
 class AIManager:
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, broadcaster=None):
         self.db = db_manager
+        self.broadcaster = broadcaster
+        self.notifications = []  # اعلان‌های تراکنش جاری
         self.battle_engine = BattleEngine(db_manager)
+        self.target_selector = TargetSelector(db_manager)
         self.running = False
         self.ai_thread = None
+        self.scheduler = None
+        self.stop_event = Event()
+        self.pool = None
+        self.tick = 0
     
     def start(self):
         """شروع مدیریت AI"""
         self.running = True
+        self.stop_event.clear()
+        self.scheduler = DecisionScheduler(
+            config.Config.AI_DECISION_INTERVAL_MIN[0] * 60,
+            config.Config.AI_DECISION_INTERVAL_MIN[1] * 60,
+            rng=random.Random(config.AI_SEED) if config.AI_SEED is not None else None
+        )
+        if config.AI_PARALLEL:
+            self.pool = ThreadPoolExecutor(max_workers=config.AI_WORKERS)
         self.ai_thread = Thread(target=self._ai_loop)
         self.ai_thread.daemon = True
         self.ai_thread.start()
@@ -23,46 +56,76 @@ class AIManager:
     def stop(self):
         """توقف مدیریت AI"""
         self.running = False
+        self.stop_event.set()
+        if self.scheduler:
+            self.scheduler.stop()
         if self.ai_thread:
             self.ai_thread.join()
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+    
+    def stats(self):
+        """وضعیت صف تصمیم‌گیری AI"""
+        return self.scheduler.stats() if self.scheduler else {}
     
     def _ai_loop(self):
         """حلقه اصلی تصمیم‌گیری AI"""
+        last_sync = None
         while self.running:
             try:
-                # تصمیم‌گیری برای هر کشور AI
-                session = self.db.get_session()
-                ai_countries = session.query(AICountry).all()
-                
-                for ai_country in ai_countries:
-                    self._make_decision(ai_country)
+                # افزودن کشورهای AI جدید به صف
+                if last_sync is None or time.monotonic() - last_sync > config.AI_SYNC_INTERVAL:
+                    self._sync_countries()
+                    last_sync = time.monotonic()
                 
-                session.close()
+                # انتظار تا سررسید کشورهای بعدی (با stop فوراً بیدار می‌شود)
+                due_ids = self.scheduler.wait_due(timeout=config.AI_SYNC_INTERVAL)
+                if not due_ids:
+                    continue
                 
-                # خواب بین 10 تا 30 دقیقه
-                sleep_time = random.randint(
-                    config.Config.AI_DECISION_INTERVAL_MIN[0] * 60,
-                    config.Config.AI_DECISION_INTERVAL_MIN[1] * 60
-                )
-                time.sleep(sleep_time)
+                found_ids = None
+                try:
+                    session = self.db.get_session()
+                    try:
+                        with metrics.timer(metrics.AI_TICK_SECONDS), profile("ai_tick"):
+                            ai_countries = session.query(AICountry).filter(AICountry.id.in_(due_ids)).all()
+                            found_ids = [ai_country.id for ai_country in ai_countries]
+                            if self.pool:
+                                self._run_parallel_tick(session, ai_countries)
+                            else:
+                                for ai_country in ai_countries:
+                                    self._make_decision(ai_country)
+                    finally:
+                        session.close()
+                finally:
+                    # زمان‌بندی دوباره هر کشور با فاصله تصادفی خودش (کشورهای حذف شده کنار می‌روند)؛
+                    # wait_due آن‌ها را از صف برداشته، پس در صورت خطا همه سررسیدها دوباره زمان‌بندی می‌شوند
+                    for country_id in (due_ids if found_ids is None else found_ids):
+                        self.scheduler.reschedule(country_id)
                 
             except Exception as e:
                 print(f"Error in AI loop: {e}")
-                time.sleep(60)  # خواب یک دقیقه در صورت خطا
+                self.stop_event.wait(60)  # خواب یک دقیقه در صورت خطا
+    
+    def _sync_countries(self):
+        """همگام‌سازی صف با جدول کشورهای AI (فقط id ها خوانده می‌شوند)"""
+        session = self.db.get_session()
+        try:
+            country_ids = {row[0] for row in session.query(AICountry.id)}
+        finally:
+            session.close()
+        
+        for country_id in country_ids:
+            if country_id not in self.scheduler:
+                self.scheduler.add(country_id)
     
     def _make_decision(self, ai_country):
         """تصمیم‌گیری برای یک کشور AI"""
         session = self.db.get_session()
         
         try:
-            personality = ai_country.personality
-            
-            if personality == 'aggressive':
-                decision = self._aggressive_decision(ai_country, session)
-            elif personality == 'defensive':
-                decision = self._defensive_decision(ai_country, session)
-            else:  # diplomatic
-                decision = self._diplomatic_decision(ai_country, session)
+            decision = self._decide(ai_country, session)
             
             # اعمال تصمیم
             if decision:
@@ -75,27 +138,155 @@ class AIManager:
         finally:
             session.close()
     
-    def _aggressive_decision(self, ai_country, session):
+    def _decide(self, ai_country, session, rng=random):
+        """انتخاب تصمیم بر اساس شخصیت کشور"""
+        personality = ai_country.personality
+        
+        if personality == 'aggressive':
+            return self._aggressive_decision(ai_country, session, rng)
+        elif personality == 'defensive':
+            return self._defensive_decision(ai_country, session, rng)
+        else:  # diplomatic
+            return self._diplomatic_decision(ai_country, session, rng)
+    
+    def _rng_for(self, country_id):
+        """مولد تصادفی مستقل برای هر کشور (با seed نتیجه تکرارپذیر است)"""
+        if config.AI_SEED is None:
+            return random.Random()
+        return random.Random(f"{config.AI_SEED}:{self.tick}:{country_id}")
+    
+    def _snapshot(self, ai_country):
+        """کپی فقط‌خواندنی از وضعیت کشور برای workerها"""
+        return SimpleNamespace(
+            id=ai_country.id,
+            country=ai_country.country,
+            personality=ai_country.personality,
+            units=copy.deepcopy(ai_country.units or {}),
+            strategy_state=dict(ai_country.strategy_state or {}),
+            tech_level=ai_country.tech_level,
+            morale=ai_country.morale,
+            decision=None,
+            pending_attack=None,
+            target=None,
+            battle=None,
+            rng=self._rng_for(ai_country.id)
+        )
+    
+    def _plan_decision(self, snapshot):
+        """محاسبه تصمیم روی snapshot (بدون دسترسی به دیتابیس)"""
+        try:
+            snapshot.decision = self._decide(snapshot, None, snapshot.rng)
+        except Exception as e:
+            print(f"Error making AI decision: {e}")
+        return snapshot
+    
+    def _target_snapshot(self, user):
+        """کپی فقط‌خواندنی از کاربر هدف برای workerها"""
+        return SimpleNamespace(
+            id=user.id,
+            user_id=user.user_id,
+            bot_id=user.bot_id,
+            country=user.country,
+            units=copy.deepcopy(user.units or {}),
+            tech_level=user.tech_level,
+            morale=user.morale
+        )
+    
+    def _prefetch_targets(self, session, snapshots):
+        """انتخاب هدف همه حمله‌ها و بارگذاری همه هدف‌ها با یک کوئری"""
+        # انتخاب id ها به ترتیب کشورها تا مصرف rng هر کشور مثل حالت ترتیبی بماند
+        attacks = [snapshot for snapshot in snapshots if snapshot.pending_attack]
+        target_ids = {}
+        for snapshot in attacks:
+            target_ids[snapshot.id] = self._pick_target_id(session, snapshot, snapshot.pending_attack, snapshot.rng)
+        
+        ids = {target_id for target_id in target_ids.values() if target_id is not None}
+        users = {user.id: user for user in session.query(User).filter(User.id.in_(ids))} if ids else {}
+        self.target_selector.refresh_power(list(users.values()))
+        
+        for snapshot in attacks:
+            user = users.get(target_ids[snapshot.id])
+            snapshot.decision = "بررسی وضعیت"
+            if user is not None:
+                snapshot.target = self._target_snapshot(user)
+    
+    def _plan_attack(self, snapshot):
+        """پیش‌بینی و محاسبه جنگ روی snapshot (بدون دسترسی به دیتابیس)"""
+        try:
+            snapshot.decision, snapshot.battle = self._resolve_attack(
+                snapshot, snapshot.target, snapshot.pending_attack, snapshot.rng
+            )
+        except Exception as e:
+            print(f"Error making AI decision: {e}")
+        return snapshot
+    
+    def _run_parallel_tick(self, session, ai_countries):
+        """محاسبه موازی تصمیم‌ها و جنگ‌ها و اعمال همه تغییرات در یک تراکنش
+        
+        مراحل: تصمیم‌ها در pool، انتخاب و بارگذاری دسته‌ای هدف‌ها روی session،
+        پیش‌بینی و محاسبه جنگ‌ها در pool، سپس ثبت جنگ‌ها و کشورها در همین thread.
+        """
+        self.tick += 1
+        ai_countries = sorted(ai_countries, key=lambda ai_country: ai_country.id)
+        snapshots = list(self.pool.map(self._plan_decision, [self._snapshot(c) for c in ai_countries]))
+        
+        try:
+            self._prefetch_targets(session, snapshots)
+            attacks = [snapshot for snapshot in snapshots if snapshot.target is not None]
+            list(self.pool.map(self._plan_attack, attacks))
+            
+            now = datetime.utcnow()
+            for ai_country, snapshot in zip(ai_countries, snapshots):
+                if snapshot.battle:
+                    self._record_attack(snapshot, snapshot.target, snapshot.pending_attack,
+                                        snapshot.battle, session)
+                
+                if not snapshot.decision:
+                    continue
+                
+                ai_country.units = snapshot.units
+                ai_country.tech_level = snapshot.tech_level
+                ai_country.strategy_state = dict(snapshot.strategy_state, last_decision=snapshot.decision)
+                ai_country.last_action = now
+            
+            session.commit()
+            # اعلان‌ها فقط بعد از ثبت تراکنش ارسال می‌شوند
+            if self.broadcaster and self.notifications:
+                self.broadcaster.enqueue_many(self.notifications)
+        except Exception as e:
+            session.rollback()
+            print(f"Error applying AI decisions: {e}")
+        finally:
+            self.notifications = []
+    
+    def _aggressive_decision(self, ai_country, session, rng=random):
         """تصمیم‌گیری تهاجمی"""
         decisions = ['attack', 'build_military', 'upgrade_tech']
-        decision = random.choice(decisions)
+        decision = rng.choice(decisions)
         
         if decision == 'attack':
-            # حمله به یک کشور تصادفی
-            users = session.query(User).all()
-            if users:
-                target = random.choice(users)
-                self._ai_attack(ai_country, target)
-                return f"حمله به {target.country}"
+            attacker_units = self._choose_attack_units(ai_country, rng)
+            if not attacker_units:
+                return "بررسی وضعیت"
+            
+            # حالت موازی: هدف و جنگ در مرحله اعمال دسته‌ای انتخاب می‌شوند
+            if session is None:
+                ai_country.pending_attack = attacker_units
+                return "حمله"
+            
+            # حمله به یک کشور تصادفی (فقط هدف انتخاب‌شده بارگذاری می‌شود)
+            target = self._pick_target(session, ai_country, attacker_units, rng)
+            if target:
+                return self._attack_if_favourable(ai_country, target, attacker_units, rng=rng)
         
         elif decision == 'build_military':
             # ساخت نیروی نظامی
             unit_types = list(config.Config.UNITS.keys())
-            unit_type = random.choice(unit_types)
+            unit_type = rng.choice(unit_types)
             
             if unit_type in config.Config.UNITS:
                 units = list(config.Config.UNITS[unit_type].keys())
-                unit = random.choice(units)
+                unit = rng.choice(units)
                 
                 # افزایش نیروها
                 current_units = ai_country.units or {}
@@ -104,22 +295,22 @@ class AIManager:
                 if unit not in current_units[unit_type]:
                     current_units[unit_type][unit] = 0
                 
-                current_units[unit_type][unit] += random.randint(1, 5)
+                current_units[unit_type][unit] += rng.randint(1, 5)
                 ai_country.units = current_units
                 return f"ساخت {unit}"
         
         return "بررسی وضعیت"
     
-    def _defensive_decision(self, ai_country, session):
+    def _defensive_decision(self, ai_country, session, rng=random):
         """تصمیم‌گیری دفاعی"""
         decisions = ['build_defense', 'upgrade_buildings', 'form_alliance']
-        decision = random.choice(decisions)
+        decision = rng.choice(decisions)
         
         if decision == 'build_defense':
             # ساخت پدافند
             defense_units = config.Config.UNITS.get('defense', {})
             if defense_units:
-                unit = random.choice(list(defense_units.keys()))
+                unit = rng.choice(list(defense_units.keys()))
                 
                 current_units = ai_country.units or {}
                 if 'defense' not in current_units:
@@ -127,16 +318,16 @@ class AIManager:
                 if unit not in current_units['defense']:
                     current_units['defense'][unit] = 0
                 
-                current_units['defense'][unit] += random.randint(1, 3)
+                current_units['defense'][unit] += rng.randint(1, 3)
                 ai_country.units = current_units
                 return f"ساخت پدافند {unit}"
         
         return "تقویت دفاعی"
     
-    def _diplomatic_decision(self, ai_country, session):
+    def _diplomatic_decision(self, ai_country, session, rng=random):
         """تصمیم‌گیری دیپلماتیک"""
         decisions = ['form_alliance', 'trade', 'research']
-        decision = random.choice(decisions)
+        decision = rng.choice(decisions)
         
         if decision == 'form_alliance':
             # تلاش برای تشکیل اتحاد
@@ -149,19 +340,72 @@ class AIManager:
         
         return "مذاکره"
     
-    def _ai_attack(self, ai_country, target_user):
-        """حمله AI به کاربر"""
-        # انتخاب نیروهای حمله‌کننده
+    def _choose_attack_units(self, ai_country, rng=random):
+        """انتخاب نیروهای حمله‌کننده"""
         attacker_units = {}
         if ai_country.units:
             for unit_type, units in ai_country.units.items():
                 if units:
-                    unit_name = random.choice(list(units.keys()))
-                    count = min(units[unit_name], random.randint(1, 10))
+                    unit_name = rng.choice(list(units.keys()))
+                    count = min(units[unit_name], rng.randint(1, 10))
                     if count > 0:
                         if unit_type not in attacker_units:
                             attacker_units[unit_type] = {}
                         attacker_units[unit_type][unit_name] = count
+        return attacker_units
+    
+    def _pick_target_id(self, session, ai_country, attacker_units, rng=random):
+        """انتخاب id هدف هم‌قدرت با استفاده از ایندکس‌ها"""
+        attack_power = self.battle_engine.calculate_power(ai_country, attacker_units, "attack")
+        return self.target_selector.pick_id_for_attack(
+            session, attack_power, rng,
+            band=config.AI_TARGET_POWER_BAND,
+            active_days=config.AI_TARGET_ACTIVE_DAYS
+        )
+    
+    def _pick_target(self, session, ai_country, attacker_units, rng=random):
+        """انتخاب هدف هم‌قدرت با استفاده از ایندکس‌ها"""
+        attack_power = self.battle_engine.calculate_power(ai_country, attacker_units, "attack")
+        return self.target_selector.pick_for_attack(
+            session, attack_power, rng,
+            band=config.AI_TARGET_POWER_BAND,
+            active_days=config.AI_TARGET_ACTIVE_DAYS
+        )
+    
+    def _attack_if_favourable(self, ai_country, target, attacker_units, session=None, rng=random):
+        """حمله فقط در صورتی که شانس پیروزی کافی باشد"""
+        decision, result = self._resolve_attack(ai_country, target, attacker_units, rng)
+        if result:
+            self._record_attack(ai_country, target, attacker_units, result, session)
+        return decision
+    
+    def _resolve_attack(self, ai_country, target, attacker_units, rng=random):
+        """پیش‌بینی و محاسبه جنگ بدون دسترسی به دیتابیس؛ (تصمیم، نتیجه جنگ یا None)"""
+        # بردار هر دو ارتش یک بار برای پیش‌بینی و جنگ ساخته می‌شود
+        table = get_unit_table()
+        armies = (table.army(attacker_units), table.army(target.units or {}))
+        
+        # پیش‌بینی نتیجه قبل از حمله و صرف نظر از اهداف بد (seed از rng کشور برای تکرارپذیری)
+        prediction = self.battle_engine.predict_battle(
+            ai_country, target, armies[0], n=config.AI_PREDICTION_SAMPLES,
+            defender_units=armies[1], seed=rng.getrandbits(64)
+        )
+        if prediction['win_chance'] < config.AI_MIN_WIN_CHANCE:
+            return f"صرف نظر از حمله به {target.country}", None
+        
+        result = self.battle_engine.calculate_battle(
+            attacker=ai_country,
+            defender=target,
+            attacker_units=armies[0],
+            defender_units=armies[1],
+            rng=rng
+        )
+        return f"حمله به {target.country}", result
+    
+    def _ai_attack(self, ai_country, target_user, attacker_units=None, session=None, rng=random):
+        """حمله AI به کاربر"""
+        if attacker_units is None:
+            attacker_units = self._choose_attack_units(ai_country, rng)
         
         if not attacker_units:
             return
@@ -170,9 +414,13 @@ class AIManager:
         result = self.battle_engine.calculate_battle(
             attacker=ai_country,
             defender=target_user,
-            attacker_units=attacker_units
+            attacker_units=attacker_units,
+            rng=rng
         )
-        
+        self._record_attack(ai_country, target_user, attacker_units, result, session)
+    
+    def _record_attack(self, ai_country, target_user, attacker_units, result, session=None):
+        """ذخیره نتیجه جنگ و اعلان به مدافع"""
         # ذخیره نتیجه جنگ
         self.battle_engine.save_battle(
             attacker_id=ai_country.id,
@@ -183,5 +431,15 @@ class AIManager:
             result=result['result'],
             attacker_losses=result['attacker_losses'],
             defender_losses=result['defender_losses'],
-            resources_stolen=result['resources_stolen']
+            resources_stolen=result['resources_stolen'],
+            session=session
         )
+        
+        # اعلان حمله به صاحب کشور (بدون انتظار برای ارسال)
+        if self.broadcaster and getattr(target_user, 'bot_id', None):
+            text = f"⚔️ {ai_country.country} به شما حمله کرد: {ATTACK_RESULTS.get(result['result'], result['result'])}"
+            notification = (target_user.bot_id, target_user.user_id, text)
+            if session is None:
+                self.broadcaster.enqueue(*notification)
+            else:
+                self.notifications.append(notification)
@@ -0,0 +1,149 @@
+import asyncio
+import contextvars
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import database
+import metrics
+import config
+
+class DatabaseBusy(Exception):
+    """صف دیتابیس پر است"""
+
+class DatabaseTimeout(TimeoutError):
+    """کوئری در زمان مجاز تمام نشد"""
+
+class _Call:
+    """اجرای یک تابع دیتابیس در thread اجراکننده (با context فراخواننده برای متریک‌ها)"""
+
+    def __init__(self, func, args, kwargs, done):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.context = contextvars.copy_context()
+        self.done = done  # آزاد کردن جای صف وقتی کار واقعاً تمام شد
+        self.state = "queued"
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        try:
+            with self.lock:
+                # کار لغوشده در صف هرگز اجرا نمی‌شود
+                if self.state == "cancelled":
+                    raise DatabaseTimeout(f"{self.func.__name__} cancelled")
+                self.state = "running"
+                self.conn = database.get_connection()
+            return self.context.run(self.func, *self.args, **self.kwargs)
+        finally:
+            with self.lock:
+                self.conn = None
+                self.state = "finished"
+            self.done()
+
+    def cancel(self):
+        """لغو کار؛ True اگر هنوز شروع نشده بود، در غیر این صورت کوئری در حال اجرا متوقف می‌شود"""
+        with self.lock:
+            if self.state == "queued":
+                self.state = "cancelled"
+                return True
+            if self.conn is not None:
+                self.conn.interrupt()
+            return False
+
+def _consume(future):
+    # جلوگیری از هشدار exception بازیابی‌نشده برای کارهای لغوشده
+    if not future.cancelled():
+        future.exception()
+
+def _async(func):
+    async def wrapper(self, *args, **kwargs):
+        return await self.run(func, *args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+class AsyncDatabase:
+    """دسترسی async به توابع database.py از طریق یک executor اختصاصی با سقف صف و timeout"""
+
+    def __init__(self, workers, max_pending, timeout):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """اجرای func در executor بدون مسدود کردن event loop
+
+        DatabaseTimeout فقط وقتی برمی‌گردد که تابع هیچ تغییری ثبت نکرده باشد؛ جای صف تا پایان
+        واقعی کار در executor آزاد نمی‌شود.
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise DatabaseBusy(f"{self.pending} database calls pending")
+            self.pending += 1
+
+        call = _Call(func, args, kwargs, self._release)
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, call)
+        except Exception:
+            self._release()
+            raise
+
+        try:
+            done, _ = await asyncio.wait({future}, timeout=timeout or self.timeout)
+        except asyncio.CancelledError:
+            call.cancel()
+            future.add_done_callback(_consume)
+            raise
+        if not done:
+            self.timeouts += 1
+            if call.cancel():
+                future.add_done_callback(_consume)
+                raise DatabaseTimeout(f"{func.__name__} timed out")
+            # در حال اجرا: کوئری متوقف شده و نتیجه واقعی (ثبت یا rollback) منتظر می‌ماند
+            try:
+                result = await future
+            except sqlite3.OperationalError as e:
+                if "interrupted" in str(e):
+                    raise DatabaseTimeout(f"{func.__name__} timed out") from None
+                raise
+        else:
+            result = future.result()
+        self.completed += 1
+        return result
+
+    get_user = _async(database.get_user)
+    add_user = _async(database.add_user)
+    update_user_resources = _async(database.update_user_resources)
+    give_loan = _async(database.give_loan)
+    set_units = _async(database.set_units)
+    get_units = _async(database.get_units)
+    add_units = _async(database.add_units)
+    remove_units = _async(database.remove_units)
+    apply_battle_losses = _async(database.apply_battle_losses)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+adb = AsyncDatabase(config.DB_EXECUTOR_WORKERS, config.DB_MAX_PENDING, config.DB_QUERY_TIMEOUT)
+metrics.REGISTRY.register_gauges("db_executor", "Async database executor state", adb.stats)
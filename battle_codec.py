@@ -0,0 +1,219 @@
+import threading
+from sqlalchemy import event, tuple_
+from sqlalchemy.orm import Session
+from models import UnitId, Battle
+
+# نسخه 2: گروه‌های خالی (مثل 'air': {}) هم ذخیره می‌شوند
+FORMAT_VERSION = 2
+FORMAT_VERSIONS = (1, 2)
+
+def _write_varint(out, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+class UnitDictionary:
+    """دیکشنری نسخه‌دار واحدها (فقط اضافه‌شونده؛ نسخه = بزرگ‌ترین id شناخته‌شده)"""
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+        self._version = 0
+
+    @property
+    def version(self):
+        # register فقط ورودی‌های جستجوشده را اضافه می‌کند، پس تعداد ورودی‌ها نسخه را نشان نمی‌دهد
+        return self._version
+
+    def load(self, session):
+        """بارگذاری همه ورودی‌ها از دیتابیس (ورودی‌های commit‌نشده همین session کنار گذاشته می‌شوند)"""
+        pending = set(_pending(session).values())
+        rows = session.query(UnitId.unit_id, UnitId.unit_type, UnitId.unit_name).all()
+        with self.lock:
+            for unit_id, unit_type, unit_name in rows:
+                if unit_id in pending:
+                    continue
+                self.ids[(unit_type, unit_name)] = unit_id
+                self.keys[unit_id] = (unit_type, unit_name)
+                self._version = max(self._version, unit_id)
+
+    def publish(self, entries):
+        """افزودن ورودی‌های commit‌شده به کش"""
+        with self.lock:
+            for key, unit_id in entries.items():
+                self.ids[key] = unit_id
+                self.keys[unit_id] = key
+                self._version = max(self._version, unit_id)
+
+    def ensure(self, session, blobs):
+        """بارگذاری دوباره اگر یکی از بایت‌ها با نسخه جدیدتری ساخته شده باشد"""
+        versions = [_read_varint(blob, 1)[0] for blob in blobs if blob]
+        if versions and max(versions) > self.version:
+            self.load(session)
+
+    def register(self, session, units_dicts):
+        """ثبت واحدهای جدید در تراکنش فراخواننده؛ id ها فقط بعد از commit وارد کش می‌شوند"""
+        pending = _pending(session)
+        new_keys = {(unit_type, unit_name)
+                    for units in units_dicts if units
+                    for unit_type, unit_dict in units.items()
+                    for unit_name in unit_dict
+                    if (unit_type, unit_name) not in self.ids and (unit_type, unit_name) not in pending}
+        if not new_keys:
+            return
+
+        # واحدهایی که thread یا پروسه دیگری قبلاً ثبت و commit کرده
+        existing = {(unit_type, unit_name): unit_id for unit_id, unit_type, unit_name in
+                    session.query(UnitId.unit_id, UnitId.unit_type, UnitId.unit_name)
+                    .filter(tuple_(UnitId.unit_type, UnitId.unit_name).in_(list(new_keys)))}
+        self.publish(existing)
+
+        added = [UnitId(unit_type=unit_type, unit_name=unit_name)
+                 for unit_type, unit_name in sorted(new_keys - set(existing))]
+        if not added:
+            return
+        session.add_all(added)
+        session.flush()
+        session.info.setdefault("unit_ids", {}).update(
+            ((entry.unit_type, entry.unit_name), entry.unit_id) for entry in added)
+
+    def _lookup(self, key, pending):
+        unit_id = self.ids.get(key)
+        return pending.get(key) if unit_id is None else unit_id
+
+    def encode(self, units, session=None):
+        """تبدیل دیکشنری نیروها به بایت‌ها؛ اگر واحد ناشناخته باشد None"""
+        pending = _pending(session)
+        pairs = []
+        empty = []
+        for unit_type, unit_dict in units.items():
+            if not unit_dict:
+                empty.append(unit_type)
+            for unit_name, count in unit_dict.items():
+                unit_id = self._lookup((unit_type, unit_name), pending)
+                if unit_id is None or count != int(count):
+                    return None
+                pairs.append((unit_id, int(count)))
+
+        out = bytearray([FORMAT_VERSION])
+        _write_varint(out, max(self.version, *pending.values()) if pending else self.version)
+        _write_varint(out, len(pairs))
+        for unit_id, count in sorted(pairs):
+            _write_varint(out, unit_id)
+            _write_varint(out, _zigzag(count))
+        _write_varint(out, len(empty))
+        for unit_type in empty:
+            name = unit_type.encode("utf-8")
+            _write_varint(out, len(name))
+            out.extend(name)
+        return bytes(out)
+
+    def decode(self, data, session=None):
+        """تبدیل بایت‌ها به دیکشنری نیروها"""
+        if data[0] not in FORMAT_VERSIONS:
+            raise ValueError(f"Unknown battle encoding version: {data[0]}")
+        version, pos = _read_varint(data, 1)
+        reloaded = version > self.version and session is not None
+        if reloaded:
+            self.load(session)
+        keys = self._keys(session)
+
+        count_pairs, pos = _read_varint(data, pos)
+        units = {}
+        for _ in range(count_pairs):
+            unit_id, pos = _read_varint(data, pos)
+            count, pos = _read_varint(data, pos)
+            key = keys.get(unit_id)
+            if key is None and not reloaded and session is not None:
+                # id ثبت‌شده در پروسه دیگر با نسخه‌ای کوچک‌تر از نسخه این کش؛ یک بار بارگذاری دوباره
+                reloaded = True
+                self.load(session)
+                keys = self._keys(session)
+                key = keys.get(unit_id)
+            if key is None:
+                raise KeyError(f"Unknown unit id: {unit_id}")
+            unit_type, unit_name = key
+            units.setdefault(unit_type, {})[unit_name] = _unzigzag(count)
+
+        if data[0] >= 2:
+            count_empty, pos = _read_varint(data, pos)
+            for _ in range(count_empty):
+                length, pos = _read_varint(data, pos)
+                units.setdefault(data[pos:pos + length].decode("utf-8"), {})
+                pos += length
+        return units
+
+    def _keys(self, session):
+        # id -> (نوع، نام) همراه با ورودی‌های commit‌نشده همین session
+        pending = _pending(session)
+        if not pending:
+            return self.keys
+        keys = dict(self.keys)
+        keys.update((unit_id, key) for key, unit_id in pending.items())
+        return keys
+
+def _pending(session):
+    # id های ثبت‌شده در تراکنش باز این session (هنوز commit نشده)
+    return session.info.get("unit_ids", {}) if session is not None else {}
+
+unit_dictionary = UnitDictionary()
+
+@event.listens_for(Session, "after_commit")
+def _publish_unit_ids(session):
+    entries = session.info.pop("unit_ids", None)
+    if entries:
+        unit_dictionary.publish(entries)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_unit_ids(session):
+    session.info.pop("unit_ids", None)
+
+def convert_battles(db_manager, batch_size=1000):
+    """تبدیل دسته‌ای سطرهای JSON قدیمی به قالب فشرده"""
+    converted = 0
+    last_id = 0
+    session = db_manager.get_session()
+    try:
+        while True:
+            battles = (session.query(Battle)
+                       .filter(Battle.id > last_id)
+                       .order_by(Battle.id).limit(batch_size).all())
+            if not battles:
+                return converted
+
+            unit_dictionary.register(session, [
+                units for battle in battles for units in battle.legacy_unit_fields()
+            ])
+            for battle in battles:
+                if battle.pack_legacy():
+                    converted += 1
+            session.commit()
+            last_id = battles[-1].id
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
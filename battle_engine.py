@@ -1,81 +1,64 @@
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import and_, or_, insert, select, delete
 from database import DatabaseManager
-from models import Battle
+from models import Battle, BattleArchive
+from battle_codec import unit_dictionary
+from unit_table import Army, get_unit_table, tech_bonus
+import metrics
 import config
 
+# نرخ تلفات (مهاجم، مدافع) برای هر نتیجه
+LOSS_RATES = {
+    "win": (0.1, 0.4),
+    "minor_win": (0.25, 0.3),
+    "draw": (0.2, 0.2),
+    "minor_loss": (0.3, 0.2),
+    "heavy_loss": (0.4, 0.1)
+}
+
 class BattleEngine:
     def __init__(self, db_manager):
         self.db = db_manager
     
-    def calculate_battle(self, attacker, defender, attacker_units, defender_units=None):
-        """محاسبه نتیجه جنگ"""
+    def calculate_battle(self, attacker, defender, attacker_units, defender_units=None, rng=random):
+        """محاسبه نتیجه جنگ (rng برای نتیجه تکرارپذیر؛ نیروها دیکشنری یا Army از قبل ساخته‌شده)"""
+        
+        # اگر مدافع نیروهای مشخصی نفرستاده، از تمام نیروهای دفاعی استفاده می‌شود
+        if not defender_units:
+            defender_units = defender.units
         
-        # محاسبه قدرت حمله
-        attacker_power = self.calculate_power(attacker, attacker_units, "attack")
+        # قدرت هر ارتش یک بار محاسبه و برای فراخوانی‌های بعدی با همان Army نگه داشته می‌شود
+        table = get_unit_table()
+        attacker_army = table.army(attacker_units)
+        defender_army = table.army(defender_units)
         
-        # اگر مدافع نیروهای مشخصی فرستاده
-        if defender_units:
-            defender_power = self.calculate_power(defender, defender_units, "defense")
-        else:
-            # استفاده از تمام نیروهای دفاعی
-            defender_power = self.calculate_power(defender, defender.units, "defense")
+        attacker_power = self.calculate_power(attacker, attacker_army, "attack")
+        defender_power = self.calculate_power(defender, defender_army, "defense")
         
         # اعمال شانس (10-20%)
-        attacker_luck = random.uniform(0.9, 1.2)
-        defender_luck = random.uniform(0.9, 1.2)
+        attacker_luck = rng.uniform(0.9, 1.2)
+        defender_luck = rng.uniform(0.9, 1.2)
         
         attacker_final = attacker_power * attacker_luck * (attacker.morale / 100)
         defender_final = defender_power * defender_luck * (defender.morale / 100)
         
         # محاسبه نتیجه
-        result = ""
-        attacker_losses = {}
-        defender_losses = {}
+        result = self.classify_result(attacker_final, defender_final)
+        metrics.BATTLE_OPERATIONS.inc(operation="calculate")
+        metrics.BATTLE_RESULTS.inc(result=result)
+        attacker_loss_rate, defender_loss_rate = LOSS_RATES[result]
         resources_stolen = {}
         
-        if attacker_final > defender_final * 1.5:
-            # پیروزی قاطع
-            result = "win"
-            attacker_loss_rate = 0.1  # 10% تلفات
-            defender_loss_rate = 0.4  # 40% تلفات
-            
-            # سرقت منابع
-            if isinstance(defender, dict) and 'money' in defender:
-                steal_amount = defender['money'] * 0.3  # 30% پول
-                resources_stolen = {"money": steal_amount}
-        
-        elif attacker_final > defender_final:
-            # پیروزی جزئی
-            result = "minor_win"
-            attacker_loss_rate = 0.25  # 25% تلفات
-            defender_loss_rate = 0.3   # 30% تلفات
-            
-            if isinstance(defender, dict) and 'money' in defender:
-                steal_amount = defender['money'] * 0.15  # 15% پول
-                resources_stolen = {"money": steal_amount}
-        
-        elif attacker_final < defender_final * 0.7:
-            # شکست سنگین
-            result = "heavy_loss"
-            attacker_loss_rate = 0.4   # 40% تلفات
-            defender_loss_rate = 0.1   # 10% تلفات
-        
-        elif attacker_final < defender_final:
-            # شکست جزئی
-            result = "minor_loss"
-            attacker_loss_rate = 0.3   # 30% تلفات
-            defender_loss_rate = 0.2   # 20% تلفات
-        
-        else:
-            # تساوی
-            result = "draw"
-            attacker_loss_rate = 0.2   # 20% تلفات
-            defender_loss_rate = 0.2   # 20% تلفات
+        # سرقت منابع (30% پول در پیروزی قاطع، 15% در پیروزی جزئی)
+        if result in ("win", "minor_win") and isinstance(defender, dict) and 'money' in defender:
+            steal_rate = 0.3 if result == "win" else 0.15
+            resources_stolen = {"money": defender['money'] * steal_rate}
         
         # محاسبه تلفات واحدها
-        attacker_losses = self.calculate_losses(attacker_units, attacker_loss_rate)
-        defender_losses = self.calculate_losses(defender_units if defender_units else defender.units, defender_loss_rate)
+        attacker_losses = self.calculate_losses(attacker_army, attacker_loss_rate)
+        defender_losses = self.calculate_losses(defender_army, defender_loss_rate)
         
         return {
             "result": result,
@@ -86,57 +69,203 @@ class BattleEngine:
             "defender_power": defender_final
         }
     
+    def classify_result(self, attacker_final, defender_final):
+        """تعیین نتیجه جنگ از روی قدرت نهایی دو طرف"""
+        if attacker_final > defender_final * 1.5:
+            return "win"  # پیروزی قاطع
+        elif attacker_final > defender_final:
+            return "minor_win"  # پیروزی جزئی
+        elif attacker_final < defender_final * 0.7:
+            return "heavy_loss"  # شکست سنگین
+        elif attacker_final < defender_final:
+            return "minor_loss"  # شکست جزئی
+        return "draw"  # تساوی
+    
+    def predict_battle(self, attacker, defender, attacker_units, n=10000, defender_units=None, seed=None):
+        """پیش‌بینی احتمال نتایج جنگ با شبیه‌سازی مونت‌کارلو (نیروها دیکشنری یا Army)"""
+        if not defender_units:
+            defender_units = defender.units
+        
+        table = get_unit_table()
+        attacker_army = table.army(attacker_units)
+        defender_army = table.army(defender_units)
+        attacker_vector = attacker_army.vector
+        defender_vector = defender_army.vector
+        
+        attacker_power = self.calculate_power(attacker, attacker_army, "attack") * (attacker.morale / 100)
+        defender_power = self.calculate_power(defender, defender_army, "defense") * (defender.morale / 100)
+        
+        # شبیه‌سازی n جنگ با شانس تصادفی (همان بازه calculate_battle)
+        rng = np.random.default_rng(seed)
+        metrics.BATTLE_OPERATIONS.inc(operation="predict")
+        attacker_final = attacker_power * rng.uniform(0.9, 1.2, n)
+        defender_final = defender_power * rng.uniform(0.9, 1.2, n)
+        
+        bands = [
+            ("win", attacker_final > defender_final * 1.5),
+            ("minor_win", attacker_final > defender_final),
+            ("heavy_loss", attacker_final < defender_final * 0.7),
+            ("minor_loss", attacker_final < defender_final)
+        ]
+        outcome = np.select([mask for _, mask in bands], range(len(bands)), default=len(bands))
+        counts = np.bincount(outcome, minlength=len(bands) + 1)
+        names = [name for name, _ in bands] + ["draw"]
+        probabilities = {name: float(counts[i]) / n for i, name in enumerate(names)}
+        
+        # امید ریاضی تلفات = مجموع تلفات هر نتیجه × احتمال آن
+        attacker_expected = np.zeros(len(table))
+        defender_expected = np.zeros(len(table))
+        for name, probability in probabilities.items():
+            if probability:
+                attacker_rate, defender_rate = LOSS_RATES[name]
+                attacker_expected += probability * table.losses(attacker_vector, attacker_rate)
+                defender_expected += probability * table.losses(defender_vector, defender_rate)
+        
+        return {
+            "probabilities": probabilities,
+            "win_chance": probabilities["win"] + probabilities["minor_win"],
+            "attacker_expected_losses": self._expected_to_dict(attacker_expected),
+            "defender_expected_losses": self._expected_to_dict(defender_expected),
+            "attacker_power": attacker_power,
+            "defender_power": defender_power
+        }
+    
+    def _expected_to_dict(self, vector):
+        """تبدیل بردار تلفات مورد انتظار به دیکشنری"""
+        table = get_unit_table()
+        losses = {}
+        for i in np.flatnonzero(vector):
+            unit_type, unit_name = table.keys[i]
+            losses.setdefault(unit_type, {})[unit_name] = round(float(vector[i]), 2)
+        return losses
+    
     def calculate_power(self, player, units, action_type):
-        """محاسبه قدرت کلی"""
-        power = 0
+        """محاسبه قدرت کلی (units دیکشنری، بردار یا Army)"""
+        table = get_unit_table()
+        if isinstance(units, np.ndarray):
+            # ضرب داخلی تعداد واحدها در بردار قدرت + بونوس تکنولوژی
+            return table.power(units, action_type, player.tech_level)
         
-        for unit_type, unit_dict in units.items():
-            for unit_name, count in unit_dict.items():
-                if unit_name in config.Config.UNITS.get(unit_type, {}):
-                    unit_info = config.Config.UNITS[unit_type][unit_name]
-                    if action_type == "attack":
-                        power += count * unit_info.get("attack", 0)
-                    else:  # defense
-                        power += count * unit_info.get("defense", 0)
-        
-        # اعمال بونوس تکنولوژی
-        tech_bonus = 1 + (player.tech_level * 0.05)  # 5% افزایش به ازای هر سطح
-        power *= tech_bonus
-        
-        return power
+        power = units.power(action_type) if isinstance(units, Army) else table.raw_power(units, action_type)
+        return power * tech_bonus(player.tech_level)
+    
+    def calculate_power_batch(self, players, armies, action_type):
+        """محاسبه قدرت تعداد زیادی ارتش در یک فراخوانی"""
+        table = get_unit_table()
+        tech_levels = [player.tech_level for player in players]
+        return table.power_batch(armies, action_type, tech_levels)
     
     def calculate_losses(self, units, loss_rate):
-        """محاسبه تلفات واحدها"""
-        losses = {}
+        """محاسبه تلفات واحدها (units دیکشنری، بردار یا Army)"""
+        if isinstance(units, np.ndarray):
+            table = get_unit_table()
+            return table.to_dict(table.losses(units, loss_rate))
+        
+        if isinstance(units, Army):
+            units = units.units
         
+        # یک پیمایش پایتونی روی دیکشنری (گروه‌های خالی و واحدهای خارج از جدول هم حفظ می‌شوند)؛
+        # برای حدود 30 نوع واحد از تبدیل بردار به دیکشنری سریع‌تر است
+        losses = {}
         for unit_type, unit_dict in units.items():
-            losses[unit_type] = {}
+            unit_losses = losses[unit_type] = {}
             for unit_name, count in unit_dict.items():
                 lost = int(count * loss_rate)
                 if lost > 0:
-                    losses[unit_type][unit_name] = lost
-        
+                    unit_losses[unit_name] = lost
         return losses
     
     def save_battle(self, attacker_id, defender_id, attacker_type, defender_type,
-                   units_used, result, attacker_losses, defender_losses, resources_stolen):
+                   units_used, result, attacker_losses, defender_losses, resources_stolen, session=None):
         """ذخیره اطلاعات جنگ"""
-        session = self.db.get_session()
+        # در تراکنش دسته‌ای فقط اضافه می‌شود و commit با فراخواننده است
+        own_session = session is None
+        if own_session:
+            session = self.db.get_session()
+        
         try:
+            # ثبت واحدهای جدید در دیکشنری تا نیروها فشرده ذخیره شوند
+            unit_dictionary.register(session, [units_used, attacker_losses, defender_losses])
             battle = Battle(
                 attacker_id=attacker_id,
                 defender_id=defender_id,
                 attacker_type=attacker_type,
                 defender_type=defender_type,
-                units_used=units_used,
                 result=result,
-                attacker_losses=attacker_losses,
-                defender_losses=defender_losses,
                 resources_stolen=resources_stolen
             )
+            # نیروها بعد از add فشرده می‌شوند تا id های ثبت‌شده در همین تراکنش دیده شوند
             session.add(battle)
+            battle.units_used = units_used
+            battle.attacker_losses = attacker_losses
+            battle.defender_losses = defender_losses
+            metrics.BATTLE_OPERATIONS.inc(operation="save")
+            if not own_session:
+                return battle
             session.commit()
             return battle.id
+        except Exception as e:
+            if own_session:
+                session.rollback()
+            raise e
+        finally:
+            if own_session:
+                session.close()
+    
+    def get_history(self, player_id, limit=20, before=None, player_type=None):
+        """تاریخچه جنگ‌های یک بازیکن (صفحه‌بندی keyset، جدیدترین اول)"""
+        # before: مکان‌نمای برگشتی صفحه قبل به شکل (timestamp, id)
+        session = self.db.get_session()
+        try:
+            def side(column, type_column):
+                # هر طرف جداگانه از ایندکس (id, timestamp) خودش استفاده می‌کند
+                query = session.query(Battle).filter(column == player_id)
+                if player_type:
+                    query = query.filter(type_column == player_type)
+                if before:
+                    timestamp, battle_id = before
+                    query = query.filter(or_(
+                        Battle.timestamp < timestamp,
+                        and_(Battle.timestamp == timestamp, Battle.id < battle_id)
+                    ))
+                return query.order_by(Battle.timestamp.desc(), Battle.id.desc()).limit(limit).all()
+            
+            battles = {battle.id: battle for battle in
+                       side(Battle.attacker_id, Battle.attacker_type) + side(Battle.defender_id, Battle.defender_type)}
+            page = sorted(battles.values(), key=lambda b: (b.timestamp, b.id), reverse=True)[:limit]
+            
+            # اطمینان از بارگذاری دیکشنری واحدها قبل از بستن session
+            unit_dictionary.ensure(session, [battle.units_used_packed for battle in page] +
+                                   [battle.attacker_losses_packed for battle in page] +
+                                   [battle.defender_losses_packed for battle in page])
+            
+            next_cursor = None
+            if len(page) == limit:
+                next_cursor = (page[-1].timestamp, page[-1].id)
+            return page, next_cursor
+        finally:
+            session.close()
+    
+    def archive_battles(self, older_than_days=90, batch_size=5000):
+        """انتقال جنگ‌های قدیمی به جدول آرشیو (دسته‌ای، هر دسته یک تراکنش)"""
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        columns = [c.name for c in BattleArchive.__table__.columns if c.name != 'archived_at']
+        archived = 0
+        
+        session = self.db.get_session()
+        try:
+            while True:
+                ids = [row[0] for row in session.query(Battle.id)
+                       .filter(Battle.timestamp < cutoff)
+                       .order_by(Battle.timestamp).limit(batch_size)]
+                if not ids:
+                    return archived
+                
+                source = select(*[Battle.__table__.c[name] for name in columns]).where(Battle.id.in_(ids))
+                session.execute(insert(BattleArchive.__table__).from_select(columns, source))
+                session.execute(delete(Battle.__table__).where(Battle.id.in_(ids)))
+                session.commit()
+                archived += len(ids)
         except Exception as e:
             session.rollback()
             raise e
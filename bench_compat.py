@@ -0,0 +1,73 @@
+"""جایگزین‌های موقت برای اجرای بنچمارک‌ها روی این درخت
+
+battle_engine، economy و webhook_server به config.Config و database.DatabaseManager وابسته‌اند
+که در این مخزن تعریف نشده‌اند. install() فقط وقتی این دو وجود نداشته باشند نسخه بنچمارک را
+قرار می‌دهد؛ اگر تعریف واقعی اضافه شود همان استفاده می‌شود.
+
+مشخصات واحدها در BENCH_UNITS ساختگی و ثابت است (نه ترازبندی واقعی بازی)، پس اعداد
+بنچمارک‌های جنگ فقط برای مقایسه نسخه‌ها با هم معنی دارند.
+"""
+import os
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import models
+from models import User
+
+def _bench_units():
+    # واحدهای ارتش پیش‌فرض models.User با حمله/دفاع ثابت بر اساس ترتیب
+    units = User.__table__.c.units.default.arg(None)
+    table = {}
+    for group_index, (unit_type, unit_dict) in enumerate(units.items()):
+        table[unit_type] = {
+            unit_name: {"attack": 10 * (group_index + 1) + 5 * i, "defense": 8 * (group_index + 1) + 3 * i}
+            for i, unit_name in enumerate(unit_dict)
+        }
+    return table
+
+class BenchConfig:
+    UNITS = _bench_units()
+    COUNTRIES = ["ایران", "ترکیه", "عراق", "مصر"]
+    LOAN_COOLDOWN_HOURS = 24
+    MAX_LOAN_AMOUNT = 5000
+    AI_DECISION_INTERVAL_MIN = (10, 30)
+
+class BenchDB:
+    """دیتابیس SQLAlchemy با همان متدهایی که EconomyManager و webhook_server صدا می‌زنند"""
+
+    def __init__(self, url=None):
+        # پیش‌فرض فایل در پوشه جاری (بنچمارک‌ها در پوشه موقت اجرا می‌شوند) تا همه thread ها یک دیتابیس ببینند
+        self.engine = create_engine(url or f"sqlite:///{os.path.abspath('bench-orm.db')}",
+                                    connect_args={"check_same_thread": False})
+        models.Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def get_session(self):
+        return self.Session()
+
+    def get_user(self, user_id, bot_id):
+        session = self.Session()
+        try:
+            return session.query(User).filter(User.user_id == user_id, User.bot_id == bot_id).first()
+        finally:
+            session.close()
+
+    def update_user(self, user_id, data):
+        session = self.Session()
+        try:
+            session.query(User).filter(User.user_id == user_id).update(data)
+            session.commit()
+        finally:
+            session.close()
+
+def install():
+    """قرار دادن config.Config و database.DatabaseManager در صورت نبود؛ فهرست جایگزین‌ها برمی‌گردد"""
+    import config
+    import database
+    installed = []
+    if not hasattr(config, "Config"):
+        config.Config = BenchConfig
+        installed.append("config.Config")
+    if not hasattr(database, "DatabaseManager"):
+        database.DatabaseManager = BenchDB
+        installed.append("database.DatabaseManager")
+    return installed
@@ -0,0 +1,297 @@
+"""میکروبنچمارک مسیرهای پرتکرار جنگ، اقتصاد و دیتابیس
+
+ارتش‌ها از مقادیر پیش‌فرض models.User ساخته و با ضریب 1، 10 و 100 بزرگ می‌شوند.
+هر بنچمارک با seed ثابت، گرم‌کردن و چند دور اندازه‌گیری اجرا می‌شود.
+config.Config و database.DatabaseManager در صورت نبود از bench_compat جایگزین می‌شوند.
+
+    python bench_micro.py --save-baseline bench_baseline.json
+    python bench_micro.py --compare bench_baseline.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from models import User
+from bench_compat import BenchDB, install
+
+SEED = 1234
+SCALES = (1, 10, 100)
+
+def default_user(**overrides):
+    """کاربر با مقادیر پیش‌فرض ستون‌ها (مثل یک سطر تازه درج‌شده)"""
+    values = {}
+    for column in User.__table__.c:
+        default = column.default
+        if default is None:
+            continue
+        values[column.key] = default.arg(None) if default.is_callable else default.arg
+    values.update(user_id=1, country="bench", production_rate=None)
+    values.update(overrides)
+    return User(**values)
+
+def scale_counts(groups, factor):
+    """ضرب همه تعدادها در ضریب"""
+    return {group: {name: count * factor for name, count in items.items()}
+            for group, items in groups.items()}
+
+def scaled_user(factor, **overrides):
+    user = default_user(**overrides)
+    user.units = scale_counts(user.units, factor)
+    user.buildings = {name: count * factor for name, count in user.buildings.items()}
+    user.production_rate = None
+    return user
+
+# هر بنچمارک: setup(ضریب) -> تابع بدون آرگومان
+BENCHMARKS = {}
+
+def benchmark(name, scaled=True):
+    def register(setup):
+        BENCHMARKS[name] = (setup, scaled)
+        return setup
+    return register
+
+@benchmark("battle.calculate_battle")
+def bench_calculate_battle(factor):
+    from battle_engine import BattleEngine
+    engine = BattleEngine(None)
+    attacker = scaled_user(factor)
+    defender = scaled_user(factor, user_id=2)
+    return lambda: engine.calculate_battle(attacker, defender, attacker.units)
+
+@benchmark("battle.calculate_battle.prebuilt")
+def bench_calculate_battle_prebuilt(factor):
+    # مسیر AI: Army دو طرف یک بار برای پیش‌بینی و جنگ ساخته می‌شود و قدرت آن‌ها نگه داشته می‌شود
+    from battle_engine import BattleEngine
+    from unit_table import get_unit_table
+    engine = BattleEngine(None)
+    attacker = scaled_user(factor)
+    defender = scaled_user(factor, user_id=2)
+    table = get_unit_table()
+    attacker_army, defender_army = table.army(attacker.units), table.army(defender.units)
+    return lambda: engine.calculate_battle(attacker, defender, attacker_army, defender_army)
+
+@benchmark("battle.calculate_power")
+def bench_calculate_power(factor):
+    from battle_engine import BattleEngine
+    engine = BattleEngine(None)
+    player = scaled_user(factor)
+    return lambda: engine.calculate_power(player, player.units, "attack")
+
+@benchmark("battle.calculate_losses")
+def bench_calculate_losses(factor):
+    from battle_engine import BattleEngine
+    engine = BattleEngine(None)
+    units = scaled_user(factor).units
+    return lambda: engine.calculate_losses(units, 0.2)
+
+@benchmark("economy.calculate_daily_production")
+def bench_daily_production(factor):
+    from economy import EconomyManager
+    economy = EconomyManager(None)
+    user = scaled_user(factor)
+    return lambda: economy.calculate_daily_production(user)
+
+@benchmark("economy.update_user_resources")
+def bench_update_user_resources(factor):
+    from economy import EconomyManager
+    db = BenchDB("sqlite://")
+    economy = EconomyManager(db)
+    session = db.get_session()
+    user = scaled_user(factor, bot_id=1, last_active=datetime.utcnow() - timedelta(hours=1))
+    session.add(user)
+    session.commit()
+    session.close()
+    return lambda: economy.update_user_resources(1, 1)
+
+def _sqlite_db():
+    """دیتابیس sqlite موقت برای توابع database.py"""
+    import database
+    database.write_buffer.flush()
+    database.pool.close_all()
+    database.pool.path = os.path.join(tempfile.mkdtemp(prefix="bench-micro-"), "game.db")
+    database.player_cache.clear()
+    database.init_db()
+    database.add_user(1, "attacker", "bench")
+    database.add_user(2, "defender", "bench")
+    return database
+
+@benchmark("database.get_user", scaled=False)
+def bench_db_get_user(factor):
+    # مسیر گرم: بعد از اولین فراخوانی از کش بازیکن
+    database = _sqlite_db()
+    return lambda: database.get_user(1)
+
+@benchmark("database.get_user.cold", scaled=False)
+def bench_db_get_user_cold(factor):
+    # مسیر سرد: کش قبل از هر فراخوانی خالی می‌شود و سطر از sqlite خوانده می‌شود
+    database = _sqlite_db()
+    key = database._cache_key(1)
+
+    def cold():
+        database.player_cache.invalidate(key)
+        return database.get_user(1)
+    return cold
+
+@benchmark("database.update_user_resources", scaled=False)
+def bench_db_update_resources(factor):
+    database = _sqlite_db()
+    return lambda: database.update_user_resources(1, 10, durability="immediate")
+
+@benchmark("database.update_user_resources.grouped", scaled=False)
+def bench_db_update_resources_grouped(factor):
+    database = _sqlite_db()
+    return lambda: database.update_user_resources(1, 10, durability="grouped")
+
+@benchmark("database.set_units")
+def bench_db_set_units(factor):
+    database = _sqlite_db()
+    units = scaled_user(factor).units
+    return lambda: database.set_units(1, units, durability="immediate")
+
+@benchmark("database.get_units")
+def bench_db_get_units(factor):
+    database = _sqlite_db()
+    database.set_units(1, scaled_user(factor).units, durability="immediate")
+    return lambda: database.get_units(1)
+
+@benchmark("database.apply_battle_losses")
+def bench_db_apply_losses(factor):
+    database = _sqlite_db()
+    units = scaled_user(factor).units
+    database.set_units(1, units, durability="immediate")
+    database.set_units(2, units, durability="immediate")
+    losses = {group: {name: 1 for name in items} for group, items in units.items()}
+    return lambda: database.apply_battle_losses(1, losses, 2, losses)
+
+def measure(func, warmup, repeat, min_time):
+    """گرم‌کردن، تعیین تعداد فراخوانی هر دور و زمان هر فراخوانی در هر دور"""
+    for _ in range(warmup):
+        func()
+
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - started) / number)
+
+    return {
+        "number": number,
+        "rounds": repeat,
+        "median_us": statistics.median(rounds) * 1e6,
+        "mean_us": statistics.fmean(rounds) * 1e6,
+        "stdev_us": (statistics.stdev(rounds) if len(rounds) > 1 else 0.0) * 1e6,
+        "min_us": min(rounds) * 1e6,
+        "max_us": max(rounds) * 1e6,
+        "ops_per_sec": 1 / statistics.median(rounds)
+    }
+
+def run(names, scales, warmup, repeat, min_time):
+    results = {}
+    for name in names:
+        setup, scaled = BENCHMARKS[name]
+        for factor in (scales if scaled else (1,)):
+            # seed ثابت برای هر بنچمارک (شانس جنگ و ...)
+            random.seed(SEED)
+            np.random.seed(SEED)
+            key = f"{name}[x{factor}]" if scaled else name
+            results[key] = measure(setup(factor), warmup, repeat, min_time)
+            print(f"{key:50s} {results[key]['median_us']:12.2f} us  ±{results[key]['stdev_us']:.2f}",
+                  file=sys.stderr)
+    return results
+
+def compare(results, baseline, threshold):
+    """مقایسه میانه‌ها با baseline؛ کندتر از آستانه = regression"""
+    report = {}
+    for key, current in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if previous is None:
+            continue
+        change = current["median_us"] / previous["median_us"] - 1
+        status = "regression" if change > threshold else "improved" if change < -threshold else "ok"
+        report[key] = {
+            "baseline_us": previous["median_us"],
+            "current_us": current["median_us"],
+            "change": change,
+            "status": status
+        }
+    return report
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Battle/economy/database microbenchmarks")
+    parser.add_argument("--filter", default="", help="فقط بنچمارک‌هایی که نامشان شامل این متن است")
+    parser.add_argument("--scales", default=",".join(map(str, SCALES)))
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.05, help="حداقل زمان هر دور (ثانیه)")
+    parser.add_argument("--output", help="ذخیره نتیجه JSON")
+    parser.add_argument("--save-baseline", help="ذخیره نتیجه به عنوان baseline")
+    parser.add_argument("--compare", help="فایل baseline برای مقایسه")
+    parser.add_argument("--threshold", type=float, default=0.10, help="آستانه regression (0.1 = 10%%)")
+    args = parser.parse_args(argv)
+    for option in ("output", "save_baseline", "compare"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+    # database.py هنگام import فایل game.db را در پوشه جاری می‌سازد
+    os.chdir(tempfile.mkdtemp(prefix="bench-micro-"))
+
+    shims = install()
+    names = [name for name in BENCHMARKS if args.filter in name]
+    scales = [int(scale) for scale in args.scales.split(",")]
+    result = {
+        "benchmark": "micro",
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": sys.version.split()[0],
+        "config": {"warmup": args.warmup, "repeat": args.repeat, "min_time": args.min_time,
+                   "scales": scales, "seed": SEED, "shims": shims},
+        "results": run(names, scales, args.warmup, args.repeat, args.min_time)
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        result["comparison"] = compare(result["results"], baseline, args.threshold)
+        regressions = [key for key, item in result["comparison"].items() if item["status"] == "regression"]
+        for key in regressions:
+            item = result["comparison"][key]
+            print(f"REGRESSION {key}: {item['baseline_us']:.2f} -> {item['current_us']:.2f} us "
+                  f"({item['change']:+.1%})", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+    print(text)
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
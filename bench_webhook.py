@@ -0,0 +1,372 @@
+"""بنچمارک سرتاسری وب‌هوک ربات‌های فرزند
+
+آپدیت‌های مصنوعی تلگرام به webhook_server (روی یک پورت محلی) ارسال می‌شود و پاسخ ربات‌ها
+توسط یک Bot API محلی دریافت می‌شود. نتیجه (گذردهی، تأخیرها و تعداد عملیات دیتابیس) به صورت JSON ذخیره می‌شود.
+
+    python bench_webhook.py --bots 20 --users 200 --updates 5000 --mix info=5,loan=2,start=1 --output results.json
+
+تعامل attack هندلری در child_bot ندارد؛ فقط با --mix صریح اجرا و در گزارش unhandled نامیده می‌شود.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import numpy as np
+
+# نوع تعامل -> نوع آپدیت و داده callback (آپدیت‌های بدون هندلر فقط تا پاسخ HTTP اندازه‌گیری می‌شوند)
+INTERACTIONS = {
+    "start": ("message", "/start"),
+    "info": ("callback", "info"),
+    "loan": ("callback", "loan"),
+    "attack": ("message", "⚔️ حمله")  # بدون هندلر
+}
+
+class FakeTelegramAPI:
+    """Bot API محلی که فقط زمان پاسخ ربات به هر آپدیت را ثبت می‌کند"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        api = self
+        self.calls = Counter()
+        self.completed = {}  # (توکن، message_id) -> زمان اولین پاسخ
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                token, _, method = self.path[len("/bot"):].partition("/")
+                params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+                result = api.handle(token, method, params)
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, token, method, params):
+        now = time.perf_counter()
+        # پاسخ هر آپدیت با message_id آن (یا پیامی که به آن reply شده) شناسایی می‌شود
+        message_id = params.get("reply_to_message_id") or params.get("message_id")
+        with self._lock:
+            self.calls[method] += 1
+            if message_id and method in ("sendMessage", "editMessageText"):
+                self.completed.setdefault((token, int(message_id)), now)
+
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            return {
+                "message_id": int(message_id or 0),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "text": params.get("text", "")
+            }
+        return True
+
+    def completion(self, token, message_id):
+        with self._lock:
+            return self.completed.get((token, message_id))
+
+def make_update(seq, kind, user_id):
+    """ساخت یک آپدیت مصنوعی تلگرام (message_id یکتا برای پیگیری پاسخ)"""
+    update_type, value = INTERACTIONS[kind]
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    if update_type == "callback":
+        return {
+            "update_id": seq,
+            "callback_query": {
+                "id": str(seq),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": value,
+                "message": {
+                    "message_id": seq,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "پنل کاربر"
+                }
+            }
+        }
+    # پیام‌ها در گروه ارسال می‌شوند تا پاسخ ربات با reply_to_message_id قابل پیگیری باشد
+    return {
+        "update_id": seq,
+        "message": {
+            "message_id": seq,
+            "date": int(time.time()),
+            "from": user,
+            "chat": {"id": -user_id, "type": "group", "title": "bench"},
+            "text": value
+        }
+    }
+
+def parse_mix(text):
+    """تبدیل 'info=5,loan=2' به وزن نوع‌های تعامل"""
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in INTERACTIONS:
+            raise ValueError(f"Unknown interaction: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+def summarize(samples):
+    """p50/p95/p99 بر حسب میلی‌ثانیه"""
+    if not samples:
+        return None
+    values = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(samples),
+        "mean": float(values.mean()),
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "max": float(values.max())
+    }
+
+class StatementCounter:
+    """شمارش دستورهای SQL اجرا شده روی اتصال‌های sqlite"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, statement):
+        with self._lock:
+            self.count += 1
+
+    def attach(self, pool):
+        # اتصال‌های جدید استخر با trace callback ساخته می‌شوند
+        pool.close_all()
+        connect = pool._connect
+
+        def traced_connect():
+            conn = connect()
+            conn.set_trace_callback(self)
+            return conn
+
+        pool._connect = traced_connect
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    api = FakeTelegramAPI().start()
+
+    # دیتابیس موقت؛ مسیر game.db نسبی است و از پوشه جاری خوانده می‌شود
+    db_dir = args.db_dir or tempfile.mkdtemp(prefix="bench-webhook-")
+    os.makedirs(db_dir, exist_ok=True)
+    os.chdir(db_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import config
+    config.TELEGRAM_API_URL = api.url
+    import database
+    from werkzeug.serving import make_server
+    from bench_compat import install
+    shims = install()
+    import webhook_server
+
+    # لاگ هر درخواست HTTP خود بخشی از هزینه اندازه‌گیری می‌شد
+    for name in ("httpx", "werkzeug"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    # اگر database قبلاً (در پوشه دیگری) import شده باشد، اتصال‌ها به دیتابیس موقت منتقل می‌شوند
+    database.pool.close_all()
+    database.pool.path = os.path.join(db_dir, "game.db")
+    database.init_db()
+    for user_id in range(1, args.users + 1):
+        database.add_user(user_id, f"user{user_id}", "bench")
+
+    dispatcher = webhook_server.dispatcher
+    tokens = []
+    for bot_id in range(1, args.bots + 1):
+        token = f"{bot_id}:bench-token-{bot_id}"
+        dispatcher.register(bot_id, token)
+        tokens.append(token)
+
+    counter = StatementCounter()
+    counter.attach(database.pool)
+
+    server = make_server("127.0.0.1", 0, webhook_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+
+    rng = random.Random(args.seed)
+    kinds = list(args.mix)
+    weights = [args.mix[kind] for kind in kinds]
+    plan = [(seq, rng.choice(tokens), rng.choices(kinds, weights)[0], rng.randint(1, args.users))
+            for seq in range(1, args.updates + 1)]
+
+    local = threading.local()
+    sent = {}  # seq -> (زمان ارسال، نوع)
+    ack_latency = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def post(token, body):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection(host, port, timeout=30)
+        try:
+            conn.request("POST", f"/webhook/{token}", body, {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            local.conn = None
+            return "error"
+
+    def send(item):
+        seq, token, kind, user_id = item
+        body = json.dumps(make_update(seq, kind, user_id))
+        started = time.perf_counter()
+        # مثل تلگرام، آپدیت‌های رد شده (429/503) پس از مکث دوباره ارسال می‌شوند
+        for attempt in range(args.retries + 1):
+            request_started = time.perf_counter()
+            status = post(token, body)
+            elapsed = time.perf_counter() - request_started
+            with lock:
+                statuses[status] += 1
+                ack_latency.append(elapsed)
+            if status not in (429, 503):
+                break
+            time.sleep(args.retry_delay * (attempt + 1))
+        if status == 200:
+            with lock:
+                sent[seq] = (started, token, kind)
+
+    # تعداد عملیات دیتابیس فقط در بازه اندازه‌گیری
+    counter.count = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(send, plan))
+    send_duration = time.perf_counter() - started
+
+    # انتظار برای پاسخ ربات‌ها به آپدیت‌های دارای هندلر
+    expected = {seq: item for seq, item in sent.items() if item[2] in args.handled}
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        if all(api.completion(token, seq) for seq, (_, token, _) in expected.items()):
+            break
+        time.sleep(0.05)
+    while dispatcher.stats()["queue_depth"] and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    database.write_buffer.flush()
+
+    e2e = []
+    by_type = {kind: [] for kind in args.mix}
+    last_completion = started + send_duration
+    missing = 0
+    for seq, (sent_at, token, kind) in expected.items():
+        done_at = api.completion(token, seq)
+        if done_at is None:
+            missing += 1
+            continue
+        e2e.append(done_at - sent_at)
+        by_type[kind].append(done_at - sent_at)
+        last_completion = max(last_completion, done_at)
+
+    duration = last_completion - started
+    accepted = len(sent)
+    result = {
+        "benchmark": "webhook",
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "bots": args.bots,
+            "users": args.users,
+            "updates": args.updates,
+            "concurrency": args.concurrency,
+            "retries": args.retries,
+            "mix": args.mix,
+            "unhandled": sorted(kind for kind in args.mix if kind not in args.handled),
+            "seed": args.seed,
+            "shims": shims
+        },
+        "duration": duration,
+        "accepted": accepted,
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "throughput": accepted / duration if duration else 0.0,
+        "ack_latency_ms": summarize(ack_latency),
+        "e2e_latency_ms": summarize(e2e),
+        "e2e_by_type_ms": {kind: summarize(samples) for kind, samples in by_type.items() if samples},
+        "unanswered": missing,
+        "db_ops": counter.count,
+        "db_ops_per_update": counter.count / accepted if accepted else 0.0,
+        "telegram_calls": dict(api.calls),
+        "dispatcher": dispatcher.stats()
+    }
+
+    server.shutdown()
+    dispatcher.stop()
+    api.stop()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Webhook load benchmark")
+    parser.add_argument("--bots", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("info=5,loan=2,start=1"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--retries", type=int, default=20, help="تعداد ارسال دوباره پس از 429/503")
+    parser.add_argument("--retry-delay", type=float, default=0.05)
+    parser.add_argument("--db-dir", help="پوشه دیتابیس (پیش‌فرض: پوشه موقت)")
+    parser.add_argument("--output", help="مسیر فایل JSON نتیجه")
+    args = parser.parse_args(argv)
+    # تعامل‌هایی که هندلر دارند و پاسخشان به Bot API می‌رسد
+    args.handled = {"start", "info", "loan"}
+
+    output = os.path.abspath(args.output) if args.output else None
+    result = run(args)
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
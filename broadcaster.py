@@ -0,0 +1,415 @@
+import asyncio
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, InvalidToken, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+import database
+import config
+
+MAX_TEXT_LENGTH = 4096
+SEPARATOR = "\n\n"
+
+class TokenBucket:
+    """محدودیت نرخ: rate توکن در ثانیه با حداکثر capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now):
+        """برداشتن یک توکن؛ در صورت نبود، زمان انتظار لازم برمی‌گردد"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def block(self, seconds):
+        """توقف ارسال (پاسخ 429 تلگرام)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+class Message:
+    __slots__ = ("id", "bot_id", "chat_id", "text", "attempts")
+
+    def __init__(self, bot_id, chat_id, text, message_id=None):
+        self.id = message_id
+        self.bot_id = bot_id
+        self.chat_id = chat_id
+        self.text = text
+        self.attempts = 0
+
+class Broadcaster:
+    """صف ارسال پیام به کاربران با محدودیت نرخ هر ربات و سراسری، ادغام پیام‌های هر چت و ماندگاری در دیتابیس
+
+    هر پروسه (مثلاً هر worker گانیکورن) فقط پیام‌هایی را می‌فرستد که در جدول outbox با lease
+    به نام خودش ثبت شده‌اند؛ پیام‌های پروسه‌ای که lease آن منقضی شود توسط پروسه دیگری برداشته می‌شوند.
+    """
+
+    def __init__(self, db_manager, bot_rate=None, bot_burst=None, global_rate=None,
+                 concurrency=None, max_attempts=None, connection_pool_size=32,
+                 lease=None, retry_base=1.0):
+        self.db = db_manager
+        self.bot_rate = bot_rate or config.BROADCAST_BOT_RATE
+        self.bot_burst = bot_burst or config.BROADCAST_BOT_BURST
+        self.global_bucket = TokenBucket(global_rate or config.BROADCAST_GLOBAL_RATE,
+                                         global_rate or config.BROADCAST_GLOBAL_RATE)
+        self.concurrency = concurrency or config.BROADCAST_CONCURRENCY
+        self.max_attempts = max_attempts or config.BROADCAST_MAX_ATTEMPTS
+        self.lease = lease or config.BROADCAST_LEASE_SECONDS
+        self.retry_base = retry_base
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.request = HTTPXRequest(connection_pool_size=connection_pool_size)
+
+        self._lock = threading.Lock()
+        self._queues = {}  # bot_id -> deque پیام‌ها
+        self._open = {}  # (bot_id, chat_id) -> آخرین پیام در صف (قابل ادغام)
+        self._buckets = {}
+        self._ready = []  # heap (زمان آماده شدن، bot_id)
+        self._scheduled = set()
+        self._bots = {}
+        self._tokens = {}
+        self._done = []  # id پیام‌های ارسال‌شده برای حذف دسته‌ای
+        self._wake = None
+        self._slots = None
+        self.loop = None
+        self._thread = None
+        self._tasks = []
+
+        self.queued = 0
+        self.enqueued = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.throttled = 0
+        self.retried = 0
+        self.dropped = 0
+        self.claimed = 0
+
+    def start(self):
+        """بارگذاری پیام‌های باقی‌مانده و اجرای حلقه ارسال در thread جداگانه"""
+        if self._thread:
+            return
+        self._claim()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_tasks(), self.loop).result()
+
+    async def _start_tasks(self):
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._tasks = [asyncio.create_task(self._sender()), asyncio.create_task(self._persist_loop())]
+        self._wake.set()
+
+    def stop(self):
+        if not self.loop:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
+        self._thread = None
+
+    async def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._flush_done()
+        # پیام‌های ارسال‌نشده بلافاصله برای پروسه‌های دیگر آزاد می‌شوند
+        database.outbox_release(self.owner)
+        await self.request.shutdown()
+
+    def _claim(self):
+        """برداشتن پیام‌های بی‌صاحب (از قبل از راه‌اندازی یا از پروسه‌ای که lease آن تمام شده)"""
+        now = time.time()
+        rows = database.outbox_claim(self.owner, now + self.lease, now)
+        if not rows:
+            return 0
+        # پیام‌های یک چت در یک پیام ادغام می‌شوند
+        updated = {}
+        duplicates = []
+        with self._lock:
+            for message_id, bot_id, chat_id, text in rows:
+                key = (bot_id, chat_id)
+                message = self._open.get(key)
+                if message and len(message.text) + len(SEPARATOR) + len(text) <= MAX_TEXT_LENGTH:
+                    message.text += SEPARATOR + text
+                    duplicates.append(message_id)
+                    if message.id is not None:
+                        updated[message.id] = message
+                    continue
+                message = Message(bot_id, chat_id, text, message_id)
+                self._open[key] = message
+                self._push(message)
+            texts = [(message.text, message_id) for message_id, message in updated.items()]
+        if duplicates:
+            database.outbox_save([], texts)
+            database.outbox_delete(duplicates)
+        self.claimed += len(rows)
+        logging.info(f"Claimed {len(rows)} pending outbound messages")
+        return len(rows)
+
+    def enqueue(self, bot_id, chat_id, text):
+        """افزودن یک پیام به صف"""
+        self.enqueue_many([(bot_id, chat_id, text)])
+
+    def enqueue_many(self, items):
+        """افزودن تعداد زیادی پیام (bot_id, chat_id, text) بدون انتظار برای ارسال"""
+        new_messages = []
+        updated = {}
+        appended = []  # (پیام ثبت‌شده، شروع، پایان) متن ادغام‌شده این فراخوانی
+        with self._lock:
+            for bot_id, chat_id, text in items:
+                self.enqueued += 1
+                key = (bot_id, chat_id)
+                message = self._open.get(key)
+                if message and len(message.text) + len(SEPARATOR) + len(text) <= MAX_TEXT_LENGTH:
+                    # ادغام با پیام ارسال‌نشده همان چت
+                    start = len(message.text)
+                    message.text += SEPARATOR + text
+                    self.coalesced += 1
+                    if message.id is not None:
+                        updated[message.id] = message
+                        appended.append((message, start, len(message.text)))
+                    continue
+                message = Message(bot_id, chat_id, text[:MAX_TEXT_LENGTH])
+                self._open[key] = message
+                new_messages.append(message)
+
+            saved = [message.text for message in new_messages]
+            updated_texts = [(message.text, message_id) for message_id, message in updated.items()]
+
+        # ماندگاری خارج از قفل تا حلقه ارسال منتظر دیسک نماند
+        try:
+            ids = database.outbox_save(
+                [(message.bot_id, message.chat_id, text) for message, text in zip(new_messages, saved)],
+                updated_texts, owner=self.owner, lease_until=time.time() + self.lease
+            )
+        except Exception:
+            with self._lock:
+                self._discard_unsaved(new_messages, saved, appended)
+            self._notify()
+            raise
+        with self._lock:
+            for message, message_id in zip(new_messages, ids):
+                message.id = message_id
+                self._push(message)
+            # پیام‌هایی که پیش از گرفتن id با فراخوانی دیگری ادغام شدند
+            late = [(message.text, message.id) for message, text in zip(new_messages, saved)
+                    if message.text != text]
+        if late:
+            database.outbox_save([], late)
+        self._notify()
+
+    def _discard_unsaved(self, new_messages, saved, appended):
+        # باید با self._lock فراخوانی شود؛ وضعیت صف به پیش از enqueue_many ناموفق برمی‌گردد
+        for message, start, end in reversed(appended):
+            message.text = message.text[:start] + message.text[end:]
+        for message, text in zip(new_messages, saved):
+            key = (message.bot_id, message.chat_id)
+            if self._open.get(key) is message:
+                del self._open[key]
+            if message.text != text:
+                # فراخوانی دیگری در این فاصله در پیام ادغام کرده؛ بخش آن بدون ماندگاری ارسال می‌شود
+                message.text = message.text[len(text) + len(SEPARATOR):]
+                self._push(message)
+
+    def broadcast(self, bot_id, chat_ids, text):
+        """ارسال یک متن به چند چت (مثلاً پیام همگانی مالک)"""
+        self.enqueue_many([(bot_id, chat_id, text) for chat_id in chat_ids])
+
+    def _push(self, message):
+        # باید با self._lock فراخوانی شود
+        queue = self._queues.get(message.bot_id)
+        if queue is None:
+            queue = self._queues[message.bot_id] = deque()
+        queue.append(message)
+        self.queued += 1
+        if message.bot_id not in self._scheduled:
+            self._scheduled.add(message.bot_id)
+            heapq.heappush(self._ready, (time.monotonic(), message.bot_id))
+
+    def _notify(self):
+        if self.loop and self._wake:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    def _bucket(self, bot_id):
+        bucket = self._buckets.get(bot_id)
+        if bucket is None:
+            bucket = self._buckets[bot_id] = TokenBucket(self.bot_rate, self.bot_burst)
+        return bucket
+
+    def _next(self, now):
+        """پیام بعدی که محدودیت‌ها اجازه ارسالش را می‌دهند، یا زمان انتظار"""
+        with self._lock:
+            while self._ready:
+                ready_at, bot_id = self._ready[0]
+                if ready_at > now:
+                    return None, ready_at - now
+                heapq.heappop(self._ready)
+
+                bucket = self._bucket(bot_id)
+                wait = bucket.reserve(now)
+                if not wait:
+                    wait = self.global_bucket.reserve(now)
+                    if wait:
+                        bucket.refund()
+                if wait:
+                    heapq.heappush(self._ready, (now + wait, bot_id))
+                    continue
+
+                queue = self._queues[bot_id]
+                message = queue.popleft()
+                self.queued -= 1
+                key = (message.bot_id, message.chat_id)
+                if self._open.get(key) is message:
+                    del self._open[key]
+                if queue:
+                    heapq.heappush(self._ready, (now, bot_id))
+                else:
+                    del self._queues[bot_id]
+                    self._scheduled.discard(bot_id)
+                return message, 0.0
+        return None, None
+
+    async def _sender(self):
+        while True:
+            message, wait = self._next(time.monotonic())
+            if message is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            asyncio.create_task(self._send(message))
+
+    async def _bot(self, bot_id):
+        bot = self._bots.get(bot_id)
+        if bot is None:
+            token = self._tokens.get(bot_id)
+            if token is None:
+                token = self._tokens[bot_id] = await asyncio.get_running_loop().run_in_executor(
+                    None, self._lookup_token, bot_id)
+            if token is None:
+                return None
+            bot = self._bots[bot_id] = Bot(token, base_url=config.TELEGRAM_API_URL, request=self.request)
+        return bot
+
+    def _lookup_token(self, bot_id):
+        session = self.db.get_session()
+        try:
+            from models import ChildBot
+            bot = session.query(ChildBot).filter(ChildBot.id == bot_id).first()
+            return bot.bot_token if bot and bot.status == 'active' else None
+        finally:
+            session.close()
+
+    async def _send(self, message):
+        try:
+            bot = await self._bot(message.bot_id)
+            if bot is None:
+                self._drop(message, "unknown bot")
+                return
+            await bot.send_message(message.chat_id, message.text)
+            self.sent += 1
+            if message.id is not None:
+                self._done.append(message.id)
+        except RetryAfter as e:
+            # محدودیت تلگرام برای کل ربات؛ پیام به ابتدای صف برمی‌گردد
+            self.throttled += 1
+            self._bucket(message.bot_id).block(e.retry_after)
+            self._requeue(message, front=True)
+        except (Forbidden, BadRequest, InvalidToken) as e:
+            self._drop(message, e)
+        except NetworkError as e:
+            message.attempts += 1
+            if message.attempts >= self.max_attempts:
+                self._drop(message, e)
+            else:
+                # تلاش دوباره با فاصله نمایی
+                self.retried += 1
+                delay = min(self.retry_base * 2 ** message.attempts, 300)
+                self.loop.call_later(delay, self._requeue, message)
+        except Exception as e:
+            self._drop(message, e)
+        finally:
+            self._slots.release()
+
+    def _requeue(self, message, front=False):
+        with self._lock:
+            if front:
+                queue = self._queues.setdefault(message.bot_id, deque())
+                queue.appendleft(message)
+                self.queued += 1
+                if message.bot_id not in self._scheduled:
+                    self._scheduled.add(message.bot_id)
+                    heapq.heappush(self._ready, (time.monotonic(), message.bot_id))
+            else:
+                self._push(message)
+        self._wake.set()
+
+    def _drop(self, message, reason):
+        self.dropped += 1
+        if message.id is not None:
+            self._done.append(message.id)
+        logging.warning(f"Dropped message to chat {message.chat_id} of bot {message.bot_id}: {reason}")
+
+    def _flush_done(self):
+        done, self._done = self._done, []
+        if done:
+            database.outbox_delete(done)
+
+    async def _persist_loop(self):
+        # حذف دسته‌ای پیام‌های ارسال‌شده، تمدید lease و برداشتن پیام‌های پروسه‌های از کار افتاده
+        loop = asyncio.get_running_loop()
+        interval = min(1.0, self.lease / 3)
+        last_renew = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            if self._done:
+                done, self._done = self._done, []
+                try:
+                    await loop.run_in_executor(None, database.outbox_delete, done)
+                except Exception as e:
+                    self._done.extend(done)
+                    logging.error(f"Error deleting sent messages: {e}")
+            if time.monotonic() - last_renew >= self.lease / 3:
+                last_renew = time.monotonic()
+                try:
+                    await loop.run_in_executor(None, database.outbox_renew, self.owner, time.time() + self.lease)
+                    if await loop.run_in_executor(None, self._claim):
+                        self._wake.set()
+                except Exception as e:
+                    logging.error(f"Error renewing outbox lease: {e}")
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "claimed": self.claimed,
+            "bots": len(self._queues)
+        }
@@ -0,0 +1,100 @@
+import logging
+import numpy as np
+
+# قوانین تولید: (دسته، کلمه کلیدی، تولید پایه، [(پسوند، تولید)])
+# ترتیب پسوندها مهم است؛ اولین پسوند منطبق انتخاب می‌شود
+PRODUCTION_RULES = [
+    ("factory", "کارخانه", 50, [("پیشرفته", 100), ("حرفه ای", 150)]),
+    ("mine", "معدن", 30, [("حرفه ای", 60), ("پیشرفته", 90)]),
+    ("power_plant", "نیروگاه", 40, [("پیشرفته", 80), ("حرفه ای", 120), ("هسته ای", 200)]),
+    ("oil", "نفت کش", 25, [("حرفه ای", 50)])
+]
+
+# سازه‌های خدماتی که تولید ندارند (ناشناخته حساب نمی‌شوند)
+SERVICE_BUILDINGS = ["بیمارستان", "زایشگاه", "پارک"]
+
+KNOWN_BUILDINGS = [
+    "کارخانه ساده", "کارخانه معمولی", "کارخانه پیشرفته", "کارخانه پستونک سازی", "کارخانه حرفه ای",
+    "معدن", "معدن حرفه ای", "معدن پیشرفته",
+    "نیروگاه هسته ای", "نیروگاه پیشرفته", "نیروگاه حرفه ای",
+    "نفت کش", "نفت کش حرفه ای"
+] + SERVICE_BUILDINGS
+
+def compile_building(name):
+    """دسته و تولید روزانه یک سازه بر اساس قوانین تولید"""
+    category = None
+    daily_yield = 0
+    for rule_category, keyword, base, modifiers in PRODUCTION_RULES:
+        if keyword in name:
+            category = category or rule_category
+            production = base
+            for modifier, modifier_yield in modifiers:
+                if modifier in name:
+                    production = modifier_yield
+                    break
+            daily_yield += production
+    if category is None and name in SERVICE_BUILDINGS:
+        category = "service"
+    return category, daily_yield
+
+class BuildingCatalog:
+    """جدول کامپایل‌شده تولید سازه‌ها"""
+
+    def __init__(self, names):
+        self.names = []
+        self.index = {}
+        self.categories = []
+        self.unknown = set()
+        yields = []
+        for name in names:
+            category, daily_yield = compile_building(name)
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            self.categories.append(category)
+            yields.append(daily_yield)
+        self.yields = np.array(yields, dtype=np.float64)
+        self._yield_by_name = dict(zip(self.names, yields))
+
+    def _report_unknown(self, name):
+        # هر سازه ناشناخته فقط یک بار گزارش می‌شود
+        if name not in self.unknown:
+            self.unknown.add(name)
+            logging.warning(f"Unknown building in production catalog: {name}")
+
+    def daily_yield(self, name):
+        """تولید روزانه یک سازه"""
+        daily_yield = self._yield_by_name.get(name)
+        if daily_yield is None:
+            category, daily_yield = compile_building(name)
+            if category is None:
+                self._report_unknown(name)
+            self._yield_by_name[name] = daily_yield
+        return daily_yield
+
+    def base_production(self, buildings):
+        """مجموع تولید پایه در یک پیمایش"""
+        return sum(count * self.daily_yield(name) for name, count in buildings.items())
+
+    def to_matrix(self, buildings_list):
+        """ماتریس تعداد سازه‌ها (هر سطر یک کاربر)"""
+        matrix = np.zeros((len(buildings_list), len(self.names)), dtype=np.float64)
+        extra = np.zeros(len(buildings_list), dtype=np.float64)
+        for row, buildings in enumerate(buildings_list):
+            for name, count in (buildings or {}).items():
+                i = self.index.get(name)
+                if i is not None:
+                    matrix[row, i] += count
+                else:
+                    # سازه خارج از جدول: تولید جداگانه محاسبه می‌شود
+                    extra[row] += count * self.daily_yield(name)
+        return matrix, extra
+
+    def production_batch(self, buildings_list, tech_levels, morales):
+        """تولید روزانه تعداد زیادی کاربر با یک ضرب ماتریسی"""
+        matrix, extra = self.to_matrix(buildings_list)
+        base = matrix @ self.yields + extra
+        tech_bonus = 1 + np.asarray(tech_levels, dtype=np.float64) * 0.1
+        morale_effect = np.asarray(morales, dtype=np.float64) / 100
+        return (base * tech_bonus * morale_effect).astype(np.int64)
+
+catalog = BuildingCatalog(KNOWN_BUILDINGS)
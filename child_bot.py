@@ -1,36 +1,57 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
-from database import add_user, get_user, update_user_resources, give_loan
+from async_db import adb, DatabaseBusy, DatabaseTimeout
+from keyboards import registry
+import metrics
 
 CHILD_BOT_TOKEN = "توکن_ربات_فرزند_اینجا"
 
+@metrics.handler("child")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = get_user(user_id)
+    try:
+        user = await adb.get_user(user_id)
+    except (DatabaseBusy, DatabaseTimeout):
+        await update.message.reply_text(registry.text("db_busy"))
+        return
     if not user:
-        await update.message.reply_text("شما عضو این ربات نیستید. با مالک ربات تماس بگیرید.")
+        await update.message.reply_text(registry.text("not_member"))
         return
-    keyboard = [
-        [InlineKeyboardButton("اطلاعات من", callback_data="info")],
-        [InlineKeyboardButton("درخواست وام", callback_data="loan")]
-    ]
-    await update.message.reply_text("پنل کاربر", reply_markup=InlineKeyboardMarkup(keyboard))
+    await registry.reply(update.message, "user_panel")
 
+@metrics.handler("child")
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
     data = query.data
 
-    if data == "info":
-        user = get_user(user_id)
-        await query.edit_message_text(f"کشور: {user[2]}\nمنابع: {user[3]}\nوام: {user[4]}")
-    elif data == "loan":
-        give_loan(user_id, 500)
-        await query.edit_message_text("وام ۵۰۰ واحدی به شما تعلق گرفت. لطفاً بازپرداخت را فراموش نکنید!")
+    # دسترسی به دیتابیس در executor جداگانه؛ event loop برای بقیه کاربران آزاد می‌ماند
+    try:
+        if data == "info":
+            user = await adb.get_user(user_id)
+            await query.edit_message_text(f"کشور: {user[2]}\nمنابع: {user[3]}\nوام: {user[4]}")
+        elif data == "loan":
+            await adb.give_loan(user_id, 500)
+            await query.edit_message_text(registry.text("loan_granted"))
+    except (DatabaseBusy, DatabaseTimeout):
+        await query.edit_message_text(registry.text("db_busy"))
+
+def is_start_command(update: Update):
+    return bool(update.message and update.message.text and update.message.text.startswith("/start"))
+
+def is_callback_query(update: Update):
+    return update.callback_query is not None
 
-app = ApplicationBuilder().token(CHILD_BOT_TOKEN).build()
-app.add_handler(CommandHandler("start", start))
-app.add_handler(CallbackQueryHandler(button_handler))
+# خط لوله مشترک هندلرها برای dispatcher وب‌هوک (اولین هندلر منطبق اجرا می‌شود)
+HANDLERS = [
+    (is_start_command, start),
+    (is_callback_query, button_handler)
+]
 
-app.run_polling()
+if __name__ == '__main__':
+    app = ApplicationBuilder().token(CHILD_BOT_TOKEN).build()
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CallbackQueryHandler(button_handler))
+    
+    app.run_polling()
@@ -8,3 +8,74 @@ OWNER_ID = int(os.getenv("OWNER_ID", 123456789))
 
 # وب هوک
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "https://your-app-name.onrender.com")
+
+# پیش‌بینی جنگ برای AI
+AI_PREDICTION_SAMPLES = int(os.getenv("AI_PREDICTION_SAMPLES", 2000))
+AI_MIN_WIN_CHANCE = float(os.getenv("AI_MIN_WIN_CHANCE", 0.4))
+
+# فاصله همگام‌سازی صف AI با دیتابیس (ثانیه)
+AI_SYNC_INTERVAL = int(os.getenv("AI_SYNC_INTERVAL", 300))
+
+# اجرای موازی تصمیم‌های AI
+AI_PARALLEL = os.getenv("AI_PARALLEL", "0") == "1"
+AI_WORKERS = int(os.getenv("AI_WORKERS", 4))
+AI_SEED = os.getenv("AI_SEED")
+
+# انتخاب هدف AI (بازه قدرت نسبت به مهاجم و فعالیت اخیر بر حسب روز)
+AI_TARGET_POWER_BAND = (0.5, 1.5)
+AI_TARGET_ACTIVE_DAYS = int(os.getenv("AI_TARGET_ACTIVE_DAYS", 0)) or None
+
+# tick اقتصادی سراسری (ثانیه) و بازه کاربران فعال (روز، 0 = همه)
+ECONOMY_TICK_SECONDS = int(os.getenv("ECONOMY_TICK_SECONDS", 3600))
+ECONOMY_ACTIVE_DAYS = int(os.getenv("ECONOMY_ACTIVE_DAYS", 7))
+
+# نوشتن گروهی دیتابیس: immediate یا grouped (حداکثر از دست رفتن = یک بازه flush)
+DB_DURABILITY = os.getenv("DB_DURABILITY", "immediate")
+DB_FLUSH_INTERVAL_MS = int(os.getenv("DB_FLUSH_INTERVAL_MS", 50))
+DB_FLUSH_MAX_OPS = int(os.getenv("DB_FLUSH_MAX_OPS", 500))
+
+# صف وب‌هوک ربات‌های فرزند
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 16))
+BOT_QUEUE_SIZE = int(os.getenv("BOT_QUEUE_SIZE", 100))
+GLOBAL_QUEUE_SIZE = int(os.getenv("GLOBAL_QUEUE_SIZE", 10000))
+
+# نگهداری ربات‌های فرزند در حافظه (حداکثر تعداد و زمان بیکاری بر حسب ثانیه)
+BOT_CACHE_SIZE = int(os.getenv("BOT_CACHE_SIZE", 1000))
+BOT_IDLE_SECONDS = int(os.getenv("BOT_IDLE_SECONDS", 1800))
+# کش منفی توکن‌های ناشناخته یا غیرفعال (ثانیه)؛ هر update آن‌ها یک کوئری دیتابیس نمی‌گیرد
+BOT_NEGATIVE_TTL = int(os.getenv("BOT_NEGATIVE_TTL", 30))
+
+# کش وضعیت بازیکن (تعداد و زمان اعتبار بر حسب ثانیه)
+PLAYER_CACHE_SIZE = int(os.getenv("PLAYER_CACHE_SIZE", 10000))
+PLAYER_CACHE_TTL = int(os.getenv("PLAYER_CACHE_TTL", 30))
+
+# آدرس Bot API تلگرام (برای بنچمارک با یک API محلی قابل تغییر است)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+# پورت محلی /metrics ربات مادر (0 = غیرفعال)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# پروفایلر اختیاری (cprofile = فایل pstats، sampler = فایل collapsed برای flame graph)
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.05))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_FLUSH_EVERY = int(os.getenv("PROFILE_FLUSH_EVERY", 50))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 20))
+PROFILE_MAX_MB = int(os.getenv("PROFILE_MAX_MB", 50))
+# طول هر پنجره پروفایل event loop وب‌هوک (ثانیه)
+PROFILE_LOOP_WINDOW = float(os.getenv("PROFILE_LOOP_WINDOW", 1.0))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+
+# دسترسی async هندلرها به دیتابیس (تعداد thread، سقف صف و timeout بر حسب ثانیه)
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", 4))
+DB_MAX_PENDING = int(os.getenv("DB_MAX_PENDING", 200))
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", 5))
+
+# صف ارسال پیام (پیام در ثانیه برای هر ربات و کل سرور، تعداد ارسال همزمان، تلاش مجدد و مدت lease پیام‌های هر پروسه)
+BROADCAST_BOT_RATE = float(os.getenv("BROADCAST_BOT_RATE", 25))
+BROADCAST_BOT_BURST = int(os.getenv("BROADCAST_BOT_BURST", 30))
+BROADCAST_GLOBAL_RATE = float(os.getenv("BROADCAST_GLOBAL_RATE", 100))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 16))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", 5))
+BROADCAST_LEASE_SECONDS = float(os.getenv("BROADCAST_LEASE_SECONDS", 60))
@@ -1,84 +1,631 @@
 import sqlite3
 from pathlib import Path
+import threading
+import atexit
+import time
 import json
+import config
+import metrics
+from player_cache import PlayerCache
 
 DB_PATH = Path("game.db")
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-c = conn.cursor()
-
-# جدول کاربران
-c.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    username TEXT,
-    country TEXT,
-    resources INTEGER DEFAULT 1000,
-    loan INTEGER DEFAULT 0,
-    units TEXT DEFAULT '{}'
-)
-""")
-
-# جدول ربات‌ها
-c.execute("""
-CREATE TABLE IF NOT EXISTS bots (
-    bot_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    bot_token TEXT,
-    owner_id INTEGER,
-    created_at TEXT,
-    status TEXT
-)
-""")
-
-# جدول AI
-c.execute("""
-CREATE TABLE IF NOT EXISTS ai (
-    ai_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    country TEXT,
-    personality TEXT,
-    strategy_state TEXT,
-    last_action TEXT
-)
-""")
-
-# جدول جنگ‌ها
-c.execute("""
-CREATE TABLE IF NOT EXISTS battles (
-    battle_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    attacker_id INTEGER,
-    defender_id INTEGER,
-    units_used TEXT,
-    result TEXT,
-    timestamp TEXT
-)
-""")
-
-conn.commit()
+
+# تنظیمات اتصال: WAL برای خواندن همزمان با نوشتن، انتظار به جای خطای قفل
+BUSY_TIMEOUT_MS = 5000
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",   # در WAL امن است و fsync را فقط در checkpoint انجام می‌دهد
+    "cache_size": -20000,      # حدود 20MB کش صفحه برای هر اتصال
+    "mmap_size": 268435456,    # 256MB
+    "temp_store": "MEMORY",
+    "busy_timeout": BUSY_TIMEOUT_MS
+}
+
+class ConnectionPool:
+    """یک اتصال sqlite برای هر thread (بدون اشتراک cursor بین threadها)"""
+    def __init__(self, path, pragmas=None):
+        self.path = path
+        self.pragmas = pragmas or {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+    
+    def _connect(self):
+        # اتصال با شمارش تعداد و زمان کوئری‌ها برای /metrics
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000,
+                               factory=metrics.InstrumentedConnection)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+    
+    def get(self):
+        """اتصال thread فعلی (در اولین استفاده ساخته می‌شود)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+    
+    def close_all(self):
+        """بستن همه اتصال‌ها (هنگام خاموش شدن)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # اتصال متعلق به thread دیگری است؛ با پایان پروسه بسته می‌شود
+                pass
+        self._local = threading.local()
+
+pool = ConnectionPool(DB_PATH, PRAGMAS)
+
+def get_connection():
+    return pool.get()
+
+def init_db():
+    """ساخت جدول‌ها"""
+    conn = get_connection()
+    
+    # جدول کاربران
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        country TEXT,
+        resources INTEGER DEFAULT 1000,
+        loan INTEGER DEFAULT 0,
+        units TEXT DEFAULT '{}'
+    )
+    """)
+    
+    # جدول ربات‌ها
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bots (
+        bot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bot_token TEXT,
+        owner_id INTEGER,
+        created_at TEXT,
+        status TEXT
+    )
+    """)
+    
+    # جدول AI
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ai (
+        ai_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        country TEXT,
+        personality TEXT,
+        strategy_state TEXT,
+        last_action TEXT
+    )
+    """)
+    
+    # جدول جنگ‌ها
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS battles (
+        battle_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        attacker_id INTEGER,
+        defender_id INTEGER,
+        units_used TEXT,
+        result TEXT,
+        timestamp TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_battles_attacker_time ON battles (attacker_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_battles_defender_time ON battles (defender_id, timestamp)")
+    
+    # دیکشنری واحدها: هر (نوع، نام) یک id ثابت می‌گیرد
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS unit_ids (
+        unit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        unit_type TEXT NOT NULL,
+        unit_name TEXT NOT NULL,
+        UNIQUE (unit_type, unit_name)
+    )
+    """)
+    
+    # موجودی نیروها: یک سطر برای هر مالک و واحد (کلید اصلی = ایندکس مالک)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS unit_inventory (
+        owner_type TEXT NOT NULL DEFAULT 'user',
+        owner_id INTEGER NOT NULL,
+        unit_id INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (owner_type, owner_id, unit_id)
+    ) WITHOUT ROWID
+    """)
+    
+    # صف پیام‌های خروجی (تا ارسال موفق باقی می‌ماند)؛ هر سطر تا پایان lease متعلق به یک پروسه است
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bot_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        owner TEXT,
+        lease_until REAL
+    )
+    """)
+    outbox_columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+    if "owner" not in outbox_columns:
+        conn.execute("ALTER TABLE outbox ADD COLUMN owner TEXT")
+        conn.execute("ALTER TABLE outbox ADD COLUMN lease_until REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_owner ON outbox (owner, lease_until)")
+    
+    conn.commit()
+    
+    if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+        migrate_units_to_inventory(conn)
+
+# --- موجودی نیروها ---
+_unit_ids = {}
+_unit_keys = {}
+_unit_lock = threading.Lock()
+
+# کش فقط id های commit‌شده را نگه می‌دارد؛ id ثبت‌شده در تراکنشی که rollback شود دوباره استفاده می‌شود
+def _load_unit_ids(conn):
+    rows = conn.execute("SELECT unit_id, unit_type, unit_name FROM unit_ids").fetchall()
+    with _unit_lock:
+        for unit_id, unit_type, unit_name in rows:
+            _unit_ids[(unit_type, unit_name)] = unit_id
+            _unit_keys[unit_id] = (unit_type, unit_name)
+
+def register_units(conn, units_dicts):
+    """ثبت واحدهای جدید در تراکنش جداگانه، قبل از تراکنش اصلی فراخواننده"""
+    missing = {(unit_type, unit_name)
+               for units in units_dicts if units
+               for unit_type, unit_dict in units.items()
+               for unit_name in unit_dict
+               if (unit_type, unit_name) not in _unit_ids}
+    if not missing or conn.in_transaction:
+        return
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO unit_ids (unit_type, unit_name) VALUES (?, ?)", sorted(missing))
+    _load_unit_ids(conn)
+
+def get_unit_id(conn, unit_type, unit_name):
+    """id ثابت یک واحد (واحد ثبت‌نشده در تراکنش جاری ثبت و کش نمی‌شود)"""
+    unit_id = _unit_ids.get((unit_type, unit_name))
+    if unit_id is None:
+        conn.execute("INSERT OR IGNORE INTO unit_ids (unit_type, unit_name) VALUES (?, ?)", (unit_type, unit_name))
+        unit_id = conn.execute("SELECT unit_id FROM unit_ids WHERE unit_type=? AND unit_name=?",
+                               (unit_type, unit_name)).fetchone()[0]
+    return unit_id
+
+def get_unit_key(conn, unit_id):
+    """(نوع، نام) یک id"""
+    key = _unit_keys.get(unit_id)
+    if key is not None:
+        return key
+    if not conn.in_transaction:
+        _load_unit_ids(conn)
+        return _unit_keys[unit_id]
+    return tuple(conn.execute("SELECT unit_type, unit_name FROM unit_ids WHERE unit_id=?", (unit_id,)).fetchone())
+
+def _unit_rows(conn, owner_type, owner_id, units_dict):
+    # تبدیل دیکشنری تو در تو به سطرهای (مالک، id واحد، تعداد)
+    return [(owner_type, owner_id, get_unit_id(conn, unit_type, unit_name), count)
+            for unit_type, unit_dict in units_dict.items()
+            for unit_name, count in unit_dict.items()]
+
+def _replace_inventory(conn, owner_id, units_dict, owner_type="user"):
+    # واحدهای با تعداد صفر سطری ندارند
+    conn.execute("DELETE FROM unit_inventory WHERE owner_type=? AND owner_id=?", (owner_type, owner_id))
+    conn.executemany("INSERT INTO unit_inventory (owner_type, owner_id, unit_id, count) VALUES (?, ?, ?, ?)",
+                     [row for row in _unit_rows(conn, owner_type, owner_id, units_dict) if row[3] > 0])
+
+def _subtract_inventory(conn, rows):
+    # کم کردن تعدادها (count، نوع مالک، id مالک، id واحد) و حذف سطرهایی که به صفر رسیده‌اند
+    conn.executemany(
+        "UPDATE unit_inventory SET count = count - ? WHERE owner_type=? AND owner_id=? AND unit_id=?",
+        rows
+    )
+    conn.executemany(
+        "DELETE FROM unit_inventory WHERE count <= 0 AND owner_type=? AND owner_id=? AND unit_id=?",
+        [row[1:] for row in rows]
+    )
+
+def migrate_units_to_inventory(conn=None, batch_size=1000):
+    """انتقال ستون JSON قدیمی users.units به جدول موجودی (یک بار)"""
+    conn = conn or get_connection()
+    migrated = 0
+    last_id = None
+    with conn:
+        while True:
+            rows = conn.execute(
+                "SELECT user_id, units FROM users WHERE units IS NOT NULL AND units != '{}' "
+                "AND (? IS NULL OR user_id > ?) ORDER BY user_id LIMIT ?",
+                (last_id, last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            for user_id, units_json in rows:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO unit_inventory (owner_type, owner_id, unit_id, count) VALUES (?, ?, ?, ?)",
+                    [row for row in _unit_rows(conn, "user", user_id, json.loads(units_json)) if row[3] > 0]
+                )
+            migrated += len(rows)
+            last_id = rows[-1][0]
+        conn.execute("PRAGMA user_version = 1")
+    return migrated
+
+init_db()
+
+class WriteBehindBuffer:
+    """بافر نوشتن گروهی: ادغام تغییرات هر کاربر و ثبت در یک تراکنش"""
+    def __init__(self, flush_interval_ms, max_ops):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_ops = max_ops
+        self._pending = {}  # user_id -> {"resources": ..., "loan": ..., "units": dict}
+        self._inflight = {}  # تغییرات در حال commit
+        self._version = 0  # با هر commit زیاد می‌شود
+        self._ops = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.stats = {
+            "ops": 0,
+            "batches": 0,
+            "rows": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0
+        }
+    
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+    
+    def add(self, user_id, resources=0, loan=0, units=None):
+        """ثبت یک تغییر (تغییرات یک کاربر با هم جمع می‌شوند)"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("write-behind buffer is closed")
+            self._start()
+            entry = self._pending.setdefault(user_id, {"resources": 0, "loan": 0, "units": None})
+            entry["resources"] += resources
+            entry["loan"] += loan
+            if units is not None:
+                entry["units"] = units
+            self._count_op()
+    
+    def _count_op(self):
+        # با قفل _cond صدا زده می‌شود
+        self._ops += 1
+        self.stats["ops"] += 1
+        if self._ops >= self.max_ops:
+            self._cond.notify()
+    
+    def modify_units(self, user_id, change):
+        """اعمال change روی نیروهای ثبت‌نشده یک کاربر؛ اگر set_units گروهی در صف نباشد False برمی‌گردد
+
+        وقتی جایگزینی نیروها در صف یا در حال commit است، نوشتن فوری در دیتابیس با flush بعدی
+        بازنویسی می‌شود؛ پس تغییر روی همان نسخه صف اعمال می‌شود.
+        """
+        with self._cond:
+            units = None
+            for entries in (self._pending, self._inflight):
+                entry = entries.get(user_id)
+                if entry and entry["units"] is not None:
+                    units = entry["units"]
+                    break
+            if units is None:
+                return False
+            # نسخه در حال commit یا دیکشنری فراخواننده set_units تغییر نمی‌کند
+            units = json.loads(json.dumps(units))
+            change(units)
+            entry = self._pending.setdefault(user_id, {"resources": 0, "loan": 0, "units": None})
+            entry["units"] = units
+            self._count_op()
+            return True
+    
+    def pending_for(self, user_id):
+        """تغییرات ثبت‌نشده یک کاربر (برای خواندن سازگار)"""
+        return self._pending_for(user_id)[1]
+    
+    def read(self, user_id, loader):
+        """سطر loader و تغییرات ثبت‌نشده یک کاربر از یک نسخه (commit بین دو خواندن باعث تکرار می‌شود)"""
+        while True:
+            with self._cond:
+                version = self._version
+            row = loader()
+            current, pending = self._pending_for(user_id)
+            if current == version:
+                return row, pending
+    
+    def _pending_for(self, user_id):
+        with self._cond:
+            version = self._version
+            entries = [e for e in (self._inflight.get(user_id), self._pending.get(user_id)) if e]
+        if not entries:
+            return version, None
+        merged = {"resources": 0, "loan": 0, "units": None}
+        for entry in entries:
+            merged["resources"] += entry["resources"]
+            merged["loan"] += entry["loan"]
+            if entry["units"] is not None:
+                merged["units"] = entry["units"]
+        return version, merged
+    
+    def flush(self):
+        """ثبت همه تغییرات در یک تراکنش"""
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                self._inflight = pending
+                self._ops = 0
+            if not pending:
+                return 0
+            
+            started = time.perf_counter()
+            deltas = [(e["resources"], e["loan"], user_id) for user_id, e in pending.items()
+                      if e["resources"] or e["loan"]]
+            units = [(user_id, e["units"]) for user_id, e in pending.items() if e["units"] is not None]
+            conn = get_connection()
+            try:
+                register_units(conn, [units_dict for _, units_dict in units])
+                with conn:
+                    if deltas:
+                        conn.executemany("UPDATE users SET resources = resources + ?, loan = loan + ? WHERE user_id=?", deltas)
+                    for user_id, units_dict in units:
+                        _replace_inventory(conn, user_id, units_dict)
+                    # commit، پاک کردن کش و تغییرات در حال commit زیر یک قفل تا خواننده‌ها سطر جدید را
+                    # همراه تغییرات قدیمی (یا سطر قدیمی را بدون آن‌ها) نبینند
+                    with self._cond:
+                        conn.commit()
+                        for user_id in pending:
+                            player_cache.invalidate(_cache_key(user_id))
+                        self._inflight = {}
+                        self._version += 1
+            except Exception:
+                # برگرداندن تغییرات به صف تا در flush بعدی دوباره تلاش شود
+                with self._cond:
+                    for user_id, entry in pending.items():
+                        current = self._pending.get(user_id)
+                        if current:
+                            entry["resources"] += current["resources"]
+                            entry["loan"] += current["loan"]
+                            if current["units"] is not None:
+                                entry["units"] = current["units"]
+                        self._pending[user_id] = entry
+                    self._inflight = {}
+                raise
+            
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._cond:
+                self.stats["batches"] += 1
+                self.stats["rows"] += len(pending)
+                self.stats["last_batch_size"] = len(pending)
+                self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(pending))
+                self.stats["last_flush_ms"] = elapsed_ms
+                self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
+                self.stats["total_flush_ms"] += elapsed_ms
+            return len(pending)
+    
+    def _loop(self):
+        while True:
+            with self._cond:
+                if not self._closed and self._ops < self.max_ops:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing write-behind buffer: {e}")
+            if closed:
+                return
+    
+    def close(self):
+        """ثبت تغییرات باقی‌مانده و توقف (هنگام خاموش شدن)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread:
+            thread.join()
+        else:
+            self.flush()
+
+# کش سطرهای کاربران؛ دیتابیس sqlite مخصوص یک ربات است پس bot_id در کلید None است
+player_cache = PlayerCache(config.PLAYER_CACHE_SIZE, config.PLAYER_CACHE_TTL)
+
+def _cache_key(user_id):
+    return (None, user_id)
+
+write_buffer = WriteBehindBuffer(config.DB_FLUSH_INTERVAL_MS, config.DB_FLUSH_MAX_OPS)
+atexit.register(write_buffer.close)
+
+def _is_grouped(durability):
+    return (durability or config.DB_DURABILITY) == "grouped"
+
+def _apply_pending(row, pending):
+    # اعمال تغییرات ثبت‌نشده روی سطر خوانده‌شده
+    if not row or not pending:
+        return row
+    row = list(row)
+    row[3] += pending["resources"]
+    row[4] += pending["loan"]
+    return tuple(row)
 
 # --- توابع عمومی ---
 def add_user(user_id, username, country):
-    c.execute("INSERT OR IGNORE INTO users (user_id, username, country) VALUES (?, ?, ?)",
-              (user_id, username, country))
-    conn.commit()
+    conn = get_connection()
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO users (user_id, username, country) VALUES (?, ?, ?)",
+                     (user_id, username, country))
+    player_cache.invalidate(_cache_key(user_id))
 
 def get_user(user_id):
-    c.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    return c.fetchone()
+    """(user_id, username, country, resources, loan)؛ نیروها با get_units خوانده می‌شوند"""
+    row, pending = write_buffer.read(user_id, lambda: player_cache.get(
+        _cache_key(user_id),
+        lambda: get_connection().execute(
+            "SELECT user_id, username, country, resources, loan FROM users WHERE user_id=?", (user_id,)
+        ).fetchone()
+    ))
+    return _apply_pending(row, pending)
 
-def update_user_resources(user_id, amount):
-    c.execute("UPDATE users SET resources = resources + ? WHERE user_id=?", (amount, user_id))
-    conn.commit()
+# durability: "immediate" (commit فوری) یا "grouped" (ثبت گروهی با پنجره از دست رفتن محدود)
+def update_user_resources(user_id, amount, durability=None):
+    if _is_grouped(durability):
+        write_buffer.add(user_id, resources=amount)
+        return
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE users SET resources = resources + ? WHERE user_id=?", (amount, user_id))
+    player_cache.invalidate(_cache_key(user_id))
 
-def give_loan(user_id, loan_amount):
-    c.execute("UPDATE users SET resources = resources + ?, loan = loan + ? WHERE user_id=?",
-              (loan_amount, loan_amount, user_id))
-    conn.commit()
+def give_loan(user_id, loan_amount, durability=None):
+    if _is_grouped(durability):
+        write_buffer.add(user_id, resources=loan_amount, loan=loan_amount)
+        return
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE users SET resources = resources + ?, loan = loan + ? WHERE user_id=?",
+                     (loan_amount, loan_amount, user_id))
+    player_cache.invalidate(_cache_key(user_id))
 
-def set_units(user_id, units_dict):
-    units_json = json.dumps(units_dict)
-    c.execute("UPDATE users SET units=? WHERE user_id=?", (units_json, user_id))
-    conn.commit()
+# ستون users.units فقط برای مهاجرت نگه داشته شده؛ نیروها در unit_inventory هستند
+def set_units(user_id, units_dict, durability=None):
+    if _is_grouped(durability):
+        write_buffer.add(user_id, units=units_dict)
+        return
+    if _route_units("user", user_id, lambda units: _assign_units(units, units_dict)):
+        write_buffer.flush()
+        return
+    conn = get_connection()
+    register_units(conn, [units_dict])
+    with conn:
+        _replace_inventory(conn, user_id, units_dict)
+    player_cache.invalidate(_cache_key(user_id))
+
+def _empty_units():
+    # همه گروه‌های تعریف‌شده در کانفیگ، حتی بدون واحد (مثل {"air": {}} در ستون JSON قدیمی)
+    return {unit_type: {} for unit_type in config.Config.UNITS}
+
+def get_units(user_id, owner_type="user"):
+    """نیروهای یک مالک؛ گروه‌های کانفیگ همیشه حاضرند و واحدهای با تعداد صفر حذف شده‌اند"""
+    if owner_type == "user":
+        pending = write_buffer.pending_for(user_id)
+        if pending and pending["units"] is not None:
+            units = _empty_units()
+            for unit_type, unit_dict in pending["units"].items():
+                units.setdefault(unit_type, {}).update(
+                    (unit_name, count) for unit_name, count in unit_dict.items() if count > 0
+                )
+            return units
+    conn = get_connection()
+    units = _empty_units()
+    for unit_id, count in conn.execute(
+            "SELECT unit_id, count FROM unit_inventory WHERE owner_type=? AND owner_id=?",
+            (owner_type, user_id)):
+        unit_type, unit_name = get_unit_key(conn, unit_id)
+        units.setdefault(unit_type, {})[unit_name] = count
+    return units
+
+def _assign_units(units, units_dict):
+    units.clear()
+    units.update(json.loads(json.dumps(units_dict)))
+
+def _merge_units(units, units_dict, sign):
+    # همان نتیجه add_units/remove_units روی دیکشنری نیروها (تعداد منفی نمی‌شود)
+    for unit_type, unit_dict in units_dict.items():
+        for unit_name, count in unit_dict.items():
+            if sign > 0:
+                group = units.setdefault(unit_type, {})
+                group[unit_name] = group.get(unit_name, 0) + count
+            elif unit_name in units.get(unit_type, {}):
+                units[unit_type][unit_name] -= count
+                if units[unit_type][unit_name] <= 0:
+                    del units[unit_type][unit_name]
+
+def _route_units(owner_type, user_id, change):
+    # با set_units گروهی در صف، نوشتن فوری با flush بعدی بازنویسی می‌شد؛ تغییر از خود صف می‌گذرد
+    return owner_type == "user" and write_buffer.modify_units(user_id, change)
+
+def add_units(user_id, units_dict, owner_type="user"):
+    """افزایش اتمی تعداد واحدها (ساخت نیرو)"""
+    if _route_units(owner_type, user_id, lambda units: _merge_units(units, units_dict, 1)):
+        write_buffer.flush()
+        return
+    conn = get_connection()
+    register_units(conn, [units_dict])
+    with conn:
+        conn.executemany(
+            "INSERT INTO unit_inventory (owner_type, owner_id, unit_id, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (owner_type, owner_id, unit_id) DO UPDATE SET count = count + excluded.count",
+            _unit_rows(conn, owner_type, user_id, units_dict)
+        )
+
+def remove_units(user_id, units_dict, owner_type="user"):
+    """کاهش اتمی تعداد واحدها (تلفات جنگ) با یک executemany"""
+    if _route_units(owner_type, user_id, lambda units: _merge_units(units, units_dict, -1)):
+        write_buffer.flush()
+        return
+    conn = get_connection()
+    register_units(conn, [units_dict])
+    with conn:
+        _subtract_inventory(conn, [(count, owner, owner_id, unit_id) for owner, owner_id, unit_id, count
+                                   in _unit_rows(conn, owner_type, user_id, units_dict)])
+
+def apply_battle_losses(attacker_id, attacker_losses, defender_id, defender_losses,
+                        attacker_type="user", defender_type="user"):
+    """اعمال تلفات هر دو طرف جنگ در یک تراکنش (طرفی که set_units گروهی در صف دارد از صف)"""
+    sides = [(owner_type, owner_id, losses) for owner_type, owner_id, losses in
+             ((attacker_type, attacker_id, attacker_losses), (defender_type, defender_id, defender_losses))
+             if not _route_units(owner_type, owner_id, lambda units, losses=losses: _merge_units(units, losses, -1))]
+    conn = get_connection()
+    register_units(conn, [losses for _, _, losses in sides])
+    rows = [(count, row_type, row_id, unit_id)
+            for owner_type, owner_id, losses in sides
+            for row_type, row_id, unit_id, count in _unit_rows(conn, owner_type, owner_id, losses)]
+    with conn:
+        _subtract_inventory(conn, rows)
+    if len(sides) < 2:
+        write_buffer.flush()
+
+def outbox_save(new_messages, updated_texts=(), owner=None, lease_until=None):
+    """ثبت پیام‌های جدید (متعلق به owner) و متن پیام‌های ادغام‌شده در یک تراکنش؛ id پیام‌های جدید برمی‌گردد"""
+    conn = get_connection()
+    with conn:
+        ids = [conn.execute("INSERT INTO outbox (bot_id, chat_id, text, owner, lease_until) VALUES (?, ?, ?, ?, ?)",
+                            (*message, owner, lease_until)).lastrowid
+               for message in new_messages]
+        conn.executemany("UPDATE outbox SET text=? WHERE id=?", updated_texts)
+    return ids
+
+def outbox_delete(ids):
+    conn = get_connection()
+    with conn:
+        conn.executemany("DELETE FROM outbox WHERE id=?", [(message_id,) for message_id in ids])
+
+def outbox_claim(owner, lease_until, now):
+    """برداشتن پیام‌های بی‌صاحب یا با lease منقضی؛ فقط سطرهای تازه برداشته‌شده برمی‌گردند"""
+    conn = get_connection()
+    with conn:
+        rows = conn.execute(
+            "UPDATE outbox SET owner=?, lease_until=? WHERE owner IS NULL OR lease_until < ? "
+            "RETURNING id, bot_id, chat_id, text",
+            (owner, lease_until, now)
+        ).fetchall()
+    return sorted(rows)
+
+def outbox_renew(owner, lease_until):
+    """تمدید lease همه پیام‌های یک پروسه"""
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE outbox SET lease_until=? WHERE owner=?", (lease_until, owner))
 
-def get_units(user_id):
-    c.execute("SELECT units FROM users WHERE user_id=?", (user_id,))
-    result = c.fetchone()
-    return json.loads(result[0]) if result and result[0] else {}
+def outbox_release(owner):
+    """رها کردن پیام‌های ارسال‌نشده (هنگام خاموش شدن) تا پروسه دیگری فوراً آن‌ها را بردارد"""
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE outbox SET owner=NULL, lease_until=NULL WHERE owner=?", (owner,))
@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque, OrderedDict
+from types import SimpleNamespace
+from telegram import Bot, Update
+from telegram.request import HTTPXRequest
+import child_bot
+import config
+from profiler import profile
+
+class BotState:
+    """وضعیت هر ربات فرزند (بدون thread و Application جداگانه)"""
+
+    def __init__(self, bot_id, token, owner_id, request):
+        self.bot_id = bot_id
+        self.token = token
+        self.owner_id = owner_id
+        # getUpdates هم از استخر مشترک استفاده می‌کند تا برای هر ربات کلاینت HTTP جداگانه ساخته نشود
+        self.bot = Bot(token, base_url=config.TELEGRAM_API_URL, request=request, get_updates_request=request)
+        self.bot_data = {}
+        self.user_data = {}
+        self.chat_data = {}
+        self.updates = 0
+        self.queue = deque()  # (زمان ورود، update)
+        self.last_used = time.monotonic()
+        self.evicted = False
+
+    def close(self):
+        """آزاد کردن وضعیت ربات (استخر HTTP مشترک است و بسته نمی‌شود)"""
+        self.bot_data.clear()
+        self.user_data.clear()
+        self.chat_data.clear()
+        self.bot = None
+
+    def context(self, update):
+        """context سبک مشابه ContextTypes.DEFAULT_TYPE برای هندلرها"""
+        user_id = update.effective_user.id if update.effective_user else None
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        return SimpleNamespace(
+            bot=self.bot,
+            bot_id=self.bot_id,
+            bot_data=self.bot_data,
+            user_data=self.user_data.setdefault(user_id, {}),
+            chat_data=self.chat_data.setdefault(chat_id, {})
+        )
+
+class WebhookDispatcher:
+    """توزیع‌کننده async وب‌هوک همه ربات‌های فرزند در یک event loop"""
+
+    def __init__(self, db_manager, handlers=None, connection_pool_size=64,
+                 workers=None, bot_queue_size=None, global_queue_size=None,
+                 max_bots=None, idle_timeout=None, negative_ttl=None):
+        self.db = db_manager
+        self.handlers = handlers or child_bot.HANDLERS
+        self.workers = workers or config.WEBHOOK_WORKERS
+        self.bot_queue_size = bot_queue_size or config.BOT_QUEUE_SIZE
+        self.global_queue_size = global_queue_size or config.GLOBAL_QUEUE_SIZE
+        # یک استخر اتصال HTTP مشترک برای همه ربات‌ها
+        self.request = HTTPXRequest(connection_pool_size=connection_pool_size)
+        # ربات‌ها در اولین update ساخته می‌شوند و در LRU محدود (تعداد و زمان بیکاری) نگه داشته می‌شوند
+        self.max_bots = max_bots or config.BOT_CACHE_SIZE
+        self.idle_timeout = idle_timeout or config.BOT_IDLE_SECONDS
+        self.bots = OrderedDict()  # token -> BotState (قدیمی‌ترین استفاده در ابتدا)
+        self.tokens = {}  # bot_id -> token
+        # توکن‌هایی که در دیتابیس نبودند یا غیرفعال بودند: token -> زمان انقضا (محدود به max_bots)
+        self.negative_ttl = config.BOT_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        self.unknown = OrderedDict()
+        self.negative_hits = 0
+        self.hydrations = 0
+        self.processed = 0
+        self.evictions = 0
+        self._sweeper = None
+        self._profiler = None
+        self._lock = threading.Lock()
+        self.loop = None
+        self._thread = None
+        self.errors = 0
+
+        # صف‌های هر ربات + حلقه نوبت‌دهی ربات‌های آماده (هر ربات حداکثر یک بار در حلقه)
+        self._queue_lock = threading.Lock()
+        self._ring = deque()
+        self._scheduled = set()
+        self._ready = None
+        self._worker_tasks = []
+        self.queued = 0
+        self.rejected = 0
+        self.wait_last = 0.0
+        self.wait_max = 0.0
+        self.wait_avg = 0.0
+
+    def start(self):
+        """اجرای event loop در یک thread ثابت"""
+        if self._thread:
+            return
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_workers(), self.loop).result()
+
+    async def _start_workers(self):
+        self._ready = asyncio.Semaphore(0)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._sweeper = asyncio.create_task(self._sweep_idle())
+        self._profiler = asyncio.create_task(self._profile_windows())
+
+    def stop(self):
+        """توقف event loop"""
+        if not self.loop:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
+        self._thread = None
+
+    def register(self, bot_id, token, owner_id=None):
+        """ساخت (hydrate) یک ربات فرزند"""
+        with self._lock:
+            return self._hydrate(bot_id, token, owner_id)
+
+    def _hydrate(self, bot_id, token, owner_id):
+        # باید با self._lock فراخوانی شود
+        self.unknown.pop(token, None)
+        state = self.bots.get(token)
+        if state is None:
+            state = BotState(bot_id, token, owner_id, self.request)
+            self.bots[token] = state
+            self.tokens[bot_id] = token
+            self.hydrations += 1
+            self._evict_over_capacity()
+        return state
+
+    def _try_evict(self, state):
+        # باید با self._lock فراخوانی شود؛ ربات‌های دارای update در صف حذف نمی‌شوند
+        with self._queue_lock:
+            if state.token in self._scheduled or state.queue:
+                return False
+            state.evicted = True
+        del self.bots[state.token]
+        self.tokens.pop(state.bot_id, None)
+        state.close()
+        self.evictions += 1
+        return True
+
+    def _evict_over_capacity(self):
+        # حذف کم‌استفاده‌ترین ربات‌های بیکار تا رسیدن به سقف
+        for state in list(self.bots.values()):
+            if len(self.bots) <= self.max_bots:
+                return
+            self._try_evict(state)
+
+    def evict_idle(self):
+        """حذف ربات‌هایی که بیش از idle_timeout استفاده نشده‌اند"""
+        cutoff = time.monotonic() - self.idle_timeout
+        evicted = 0
+        with self._lock:
+            for state in list(self.bots.values()):
+                if state.last_used > cutoff:
+                    break  # بقیه جدیدتر هستند
+                if self._try_evict(state):
+                    evicted += 1
+        return evicted
+
+    async def _sweep_idle(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 60))
+            evicted = self.evict_idle()
+            if evicted:
+                logging.info(f"Evicted {evicted} idle child bots")
+
+    async def _profile_windows(self):
+        """پروفایل پنجره‌های کامل event loop (همه task ها)؛ هر پنجره با احتمال sample_rate"""
+        # پروفایل دور یک await کار task های دیگر همین loop را هم می‌شمارد، پس واحد نمونه یک پنجره است
+        while True:
+            with profile("webhook_loop"):
+                await asyncio.sleep(config.PROFILE_LOOP_WINDOW)
+
+    def resolve(self, token):
+        """پیدا کردن ربات فرزند از روی توکن (در صورت نبود، از دیتابیس ساخته می‌شود)"""
+        now = time.monotonic()
+        with self._lock:
+            state = self.bots.get(token)
+            if state is not None:
+                state.last_used = now
+                self.bots.move_to_end(token)
+                return state
+            expires_at = self.unknown.get(token)
+            if expires_at is not None:
+                if expires_at > now:
+                    self.negative_hits += 1
+                    return None
+                del self.unknown[token]
+
+        session = self.db.get_session()
+        try:
+            from models import ChildBot
+            bot = session.query(ChildBot).filter(ChildBot.bot_token == token).first()
+            if not bot or bot.status != 'active':
+                self._remember_unknown(token)
+                return None
+            return self.register(bot.id, bot.bot_token, bot.owner_id)
+        finally:
+            session.close()
+
+    def _remember_unknown(self, token):
+        # ربات فعال‌شده حداکثر پس از negative_ttl ثانیه (یا با register) دوباره پیدا می‌شود
+        if self.negative_ttl <= 0:
+            return
+        with self._lock:
+            if token in self.bots:
+                return
+            self.unknown[token] = time.monotonic() + self.negative_ttl
+            self.unknown.move_to_end(token)
+            while len(self.unknown) > self.max_bots:
+                self.unknown.popitem(last=False)
+
+    async def _shutdown(self):
+        tasks = self._worker_tasks + [self._sweeper, self._profiler]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._sweeper = None
+        self._profiler = None
+        await self.request.shutdown()
+
+    def submit(self, state, data):
+        """قرار دادن update در صف ربات؛ None یعنی پذیرفته شد، در غیر این صورت کد HTTP"""
+        # بررسی حذف، ساخت دوباره و افزودن به صف در یک بخش بحرانی (حذف هم هر دو قفل را می‌گیرد)
+        with self._lock:
+            if state.evicted:
+                # ربات بین resolve و submit حذف شده؛ دوباره ساخته می‌شود
+                state = self._hydrate(state.bot_id, state.token, state.owner_id)
+
+            with self._queue_lock:
+                if self.queued >= self.global_queue_size:
+                    self.rejected += 1
+                    return 503
+                if len(state.queue) >= self.bot_queue_size:
+                    self.rejected += 1
+                    return 429
+                state.queue.append((time.monotonic(), data))
+                self.queued += 1
+                wake = state.token not in self._scheduled
+                if wake:
+                    self._scheduled.add(state.token)
+                    self._ring.append(state)
+        if wake:
+            self.loop.call_soon_threadsafe(self._ready.release)
+        return None
+
+    async def _worker(self):
+        """برداشتن به نوبت از ربات‌های آماده (هر ربات یک update در هر نوبت)"""
+        while True:
+            await self._ready.acquire()
+            with self._queue_lock:
+                state = self._ring.popleft()
+                enqueued_at, data = state.queue.popleft()
+                self.queued -= 1
+
+            wait = time.monotonic() - enqueued_at
+            self.wait_last = wait
+            self.wait_max = max(self.wait_max, wait)
+            self.wait_avg = self.wait_avg * 0.99 + wait * 0.01
+
+            try:
+                await self.dispatch(state, data)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Error dispatching update for bot {state.bot_id}: {e}")
+
+            # ترتیب update های هر ربات حفظ می‌شود: ربات پس از پردازش به انتهای حلقه برمی‌گردد
+            with self._queue_lock:
+                if state.queue:
+                    self._ring.append(state)
+                    requeue = True
+                else:
+                    self._scheduled.discard(state.token)
+                    requeue = False
+            if requeue:
+                self._ready.release()
+
+    async def dispatch(self, state, data):
+        """اجرای اولین هندلر منطبق از خط لوله مشترک"""
+        update = Update.de_json(data, state.bot)
+        state.updates += 1
+        self.processed += 1
+        for matches, handler in self.handlers:
+            if matches(update):
+                try:
+                    await handler(update, state.context(update))
+                except Exception as e:
+                    self.errors += 1
+                    logging.error(f"Error handling update for bot {state.bot_id}: {e}")
+                return True
+        return False
+
+    def stats(self):
+        return {
+            'bots': len(self.bots),
+            'hydrations': self.hydrations,
+            'evictions': self.evictions,
+            'unknown_tokens': len(self.unknown),
+            'negative_hits': self.negative_hits,
+            'updates': self.processed,
+            'errors': self.errors,
+            'queue_depth': self.queued,
+            'busy_bots': len(self._scheduled),
+            'rejected': self.rejected,
+            'wait_last': self.wait_last,
+            'wait_avg': self.wait_avg,
+            'wait_max': self.wait_max
+        }
@@ -1,58 +1,31 @@
 from datetime import datetime, timedelta
+from threading import Thread, Event
+import time
+from sqlalchemy import event, func, cast, Integer
 from database import DatabaseManager
+from models import User
+from building_catalog import catalog
+from player_cache import PlayerCache
+import metrics
 import config
 
 class EconomyManager:
     def __init__(self, db_manager):
         self.db = db_manager
+        self.cache = PlayerCache(config.PLAYER_CACHE_SIZE, config.PLAYER_CACHE_TTL)
+    
+    def get_user(self, user_id, bot_id):
+        """خواندن بازیکن از کش (در صورت نبود از دیتابیس)"""
+        return self.cache.get((bot_id, user_id), lambda: self.db.get_user(user_id, bot_id))
+    
+    def invalidate(self, user):
+        """حذف بازیکن از کش پس از هر تغییر"""
+        self.cache.invalidate((user.bot_id, user.user_id))
     
     def calculate_daily_production(self, user):
         """محاسبه تولید روزانه"""
-        daily_production = 0
-        
-        # تولید از کارخانه‌ها
-        for building, count in user.buildings.items():
-            if "کارخانه" in building:
-                base_production = 50  # تولید پایه
-                if "پیشرفته" in building:
-                    base_production = 100
-                elif "حرفه ای" in building:
-                    base_production = 150
-                
-                daily_production += count * base_production
-        
-        # تولید از معادن
-        for building, count in user.buildings.items():
-            if "معدن" in building:
-                base_production = 30
-                if "حرفه ای" in building:
-                    base_production = 60
-                elif "پیشرفته" in building:
-                    base_production = 90
-                
-                daily_production += count * base_production
-        
-        # تولید از نیروگاه‌ها
-        for building, count in user.buildings.items():
-            if "نیروگاه" in building:
-                base_production = 40
-                if "پیشرفته" in building:
-                    base_production = 80
-                elif "حرفه ای" in building:
-                    base_production = 120
-                elif "هسته ای" in building:
-                    base_production = 200
-                
-                daily_production += count * base_production
-        
-        # تولید از نفت‌کش‌ها
-        for building, count in user.buildings.items():
-            if "نفت کش" in building:
-                base_production = 25
-                if "حرفه ای" in building:
-                    base_production = 50
-                
-                daily_production += count * base_production
+        # تولید پایه از جدول کامپایل‌شده سازه‌ها (یک پیمایش)
+        daily_production = catalog.base_production(user.buildings)
         
         # اعمال بونوس تکنولوژی
         tech_bonus = 1 + (user.tech_level * 0.1)  # 10% افزایش به ازای هر سطح
@@ -64,6 +37,120 @@ class EconomyManager:
         
         return int(daily_production)
     
+    def calculate_daily_production_batch(self, users):
+        """محاسبه تولید روزانه تعداد زیادی کاربر در یک فراخوانی"""
+        return catalog.production_batch(
+            [user.buildings for user in users],
+            [user.tech_level for user in users],
+            [user.morale for user in users]
+        )
+    
+    def production_rate(self, user):
+        """تولید روزانه کش‌شده (فقط پس از تغییر سازه‌ها، تکنولوژی یا روحیه دوباره محاسبه می‌شود)"""
+        if user.production_rate is None:
+            user.production_rate = self.calculate_daily_production(user)
+        return user.production_rate
+    
+    def accrued_production(self, user, now=None):
+        """تولید انباشته از آخرین تسویه (بدون نوشتن)"""
+        anchor = user.money_updated_at or user.last_active
+        if not anchor:
+            return 0
+        now = now or datetime.utcnow()
+        hours_passed = (now - anchor).total_seconds() / 3600
+        return int(self.production_rate(user) / 24 * hours_passed)
+    
+    def current_money(self, user, now=None):
+        """موجودی فعلی = پول ذخیره‌شده + نرخ × زمان گذشته"""
+        return user.money + self.accrued_production(user, now)
+    
+    def settle(self, user, now=None):
+        """ثبت تولید انباشته در موجودی (قبل از هر نوشتن روی پول)"""
+        now = now or datetime.utcnow()
+        user.money += self.accrued_production(user, now)
+        user.money_updated_at = now
+        return user.money
+    
+    def get_balance(self, user_id, bot_id):
+        """موجودی برای صفحات نمایشی (بدون هیچ نوشتنی)"""
+        user = self.get_user(user_id, bot_id)
+        if not user:
+            return None
+        return self.current_money(user)
+    
+    def _elapsed_days(self, session, now):
+        """عبارت SQL زمان گذشته از آخرین تسویه (روز)"""
+        if session.bind.dialect.name == 'sqlite':
+            return func.julianday(now.isoformat(sep=' ')) - func.julianday(User.money_updated_at)
+        return func.extract('epoch', now - User.money_updated_at) / 86400
+    
+    def _floor(self, session, expr):
+        if session.bind.dialect.name == 'sqlite':
+            return cast(expr, Integer)
+        return func.floor(expr)
+    
+    def _fill_production_rates(self, session, batch_size):
+        """محاسبه دسته‌ای نرخ تولید کاربرانی که نرخ کش‌شده ندارند"""
+        filled = 0
+        last_id = 0
+        while True:
+            rows = (session.query(User.id, User.buildings, User.tech_level, User.morale)
+                    .filter(User.production_rate.is_(None), User.id > last_id)
+                    .order_by(User.id).limit(batch_size).all())
+            if not rows:
+                return filled
+            
+            rates = catalog.production_batch(
+                [row.buildings for row in rows],
+                [row.tech_level or 0 for row in rows],
+                [row.morale if row.morale is not None else 100 for row in rows]
+            )
+            session.bulk_update_mappings(User, [
+                {'id': row.id, 'production_rate': float(rate)} for row, rate in zip(rows, rates)
+            ])
+            filled += len(rows)
+            last_id = rows[-1].id
+    
+    def run_tick(self, now=None, active_days=None, batch_size=5000):
+        """واریز تولید به همه کاربران فعال با چند UPDATE مجموعه‌ای"""
+        started = time.perf_counter()
+        now = now or datetime.utcnow()
+        session = self.db.get_session()
+        try:
+            rates_computed = self._fill_production_rates(session, batch_size)
+            
+            # کاربران قدیمی بدون مبدأ تسویه
+            session.query(User).filter(User.money_updated_at.is_(None)).update(
+                {User.money_updated_at: func.coalesce(User.last_active, now)},
+                synchronize_session=False
+            )
+            
+            filters = [User.production_rate.isnot(None), User.money_updated_at < now]
+            if active_days:
+                filters.append(User.last_active >= now - timedelta(days=active_days))
+            
+            credit = self._floor(session, User.production_rate * self._elapsed_days(session, now))
+            rows_updated = session.query(User).filter(*filters).update(
+                {User.money: User.money + credit, User.money_updated_at: now},
+                synchronize_session=False
+            )
+            session.commit()
+            # به‌روزرسانی مجموعه‌ای همه سطرها را تغییر داده است
+            self.cache.clear()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+        
+        metrics.ECONOMY_OPERATIONS.inc(operation="tick")
+        metrics.ECONOMY_TICK_ROWS.inc(rows_updated)
+        return {
+            'rates_computed': rates_computed,
+            'rows_updated': rows_updated,
+            'duration': time.perf_counter() - started
+        }
+    
     def process_loan(self, user, amount):
         """پردازش وام"""
         # بررسی cooldown
@@ -79,10 +166,13 @@ class EconomyManager:
         # اعطای وام
         session = self.db.get_session()
         try:
+            self.settle(user)
             user.money += amount
             user.loan_amount += amount
             user.last_loan_time = datetime.utcnow()
             session.commit()
+            self.invalidate(user)
+            metrics.ECONOMY_OPERATIONS.inc(operation="loan")
             return True, f"وام {amount} واحد دریافت شد"
         except Exception as e:
             session.rollback()
@@ -95,14 +185,17 @@ class EconomyManager:
         if amount > user.loan_amount:
             return False, "مبلغ بیشتر از وام شماست"
         
-        if amount > user.money:
+        if amount > self.current_money(user):
             return False, "پول کافی ندارید"
         
         session = self.db.get_session()
         try:
+            self.settle(user)
             user.money -= amount
             user.loan_amount -= amount
             session.commit()
+            self.invalidate(user)
+            metrics.ECONOMY_OPERATIONS.inc(operation="repay_loan")
             return True, f"مبلغ {amount} بازپرداخت شد"
         except Exception as e:
             session.rollback()
@@ -112,50 +205,94 @@ class EconomyManager:
     
     def update_user_resources(self, user_id, bot_id):
         """به‌روزرسانی منابع کاربر"""
-        user = self.db.get_user(user_id, bot_id)
+        user = self.get_user(user_id, bot_id)
         if not user:
             return
         
-        # محاسبه تولید از آخرین به‌روزرسانی
+        # ثبت تولید از آخرین تسویه با نرخ کش‌شده
         now = datetime.utcnow()
-        if user.last_active:
-            hours_passed = (now - user.last_active).total_seconds() / 3600
-            
-            # تولید منابع
-            daily_production = self.calculate_daily_production(user)
-            hourly_production = daily_production / 24
-            production = int(hourly_production * hours_passed)
-            
-            # به‌روزرسانی پول
-            user.money += production
+        if user.money_updated_at or user.last_active:
+            self.settle(user, now)
             user.last_active = now
             
             # ذخیره تغییرات
             self.db.update_user(user_id, {
                 'money': user.money,
+                'money_updated_at': user.money_updated_at,
+                'production_rate': user.production_rate,
                 'last_active': user.last_active
             })
+            self.invalidate(user)
+            metrics.ECONOMY_OPERATIONS.inc(operation="update_resources")
     
     def can_afford(self, user, cost):
         """بررسی توانایی مالی"""
-        return user.money >= cost
+        return self.current_money(user) >= cost
     
     def deduct_money(self, user_id, bot_id, amount):
         """کسر پول"""
-        user = self.db.get_user(user_id, bot_id)
+        user = self.get_user(user_id, bot_id)
         if not user:
             return False
         
-        if user.money < amount:
+        if self.current_money(user) < amount:
             return False
         
         session = self.db.get_session()
         try:
+            self.settle(user)
             user.money -= amount
             session.commit()
+            self.invalidate(user)
+            metrics.ECONOMY_OPERATIONS.inc(operation="deduct_money")
             return True
         except Exception as e:
             session.rollback()
             return False
         finally:
             session.close()
+
+
+class EconomyTicker:
+    """اجرای دوره‌ای tick اقتصادی در thread جداگانه"""
+    def __init__(self, economy_manager, interval=None, active_days=None):
+        self.economy = economy_manager
+        self.interval = interval or config.ECONOMY_TICK_SECONDS
+        self.active_days = active_days if active_days is not None else config.ECONOMY_ACTIVE_DAYS
+        self.stop_event = Event()
+        self.thread = None
+        self.last_report = None
+    
+    def start(self):
+        """شروع tick اقتصادی"""
+        self.stop_event.clear()
+        self.thread = Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        """توقف tick اقتصادی"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+    
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.last_report = self.economy.run_tick(active_days=self.active_days)
+                print(f"Economy tick: {self.last_report['rows_updated']} users in {self.last_report['duration']:.2f}s")
+            except Exception as e:
+                print(f"Error in economy tick: {e}")
+
+# با تغییر سازه‌ها، تکنولوژی یا روحیه: تسویه با نرخ قبلی و باطل کردن نرخ کش‌شده
+# (تغییرات درجای دیکشنری buildings دیده نمی‌شوند؛ باید دیکشنری جدید تنظیم شود)
+@event.listens_for(User.buildings, 'set')
+@event.listens_for(User.tech_level, 'set')
+@event.listens_for(User.morale, 'set')
+def _invalidate_production_rate(user, value, oldvalue, initiator):
+    if user.production_rate is not None and user.money_updated_at:
+        now = datetime.utcnow()
+        hours_passed = (now - user.money_updated_at).total_seconds() / 3600
+        user.money += int(user.production_rate / 24 * hours_passed)
+        user.money_updated_at = now
+    user.production_rate = None
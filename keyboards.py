@@ -1,141 +1,220 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 
+BACK = "⬅️ بازگشت"
+
+# چیدمان کیبوردهای ثابت: نام -> (سطرها، پنهان شدن پس از انتخاب)
+MAIN_MENU_ROWS = [
+    ["🪖 نیروی زمینی", "✈️ نیروی هوایی"],
+    ["📡 پدافندها", "🚢 نیروی دریایی"],
+    ["💻 نیروی سایبری", "💣 تسلیحات ویژه"],
+    ["🏭 بخش اقتصادی", "🏢 سازه‌ها"],
+    ["🧠 تکنولوژی", "⚔️ حمله"],
+    ["🏛 اتحادها", "👤 اطلاعات من"],
+    ["📘 راهنمای بازی", "🛒 فروشگاه"],
+    ["⚙️ تنظیمات", "💰 وام"]
+]
+
+REPLY_LAYOUTS = {
+    "main_menu": (MAIN_MENU_ROWS + [["⬅️ بازگشت به منوی اصلی"]], False),
+    "main_menu_owner": (MAIN_MENU_ROWS + [["👑 پنل مالک"], ["⬅️ بازگشت به منوی اصلی"]], False),
+    "owner_panel": ([
+        ["➕ افزودن کاربر", "👥 لیست کاربران"],
+        ["🏳️ انتخاب کشور کاربر", "🗑 حذف کاربر"],
+        ["📊 آمار ربات", BACK]
+    ], False),
+    "ground_forces_menu": ([
+        ["👶 تازه نفس", "🚀 ارپیجی زن"],
+        ["⛺ تک تیرانداز", "🪖 سرباز حرفه ای"],
+        ["⚽ توپخانه حرفه ای", "🙍‍♂️ سرباز"],
+        ["⚽ توپخانه", "📊 وضعیت نیروها"],
+        [BACK]
+    ], False),
+    "air_forces_menu": ([
+        ["✈️ جنگنده سبک", "🛩️ جنگنده سنگین"],
+        ["💣 بمب افکن", "🚁 بالگرد رزمی"],
+        ["🚀 موشک کوتاه‌برد", "🚀 موشک میان‌برد"],
+        ["🚀 موشک دوربرد", "🚀 موشک بالستیک"],
+        ["📊 وضعیت نیروها", BACK]
+    ], False),
+    "attack_menu": ([
+        ["🎯 حمله به کاربر", "🤖 حمله به AI"],
+        ["📊 وضعیت جنگ‌ها", BACK]
+    ], False),
+    "economy_menu": ([
+        ["🏭 ساخت کارخانه", "⛏️ ساخت معدن"],
+        ["⚡️ ساخت نیروگاه", "🛢️ ساخت نفت‌کش"],
+        ["💰 وضعیت منابع", BACK]
+    ], False),
+    "building_menu": ([
+        ["🏥 بیمارستان", "🤰 زایشگاه"],
+        ["🏞 پارک", "📊 وضعیت سازه‌ها"],
+        [BACK]
+    ], False),
+    "settings_menu": ([
+        ["🔔 تنظیم نوتیفیکیشن", "🌐 تغییر زبان"],
+        ["👤 تغییر نام", BACK]
+    ], False),
+    "shop_menu": ([
+        ["💎 خرید الماس", "⚡ خرید انرژی"],
+        ["🛡 خرید پدافند", BACK]
+    ], False),
+    "yes_no": ([
+        ["✅ بله", "❌ خیر"]
+    ], True),
+    "numeric": ([
+        ["1", "2", "3"],
+        ["4", "5", "6"],
+        ["7", "8", "9"],
+        ["0", BACK]
+    ], True)
+}
+
+# پنل‌های شیشه‌ای: نام -> سطرهای (متن دکمه، callback_data)
+INLINE_LAYOUTS = {
+    "user_panel": [
+        [("اطلاعات من", "info")],
+        [("درخواست وام", "loan")]
+    ],
+    "mother_panel": [
+        [("اضافه کردن ربات فرزند", "add_bot")],
+        [("نمایش کاربران", "show_users")]
+    ]
+}
+
+# متن‌های ثابتی که تقریباً در هر تعامل ارسال می‌شوند
+TEXTS = {
+    "main_menu": "منوی اصلی",
+    "owner_panel": "پنل مالک ربات",
+    "user_panel": "پنل کاربر",
+    "mother_panel": "پنل مالک ربات مادر",
+    "not_member": "شما عضو این ربات نیستید. با مالک ربات تماس بگیرید.",
+    "not_owner": "شما مالک ربات نیستید. مالک اصلی: @amele55",
+    "loan_granted": "وام ۵۰۰ واحدی به شما تعلق گرفت. لطفاً بازپرداخت را فراموش نکنید!",
+    "send_bot_token": "لطفاً توکن ربات فرزند را ارسال کنید...",
+    "users_list": "لیست کاربران فعلی:\n(برای نمونه)",
+    "db_busy": "سرور شلوغ است، لطفاً چند لحظه دیگر دوباره تلاش کنید."
+}
+
+class KeyboardRegistry:
+    """کیبوردها و متن‌های ثابت که یک بار ساخته و JSON آن‌ها کش می‌شود"""
+
+    def __init__(self):
+        self.markups = {}
+        self.payloads = {}
+        self.texts = dict(TEXTS)
+
+    def register(self, name, markup):
+        # اشیای markup تلگرام پس از ساخت تغییرناپذیرند و بین پاسخ‌ها مشترک می‌مانند
+        self.markups[name] = markup
+        self.payloads[name] = markup.to_json()
+        return markup
+
+    def build(self):
+        """ساخت همه کیبوردهای ثابت (در زمان راه‌اندازی)"""
+        for name, (rows, one_time) in REPLY_LAYOUTS.items():
+            self.register(name, ReplyKeyboardMarkup(rows, resize_keyboard=True,
+                                                    one_time_keyboard=one_time))
+        for name, rows in INLINE_LAYOUTS.items():
+            self.register(name, InlineKeyboardMarkup([
+                [InlineKeyboardButton(text, callback_data=data) for text, data in row]
+                for row in rows
+            ]))
+        return self
+
+    def build_countries(self, countries, per_row=3):
+        """کیبورد انتخاب کشور (فقط یک بار از روی فهرست کشورها)"""
+        buttons = [KeyboardButton(country) for country in countries]
+        rows = [buttons[i:i + per_row] for i in range(0, len(buttons), per_row)]
+        rows.append([BACK])
+        return self.register("country_selection", ReplyKeyboardMarkup(
+            rows, resize_keyboard=True, one_time_keyboard=True))
+
+    def markup(self, name):
+        return self.markups[name]
+
+    def payload(self, name):
+        """JSON آماده کیبورد"""
+        return self.payloads[name]
+
+    def text(self, name):
+        return self.texts[name]
+
+    def reply_kwargs(self, name):
+        """پارامترهای ارسال با JSON از پیش ساخته (بدون سریال‌سازی دوباره در هر پاسخ)"""
+        return {"api_kwargs": {"reply_markup": self.payloads[name]}}
+
+    async def reply(self, message, name, text=None):
+        """ارسال یک صفحه ثابت (متن + کیبورد)"""
+        return await message.reply_text(text or self.texts[name], **self.reply_kwargs(name))
+
+    async def edit(self, query, name, text=None):
+        """ویرایش پیام با متن ثابت (و کیبورد در صورت وجود)"""
+        kwargs = self.reply_kwargs(name) if name in self.payloads else {}
+        return await query.edit_message_text(text or self.texts[name], **kwargs)
+
+registry = KeyboardRegistry().build()
+
 class Keyboards:
     @staticmethod
     def main_menu(is_owner=False):
         """منوی اصلی"""
-        keyboard = [
-            ["🪖 نیروی زمینی", "✈️ نیروی هوایی"],
-            ["📡 پدافندها", "🚢 نیروی دریایی"],
-            ["💻 نیروی سایبری", "💣 تسلیحات ویژه"],
-            ["🏭 بخش اقتصادی", "🏢 سازه‌ها"],
-            ["🧠 تکنولوژی", "⚔️ حمله"],
-            ["🏛 اتحادها", "👤 اطلاعات من"],
-            ["📘 راهنمای بازی", "🛒 فروشگاه"],
-            ["⚙️ تنظیمات", "💰 وام"]
-        ]
-        
-        if is_owner:
-            keyboard.append(["👑 پنل مالک"])
-            
-        keyboard.append(["⬅️ بازگشت به منوی اصلی"])
-        
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("main_menu_owner" if is_owner else "main_menu")
     
     @staticmethod
     def owner_panel():
         """پنل مالک ربات"""
-        keyboard = [
-            ["➕ افزودن کاربر", "👥 لیست کاربران"],
-            ["🏳️ انتخاب کشور کاربر", "🗑 حذف کاربر"],
-            ["📊 آمار ربات", "⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("owner_panel")
     
     @staticmethod
     def ground_forces_menu():
         """منوی نیروی زمینی"""
-        keyboard = [
-            ["👶 تازه نفس", "🚀 ارپیجی زن"],
-            ["⛺ تک تیرانداز", "🪖 سرباز حرفه ای"],
-            ["⚽ توپخانه حرفه ای", "🙍‍♂️ سرباز"],
-            ["⚽ توپخانه", "📊 وضعیت نیروها"],
-            ["⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("ground_forces_menu")
     
     @staticmethod
     def air_forces_menu():
         """منوی نیروی هوایی"""
-        keyboard = [
-            ["✈️ جنگنده سبک", "🛩️ جنگنده سنگین"],
-            ["💣 بمب افکن", "🚁 بالگرد رزمی"],
-            ["🚀 موشک کوتاه‌برد", "🚀 موشک میان‌برد"],
-            ["🚀 موشک دوربرد", "🚀 موشک بالستیک"],
-            ["📊 وضعیت نیروها", "⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("air_forces_menu")
     
     @staticmethod
     def attack_menu():
         """منوی حمله"""
-        keyboard = [
-            ["🎯 حمله به کاربر", "🤖 حمله به AI"],
-            ["📊 وضعیت جنگ‌ها", "⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("attack_menu")
     
     @staticmethod
     def economy_menu():
         """منوی اقتصادی"""
-        keyboard = [
-            ["🏭 ساخت کارخانه", "⛏️ ساخت معدن"],
-            ["⚡️ ساخت نیروگاه", "🛢️ ساخت نفت‌کش"],
-            ["💰 وضعیت منابع", "⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("economy_menu")
     
     @staticmethod
     def building_menu():
         """منوی سازه‌ها"""
-        keyboard = [
-            ["🏥 بیمارستان", "🤰 زایشگاه"],
-            ["🏞 پارک", "📊 وضعیت سازه‌ها"],
-            ["⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("building_menu")
     
     @staticmethod
     def settings_menu():
         """منوی تنظیمات"""
-        keyboard = [
-            ["🔔 تنظیم نوتیفیکیشن", "🌐 تغییر زبان"],
-            ["👤 تغییر نام", "⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("settings_menu")
     
     @staticmethod
     def shop_menu():
         """منوی فروشگاه"""
-        keyboard = [
-            ["💎 خرید الماس", "⚡ خرید انرژی"],
-            ["🛡 خرید پدافند", "⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        return registry.markup("shop_menu")
     
     @staticmethod
     def yes_no_keyboard():
         """کیبورد بله/خیر"""
-        keyboard = [
-            ["✅ بله", "❌ خیر"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+        return registry.markup("yes_no")
     
     @staticmethod
     def country_selection_keyboard():
         """کیبورد انتخاب کشور"""
-        from config import Config
-        
-        keyboard = []
-        row = []
-        for i, country in enumerate(Config.COUNTRIES, 1):
-            row.append(KeyboardButton(country))
-            if i % 3 == 0:
-                keyboard.append(row)
-                row = []
-        if row:
-            keyboard.append(row)
-        keyboard.append(["⬅️ بازگشت"])
-        
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+        markup = registry.markups.get("country_selection")
+        if markup is None:
+            from config import Config
+            markup = registry.build_countries(Config.COUNTRIES)
+        return markup
     
     @staticmethod
     def numeric_keyboard():
         """کیبورد عددی"""
-        keyboard = [
-            ["1", "2", "3"],
-            ["4", "5", "6"],
-            ["7", "8", "9"],
-            ["0", "⬅️ بازگشت"]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+        return registry.markup("numeric")
@@ -0,0 +1,324 @@
+import random
+import threading
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import AICountry, User
+from unit_table import get_unit_table
+
+MAX_LEVELS = 24
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels  # فاصله تا گره بعدی در سطح صفر
+
+class RankedSkipList:
+    """مجموعه مرتب کلیدهای یکتا با درج، حذف، رتبه و دسترسی با اندیس در O(log n)"""
+
+    def __init__(self, seed=None):
+        self.head = _Node(None, MAX_LEVELS)
+        self.size = 0
+        self._rng = random.Random(seed)
+
+    def __len__(self):
+        return self.size
+
+    def _level(self):
+        level = 1
+        while level < MAX_LEVELS and self._rng.random() < 0.5:
+            level += 1
+        return level
+
+    def _find(self, key):
+        # آخرین گره کوچکتر از key در هر سطح و موقعیت آن
+        chain = [None] * MAX_LEVELS
+        steps = [0] * MAX_LEVELS
+        node = self.head
+        position = 0
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            steps[level] = position
+        return chain, steps
+
+    def insert(self, key):
+        chain, steps = self._find(key)
+        position = steps[0] + 1
+        levels = self._level()
+        node = _Node(key, levels)
+        for level in range(levels):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            node.width[level] = prev.width[level] - (position - steps[level]) + 1
+            prev.next[level] = node
+            prev.width[level] = position - steps[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        levels = len(node.next)
+        for level in range(levels):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        """تعداد کلیدهای کوچکتر از key (اندیس آن از صفر)"""
+        chain, steps = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return steps[0]
+
+    def _node_at(self, index):
+        node = self.head
+        position = 0
+        target = index + 1
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and position + node.width[level] <= target:
+                position += node.width[level]
+                node = node.next[level]
+        return node
+
+    def slice(self, start, stop):
+        """کلیدهای اندیس start تا stop (بدون stop)"""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        keys = []
+        if start >= stop:
+            return keys
+        node = self._node_at(start)
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+def _column_default(model, name):
+    default = model.__table__.c[name].default
+    if default is None:
+        return None
+    return default.arg(None) if default.is_callable else default.arg
+
+def _army(obj):
+    # سطرهای جدید قبل از درج هنوز مقدار پیش‌فرض ستون‌ها را ندارند
+    units = obj.units
+    if units is None:
+        units = _column_default(type(obj), "units") or {}
+    tech_level = getattr(obj, "tech_level", None)
+    if tech_level is None:
+        tech_level = 1
+    return units, tech_level
+
+def compute_powers(objects):
+    """قدرت دفاعی چند کاربر یا کشور AI با یک محاسبه دسته‌ای (همان مقدار ستون power)"""
+    if not objects:
+        return []
+    armies, tech_levels = zip(*(_army(obj) for obj in objects))
+    return [float(power) for power in get_unit_table().power_batch(list(armies), "defense", list(tech_levels))]
+
+KINDS = {User: "user", AICountry: "ai"}
+
+class Leaderboard:
+    """رتبه‌بندی قدرت کاربران و کشورهای AI؛ با هر commit که نیروها یا تکنولوژی را تغییر دهد به‌روز می‌شود
+
+    رتبه‌بندی در حافظه هر پروسه است و فقط commit های همان پروسه را می‌بیند؛ تغییرات worker های دیگر
+    گانیکورن و پروسه main.py تا load بعدی (راه‌اندازی دوباره) در آن دیده نمی‌شوند. ستون power در
+    دیتابیس همیشه درست است، پس رتبه‌های این کلاس برای انتخاب تقریبی حریف‌اند نه نمایش دقیق.
+    توابع sqlite در database.py (unit_inventory) به دیتابیس دیگری می‌نویسند و اینجا دیده نمی‌شوند.
+    """
+
+    def __init__(self):
+        self._ranking = RankedSkipList()
+        self._keys = {}  # (نوع، id) -> کلید مرتب‌سازی
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.updates = 0
+
+    @staticmethod
+    def _key(kind, owner_id, power):
+        # قدرت بیشتر اول؛ در قدرت برابر ترتیب ثابت با نوع و id
+        return (-power, kind, owner_id)
+
+    def _set(self, kind, owner_id, power):
+        old = self._keys.pop((kind, owner_id), None)
+        if old is not None:
+            self._ranking.remove(old)
+        if power is not None:
+            key = self._key(kind, owner_id, power)
+            self._ranking.insert(key)
+            self._keys[(kind, owner_id)] = key
+
+    def update(self, kind, owner_id, power):
+        """ثبت قدرت جدید (None = حذف از رتبه‌بندی)"""
+        self.apply([(kind, owner_id, power)])
+
+    def apply(self, changes):
+        with self._lock:
+            if not self.loaded:
+                return
+            for kind, owner_id, power in changes:
+                self._set(kind, owner_id, power)
+            self.updates += len(changes)
+
+    def load(self, session, recompute=False, batch_size=1000):
+        """ساخت رتبه‌بندی از ستون power (recompute فقط برای مهاجرت یک‌باره؛ python leaderboard.py)"""
+        entries = []
+        for model, kind in KINDS.items():
+            if recompute:
+                entries.extend(self._recompute(session, model, kind, batch_size))
+            else:
+                entries.extend((kind, owner_id, power or 0.0)
+                               for owner_id, power in session.query(model.id, model.power))
+        with self._lock:
+            self._ranking = RankedSkipList()
+            self._keys = {}
+            for kind, owner_id, power in entries:
+                self._set(kind, owner_id, power)
+            self.loaded = True
+        return len(entries)
+
+    def _recompute(self, session, model, kind, batch_size):
+        entries = []
+        columns = [model.id, model.units, model.power]
+        if hasattr(model, "tech_level"):
+            columns.append(model.tech_level)
+        last_id = 0
+        while True:
+            rows = (session.query(*columns).filter(model.id > last_id)
+                    .order_by(model.id).limit(batch_size).all())
+            if not rows:
+                break
+            table = get_unit_table()
+            tech_levels = [row[3] if len(row) > 3 and row[3] is not None else 1 for row in rows]
+            powers = table.power_batch([row[1] or {} for row in rows], "defense", tech_levels)
+            stale = []
+            for row, power in zip(rows, powers):
+                power = float(power)
+                entries.append((kind, row[0], power))
+                if row[2] != power:
+                    stale.append({"id": row[0], "power": power})
+            if stale:
+                session.bulk_update_mappings(model, stale)
+                session.commit()
+            last_id = rows[-1][0]
+        return entries
+
+    def rank(self, kind, owner_id):
+        """رتبه (از 1) یا None"""
+        with self._lock:
+            key = self._keys.get((kind, owner_id))
+            return None if key is None else self._ranking.rank(key) + 1
+
+    def _entries(self, start, keys):
+        return [(start + i + 1, kind, owner_id, -power)
+                for i, (power, kind, owner_id) in enumerate(keys)]
+
+    def top(self, n=10):
+        """n رتبه اول: (رتبه، نوع، id، قدرت)"""
+        with self._lock:
+            return self._entries(0, self._ranking.slice(0, n))
+
+    def page(self, start, count):
+        """رتبه‌های start تا start + count - 1 (رتبه از 1)"""
+        with self._lock:
+            return self._entries(start - 1, self._ranking.slice(start - 1, start - 1 + count))
+
+    def neighbors(self, kind, owner_id, count=2):
+        """count رتبه بالاتر و پایین‌تر از یک بازیکن (همراه خودش)"""
+        with self._lock:
+            key = self._keys.get((kind, owner_id))
+            if key is None:
+                return []
+            index = self._ranking.rank(key)
+            start = max(index - count, 0)
+            return self._entries(start, self._ranking.slice(start, index + count + 1))
+
+    def with_names(self, session, entries):
+        """افزودن نام کشور به سطرهای رتبه‌بندی (یک کوئری برای هر نوع)"""
+        names = {}
+        for model, kind in KINDS.items():
+            ids = [owner_id for _, entry_kind, owner_id, _ in entries if entry_kind == kind]
+            if ids:
+                names.update(((kind, owner_id), country) for owner_id, country in
+                             session.query(model.id, model.country).filter(model.id.in_(ids)))
+        return [(rank, kind, owner_id, names.get((kind, owner_id)), power)
+                for rank, kind, owner_id, power in entries]
+
+    def stats(self):
+        return {
+            "loaded": int(self.loaded),
+            "entries": len(self._ranking),
+            "updates": self.updates
+        }
+
+leaderboard = Leaderboard()
+
+# ستون power پیش از flush تازه می‌شود و رتبه‌بندی فقط بعد از commit تغییر می‌کند
+@event.listens_for(Session, "before_flush")
+def _refresh_power(session, flush_context, instances):
+    changed = []
+    for obj in list(session.new) + list(session.dirty):
+        if type(obj) not in KINDS:
+            continue
+        state = inspect(obj)
+        if (state.pending or state.attrs.units.history.has_changes()
+                or ("tech_level" in state.attrs and state.attrs.tech_level.history.has_changes())):
+            changed.append(obj)
+    for obj, power in zip(changed, compute_powers(changed)):
+        if obj.power != power:
+            obj.power = power
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault("leaderboard_changes", [])
+    for obj in list(session.new) + list(session.dirty):
+        kind = KINDS.get(type(obj))
+        if kind and inspect(obj).attrs.power.history.has_changes():
+            changes.append((kind, obj.id, obj.power))
+    for obj in session.deleted:
+        kind = KINDS.get(type(obj))
+        if kind:
+            changes.append((kind, obj.id, None))
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    changes = session.info.pop("leaderboard_changes", None)
+    if changes:
+        leaderboard.apply(changes)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("leaderboard_changes", None)
+
+def main():
+    """محاسبه دوباره ستون power همه سطرها (یک بار بعد از افزودن ستون یا تغییر مشخصات واحدها)"""
+    from database import DatabaseManager
+    session = DatabaseManager().get_session()
+    try:
+        count = Leaderboard().load(session, recompute=True)
+    finally:
+        session.close()
+    print(f"power recomputed for {count} rows")
+
+if __name__ == "__main__":
+    main()
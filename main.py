@@ -1,29 +1,33 @@
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
 from config import MOTHER_BOT_TOKEN, OWNER_ID, WEBHOOK_URL
-from database import add_user, get_user, update_user_resources
+from keyboards import registry
+import config
+import metrics
 
+@metrics.handler("mother")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id != OWNER_ID:
-        await update.message.reply_text(f"شما مالک ربات نیستید. مالک اصلی: @amele55")
+        await update.message.reply_text(registry.text("not_owner"))
         return
-    keyboard = [
-        [InlineKeyboardButton("اضافه کردن ربات فرزند", callback_data="add_bot")],
-        [InlineKeyboardButton("نمایش کاربران", callback_data="show_users")]
-    ]
-    await update.message.reply_text("پنل مالک ربات مادر", reply_markup=InlineKeyboardMarkup(keyboard))
+    await registry.reply(update.message, "mother_panel")
 
+@metrics.handler("mother")
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data = query.data
 
     if data == "add_bot":
-        await query.edit_message_text("لطفاً توکن ربات فرزند را ارسال کنید...")
+        await query.edit_message_text(registry.text("send_bot_token"))
     elif data == "show_users":
-        await query.edit_message_text("لیست کاربران فعلی:\n(برای نمونه)")
+        await query.edit_message_text(registry.text("users_list"))
+
+# متریک‌های ربات مادر روی پورت محلی
+if config.METRICS_PORT:
+    metrics.serve(config.METRICS_PORT)
 
 app = ApplicationBuilder().token(MOTHER_BOT_TOKEN).build()
 app.add_handler(CommandHandler("start", start))
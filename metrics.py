@@ -0,0 +1,283 @@
+import asyncio
+import functools
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# بازه‌های پیش‌فرض هیستوگرام زمان (ثانیه)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """پایه متریک‌های برچسب‌دار (هر ترکیب برچسب یک سری جدا)"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = [(key, self._snapshot(value)) for key, value in self._series.items()]
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _snapshot(self, value):
+        return value
+
+    def _render_series(self, key, value):
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [تعداد هر بازه (غیرتجمعی)، مجموع، تعداد]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return timer(self, **labels)
+
+    def _snapshot(self, value):
+        return list(value[0]), value[1], value[2]
+
+    def _render_series(self, key, value):
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            le = f'le="{bound}"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+class Registry:
+    """مجموعه متریک‌ها و گیج‌هایی که هنگام خواندن /metrics محاسبه می‌شوند"""
+
+    def __init__(self):
+        self.metrics = []
+        self.gauges = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def register_gauges(self, prefix, documentation, collect):
+        """collect() یک دیکشنری نام -> مقدار عددی برمی‌گرداند"""
+        with self._lock:
+            self.gauges.append((prefix, documentation, collect))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics):
+            lines.extend(metric.render())
+        for prefix, documentation, collect in list(self.gauges):
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {documentation} ({key})")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+def render():
+    return REGISTRY.render()
+
+# متریک‌های بازی
+HANDLER_LATENCY = histogram("bot_handler_latency_seconds", "Handler latency", ("bot", "handler"))
+HANDLER_ERRORS = counter("bot_handler_errors_total", "Handler exceptions", ("bot", "handler"))
+DB_QUERIES = counter("db_queries_total", "Executed SQL statements", ("backend",))
+DB_QUERY_SECONDS = counter("db_query_seconds_total", "Time spent executing SQL", ("backend",))
+UPDATE_DB_QUERIES = histogram("update_db_queries", "SQL statements per update", ("bot",),
+                              buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+UPDATE_DB_SECONDS = histogram("update_db_seconds", "SQL time per update", ("bot",),
+                              buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5))
+AI_TICK_SECONDS = histogram("ai_tick_duration_seconds", "AI decision tick duration",
+                            buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+BATTLE_OPERATIONS = counter("battle_operations_total", "Battle engine operations", ("operation",))
+BATTLE_RESULTS = counter("battle_results_total", "Calculated battle results", ("result",))
+ECONOMY_OPERATIONS = counter("economy_operations_total", "Economy operations", ("operation",))
+ECONOMY_TICK_ROWS = counter("economy_tick_rows_total", "Users credited by economy ticks")
+
+# آمار دیتابیس آپدیت جاری: [تعداد کوئری، زمان]
+_update_db = ContextVar("update_db", default=None)
+
+def record_query(backend, seconds):
+    """ثبت یک کوئری (کل + آپدیت جاری)"""
+    DB_QUERIES.inc(backend=backend)
+    DB_QUERY_SECONDS.inc(seconds, backend=backend)
+    stats = _update_db.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += seconds
+
+@contextmanager
+def timer(metric, **labels):
+    """زمان‌سنجی یک بلوک با هیستوگرام"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - started, **labels)
+
+@contextmanager
+def track(bot, handler):
+    """زمان هندلر و (برای بیرونی‌ترین هندلر) کوئری‌های دیتابیس آپدیت"""
+    stats = None
+    token = None
+    if _update_db.get() is None:
+        stats = [0, 0.0]
+        token = _update_db.set(stats)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        HANDLER_ERRORS.inc(bot=bot, handler=handler)
+        raise
+    finally:
+        HANDLER_LATENCY.observe(time.perf_counter() - started, bot=bot, handler=handler)
+        if token is not None:
+            _update_db.reset(token)
+            UPDATE_DB_QUERIES.observe(stats[0], bot=bot)
+            UPDATE_DB_SECONDS.observe(stats[1], bot=bot)
+
+def handler(bot, name=None):
+    """دکوریتور ثبت متریک برای هندلرهای ربات (async یا معمولی)"""
+    def decorate(func):
+        handler_name = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track(bot, handler_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(bot, handler_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+class InstrumentedConnection(sqlite3.Connection):
+    """اتصال sqlite که تعداد و زمان کوئری‌ها را ثبت می‌کند (factory در sqlite3.connect)"""
+
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            record_query("sqlite", time.perf_counter() - started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            record_query("sqlite", time.perf_counter() - started)
+
+    def executescript(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executescript(*args)
+        finally:
+            record_query("sqlite", time.perf_counter() - started)
+
+# کوئری‌های SQLAlchemy (همه engine ها)
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    record_query("sqlalchemy", time.perf_counter() - started)
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        record_query("sqlalchemy", time.perf_counter() - started.pop())
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port, host="127.0.0.1"):
+    """سرور محلی /metrics برای پروسه‌هایی که Flask ندارند (ربات مادر)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
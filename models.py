@@ -1,6 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, object_session
 from datetime import datetime
 import json
 
@@ -42,6 +42,8 @@ class User(Base):
     
     # منابع
     money = Column(Float, default=10000)
+    money_updated_at = Column(DateTime, default=datetime.utcnow)  # مبدأ محاسبه تولید
+    production_rate = Column(Float)  # تولید روزانه کش‌شده (None = نیاز به محاسبه)
     resources = Column(JSON, default=lambda: {
         "food": 1000,
         "oil": 1000,
@@ -116,11 +118,12 @@ class User(Base):
     # تکنولوژی و وضعیت
     tech_level = Column(Integer, default=1)
     morale = Column(Float, default=100.0)
+    power = Column(Float, default=0, index=True)  # قدرت دفاعی ذخیره‌شده برای انتخاب هدف
     last_loan_time = Column(DateTime)
     loan_amount = Column(Float, default=0)
     
     created_at = Column(DateTime, default=datetime.utcnow)
-    last_active = Column(DateTime, default=datetime.utcnow)
+    last_active = Column(DateTime, default=datetime.utcnow, index=True)
     is_admin = Column(Boolean, default=False)
     
     bot = relationship("ChildBot", back_populates="users")
@@ -141,22 +144,102 @@ class AICountry(Base):
     units = Column(JSON, default=lambda: {})
     resources = Column(JSON, default=lambda: {})
     money = Column(Float, default=10000)
+    tech_level = Column(Integer, default=1)  # مثل User؛ در محاسبه قدرت و تصمیم تحقیقات
+    morale = Column(Float, default=100.0)
+    power = Column(Float, default=0, index=True)  # قدرت دفاعی ذخیره‌شده برای رتبه‌بندی
     last_action = Column(DateTime, default=datetime.utcnow)
 
+def _packed_property(name):
+    """خواندن/نوشتن شفاف ستون فشرده با برگشت به JSON قدیمی"""
+    legacy_attr = f"{name}_json"
+    packed_attr = f"{name}_packed"
+    
+    def getter(self):
+        from battle_codec import unit_dictionary
+        packed = getattr(self, packed_attr)
+        if packed is not None:
+            return unit_dictionary.decode(packed, object_session(self))
+        return getattr(self, legacy_attr)
+    
+    def setter(self, value):
+        from battle_codec import unit_dictionary
+        packed = unit_dictionary.encode(value, object_session(self)) if value is not None else None
+        setattr(self, packed_attr, packed)
+        setattr(self, legacy_attr, value if packed is None else None)
+    
+    return property(getter, setter)
+
+class UnitId(Base):
+    """دیکشنری واحدها (همان جدول unit_ids در database.py)"""
+    __tablename__ = 'unit_ids'
+    __table_args__ = (UniqueConstraint('unit_type', 'unit_name'),)
+    
+    unit_id = Column(Integer, primary_key=True)
+    unit_type = Column(String(50), nullable=False)
+    unit_name = Column(String(100), nullable=False)
+
 class Battle(Base):
     __tablename__ = 'battles'
+    __table_args__ = (
+        Index('ix_battles_attacker_time', 'attacker_id', 'timestamp'),
+        Index('ix_battles_defender_time', 'defender_id', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True)
     attacker_id = Column(Integer, ForeignKey('users.id'))
     defender_id = Column(Integer)
     attacker_type = Column(String(20))  # 'user' or 'ai'
     defender_type = Column(String(20))  # 'user' or 'ai'
-    units_used = Column(JSON)
     result = Column(String(50))  # 'win', 'lose', 'draw'
+    resources_stolen = Column(JSON)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    # نیروها به صورت جفت‌های (id واحد، تعداد) فشرده ذخیره می‌شوند (battle_codec)
+    units_used_packed = Column(LargeBinary)
+    attacker_losses_packed = Column(LargeBinary)
+    defender_losses_packed = Column(LargeBinary)
+    
+    # ستون‌های JSON قدیمی (فقط برای سطرهای تبدیل‌نشده یا واحدهای ناشناخته)
+    units_used_json = Column('units_used', JSON)
+    attacker_losses_json = Column('attacker_losses', JSON)
+    defender_losses_json = Column('defender_losses', JSON)
+    
+    units_used = _packed_property('units_used')
+    attacker_losses = _packed_property('attacker_losses')
+    defender_losses = _packed_property('defender_losses')
+    
+    def legacy_unit_fields(self):
+        return [self.units_used_json, self.attacker_losses_json, self.defender_losses_json]
+    
+    def pack_legacy(self):
+        """تبدیل ستون‌های JSON قدیمی این سطر به قالب فشرده"""
+        packed = False
+        for name in ('units_used', 'attacker_losses', 'defender_losses'):
+            legacy = getattr(self, f"{name}_json")
+            if legacy is not None:
+                setattr(self, name, legacy)
+                packed = packed or getattr(self, f"{name}_packed") is not None
+        return packed
+
+class BattleArchive(Base):
+    """آرشیو جنگ‌های قدیمی (خارج از جدول اصلی)"""
+    __tablename__ = 'battles_archive'
+    
+    id = Column(Integer, primary_key=True)
+    attacker_id = Column(Integer)
+    defender_id = Column(Integer)
+    attacker_type = Column(String(20))
+    defender_type = Column(String(20))
+    units_used = Column(JSON)
+    result = Column(String(50))
     attacker_losses = Column(JSON)
     defender_losses = Column(JSON)
     resources_stolen = Column(JSON)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime)
+    units_used_packed = Column(LargeBinary)
+    attacker_losses_packed = Column(LargeBinary)
+    defender_losses_packed = Column(LargeBinary)
+    archived_at = Column(DateTime, default=datetime.utcnow)
 
 class Alliance(Base):
     __tablename__ = 'alliances'
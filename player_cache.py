@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class PlayerCache:
+    """کش وضعیت بازیکن با کلید (bot_id, user_id)، با TTL و حذف LRU"""
+
+    def __init__(self, max_size=10000, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (زمان انقضا، مقدار)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._epoch = 0  # با هر invalidate زیاد می‌شود
+
+    def get(self, key, loader):
+        """خواندن از کش؛ در صورت نبود یا انقضا با loader خوانده و ذخیره می‌شود"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+                self.expirations += 1
+            self.misses += 1
+            epoch = self._epoch
+
+        value = loader()
+        # مقدار None (بازیکن ناموجود) کش نمی‌شود
+        if value is not None:
+            self.put(key, value, epoch)
+        return value
+
+    def put(self, key, value, epoch=None):
+        with self._lock:
+            # اگر حین خواندن نوشتنی انجام شده، مقدار احتمالاً کهنه است
+            if epoch is not None and epoch != self._epoch:
+                return
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """حذف یک بازیکن از کش (بعد از هر نوشتن)"""
+        with self._lock:
+            self._epoch += 1
+            if self._items.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        """حذف همه ورودی‌ها (بعد از به‌روزرسانی‌های مجموعه‌ای)"""
+        with self._lock:
+            self._epoch += 1
+            self._items.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
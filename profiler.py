@@ -0,0 +1,239 @@
+import atexit
+import cProfile
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import config
+
+MODES = ("cprofile", "sampler")
+
+class StackSampler:
+    """نمونه‌برداری دوره‌ای از پشته thread هایی که در حال پروفایل هستند (خروجی collapsed)"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {}  # شناسه thread -> Counter نام بخش‌های باز روی آن thread
+        self.stacks = {}  # نام بخش -> Counter پشته‌ها
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                active = {thread_id: list(names) for thread_id, names in self.active.items()}
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, names in active.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    for name in names:
+                        self.stacks.setdefault(name, Counter())[key] += 1
+
+    def attach(self, name):
+        with self._lock:
+            self.active.setdefault(threading.get_ident(), Counter())[name] += 1
+
+    def detach(self, name):
+        # فقط همین بخش برداشته می‌شود؛ بخش‌های دیگر همین thread فعال می‌مانند
+        thread_id = threading.get_ident()
+        with self._lock:
+            names = self.active.get(thread_id)
+            if names is None:
+                return
+            names[name] -= 1
+            if names[name] <= 0:
+                del names[name]
+            if not names:
+                del self.active[thread_id]
+
+    def take(self, name):
+        with self._lock:
+            return self.stacks.pop(name, None)
+
+class Profiler:
+    """پروفایلر اختیاری: درصدی از اجراهای هر بخش پروفایل و به صورت تجمیعی روی دیسک نوشته می‌شود"""
+
+    def __init__(self, directory, sample_rate=0.05, mode="cprofile", flush_every=50,
+                 max_files=20, max_bytes=50 * 1024 * 1024, sampler_interval=0.005):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.flush_every = flush_every
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self.sampler = StackSampler(sampler_interval)
+        self._stats = {}  # نام بخش -> pstats.Stats تجمیعی
+        self._samples = Counter()
+        self._busy = False  # فقط یک cProfile در هر لحظه فعال است
+        self._lock = threading.Lock()
+        self.files_written = 0
+
+    def configure(self, enabled=None, sample_rate=None, mode=None):
+        """روشن/خاموش کردن و تغییر تنظیمات در زمان اجرا"""
+        if mode is not None:
+            if mode not in MODES:
+                raise ValueError(f"Unknown profiling mode: {mode}")
+            self.flush()
+            self.mode = mode
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        if enabled is not None:
+            self.enabled = bool(enabled)
+            if not self.enabled:
+                self.flush()
+        if self.enabled and self.mode == "sampler":
+            self.sampler.start()
+        else:
+            self.sampler.stop()
+        return self.status()
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "pending_samples": dict(self._samples),
+            "files_written": self.files_written,
+            "directory": os.path.abspath(self.directory)
+        }
+
+    @contextmanager
+    def profile(self, name):
+        """پروفایل یک اجرای بخش name (در صورت خاموش بودن فقط یک بررسی)
+
+        هر دو حالت کل thread جاری را اندازه می‌گیرند؛ برای کد async به جای یک await،
+        یک پنجره کامل event loop پروفایل شود (WebhookDispatcher._profile_windows).
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+
+        if self.mode == "sampler":
+            self.sampler.attach(name)
+            try:
+                yield
+            finally:
+                self.sampler.detach(name)
+                self._record(name, None)
+            return
+
+        with self._lock:
+            if self._busy:
+                profile = None
+            else:
+                self._busy = True
+                profile = cProfile.Profile()
+        if profile is None:
+            yield
+            return
+
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self._busy = False
+            self._record(name, profile)
+
+    def _record(self, name, profile):
+        with self._lock:
+            if profile is not None:
+                stats = self._stats.get(name)
+                if stats is None:
+                    self._stats[name] = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            self._samples[name] += 1
+            full = self._samples[name] >= self.flush_every
+        if full:
+            self._flush_one(name)
+
+    def flush(self):
+        """نوشتن همه نمونه‌های تجمیع‌شده روی دیسک"""
+        for name in list(self._samples):
+            self._flush_one(name)
+
+    def _flush_one(self, name):
+        with self._lock:
+            stats = self._stats.pop(name, None)
+            samples = self._samples.pop(name, 0)
+        stacks = self.sampler.take(name)
+        if not samples or (stats is None and not stacks):
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.directory, f"{name}-{stamp}-{self.files_written}-n{samples}")
+        try:
+            if stats is not None:
+                stats.dump_stats(base + ".pstats")
+            if stacks:
+                with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+            self.files_written += 1
+        except OSError as e:
+            logging.error(f"Error writing profile {name}: {e}")
+        self._prune()
+
+    def _prune(self):
+        # حذف قدیمی‌ترین فایل‌ها تا رسیدن به سقف تعداد و حجم
+        try:
+            files = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                     if name.endswith((".pstats", ".collapsed"))]
+            files.sort(key=os.path.getmtime)
+            total = sum(os.path.getsize(path) for path in files)
+            while files and (len(files) > self.max_files or total > self.max_bytes):
+                path = files.pop(0)
+                total -= os.path.getsize(path)
+                os.remove(path)
+        except OSError as e:
+            logging.error(f"Error pruning profiles: {e}")
+
+profiler = Profiler(
+    config.PROFILE_DIR,
+    sample_rate=config.PROFILE_SAMPLE_RATE,
+    mode=config.PROFILE_MODE,
+    flush_every=config.PROFILE_FLUSH_EVERY,
+    max_files=config.PROFILE_MAX_FILES,
+    max_bytes=config.PROFILE_MAX_MB * 1024 * 1024
+)
+if config.PROFILE_ENABLED:
+    profiler.configure(enabled=True)
+atexit.register(profiler.flush)
+
+_DISABLED = nullcontext()
+
+def profile(name):
+    """پروفایل یک بخش؛ در حالت خاموش یک context خالی مشترک برمی‌گردد"""
+    if not profiler.enabled:
+        return _DISABLED
+    return profiler.profile(name)
@@ -0,0 +1,102 @@
+import heapq
+import random
+import threading
+import time
+
+class DecisionScheduler:
+    """زمان‌بند تصمیم‌گیری هر کشور بر اساس زمان سررسید (heap)"""
+
+    def __init__(self, interval_min, interval_max, rng=None):
+        # بازه تصمیم‌گیری بر حسب ثانیه
+        self.interval_min = interval_min
+        self.interval_max = interval_max
+        self.rng = rng or random.Random()
+        self._heap = []
+        self._due = {}  # country_id -> زمان سررسید فعلی (برای حذف تنبل)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, country_id):
+        return country_id in self._due
+
+    def next_interval(self):
+        """فاصله تصادفی تا تصمیم بعدی"""
+        return self.rng.uniform(self.interval_min, self.interval_max)
+
+    def add(self, country_id, due=None):
+        """افزودن کشور (بدون due، زمان اول به‌طور یکنواخت پخش می‌شود)"""
+        if due is None:
+            due = time.monotonic() + self.rng.uniform(0, self.interval_max)
+        with self._cond:
+            self._due[country_id] = due
+            heapq.heappush(self._heap, (due, country_id))
+            self._cond.notify()
+
+    def reschedule(self, country_id):
+        """زمان‌بندی دوباره کشور با فاصله تصادفی"""
+        self.add(country_id, time.monotonic() + self.next_interval())
+
+    def remove(self, country_id):
+        """حذف کشور از صف"""
+        with self._cond:
+            self._due.pop(country_id, None)
+
+    def _discard_stale(self):
+        # حذف ورودی‌هایی که حذف یا دوباره زمان‌بندی شده‌اند
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def wait_due(self, max_items=100, timeout=None):
+        """انتظار تا سررسید کشور بعدی و برگرداندن کشورهای سررسید شده"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._stopped:
+                self._discard_stale()
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    due_ids = []
+                    while self._heap and self._heap[0][0] <= now and len(due_ids) < max_items:
+                        due, country_id = heapq.heappop(self._heap)
+                        if self._due.get(country_id) != due:
+                            continue
+                        del self._due[country_id]
+                        due_ids.append(country_id)
+                        self.last_lag = now - due
+                        self.max_lag = max(self.max_lag, self.last_lag)
+                    return due_ids
+
+                wait = self._heap[0][0] - now if self._heap else None
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return []
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+        return []
+
+    def stop(self):
+        """توقف فوری (بیدار کردن thread منتظر)"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def stats(self):
+        """عمق صف و تأخیر"""
+        with self._cond:
+            self._discard_stale()
+            next_due = self._heap[0][0] - time.monotonic() if self._heap else None
+            return {
+                "queue_depth": len(self._due),
+                "next_due_in": next_due,
+                "last_lag": self.last_lag,
+                "max_lag": self.max_lag
+            }
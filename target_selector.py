@@ -0,0 +1,105 @@
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import User
+from leaderboard import KINDS, compute_powers, leaderboard
+
+# تعداد تلاش نمونه‌گیری رد/قبول روی بازه id ها پیش از شمارش کاربران واجد شرایط
+SAMPLE_ATTEMPTS = 8
+
+class TargetSelector:
+    """انتخاب هدف حمله بدون اسکن کامل جدول کاربران"""
+
+    def __init__(self, db_manager):
+        self.db = db_manager
+
+    def _filters(self, min_power=None, max_power=None, active_since=None, exclude_ids=None):
+        filters = []
+        if min_power is not None:
+            filters.append(User.power >= min_power)
+        if max_power is not None:
+            filters.append(User.power <= max_power)
+        if active_since is not None:
+            filters.append(User.last_active >= active_since)
+        if exclude_ids:
+            filters.append(User.id.notin_(exclude_ids))
+        return filters
+
+    def pick_random_id(self, session, rng=random, attempts=SAMPLE_ATTEMPTS, **criteria):
+        """انتخاب یکنواخت یک id از میان کاربران واجد شرایط (فقط از روی ایندکس‌ها)"""
+        # بازه id ها در میان کاربران واجد شرایط
+        filters = self._filters(**criteria)
+        low, high = session.query(func.min(User.id), func.max(User.id)).filter(*filters).one()
+        if low is None:
+            return None
+
+        # رد/قبول: id تصادفی فقط اگر خودش واجد شرایط باشد پذیرفته می‌شود (هر کاربر با احتمال برابر)
+        for _ in range(attempts):
+            row = session.query(User.id).filter(User.id == rng.randint(low, high), *filters).first()
+            if row:
+                return row[0]
+
+        # بازه پراکنده (مثلاً بازه قدرت باریک): انتخاب با OFFSET تصادفی روی ایندکس فیلترشده
+        count = session.query(func.count(User.id)).filter(*filters).scalar()
+        if not count:
+            return None
+        return (session.query(User.id).filter(*filters)
+                .order_by(User.id).offset(rng.randrange(count)).limit(1).scalar())
+
+    def pick_random(self, session, rng=random, **criteria):
+        """انتخاب و بارگذاری فقط کاربر هدف"""
+        user_id = self.pick_random_id(session, rng, **criteria)
+        return session.get(User, user_id) if user_id is not None else None
+
+    def pick_id_for_attack(self, session, attack_power, rng=random, band=(0.5, 1.5), active_days=None):
+        """id هدف در بازه قدرت مهاجم؛ در صورت نبود، یک هدف تصادفی (بدون بارگذاری کاربر)"""
+        active_since = None
+        if active_days:
+            active_since = datetime.utcnow() - timedelta(days=active_days)
+
+        target_id = None
+        if attack_power > 0:
+            target_id = self.pick_random_id(session, rng,
+                                            min_power=attack_power * band[0],
+                                            max_power=attack_power * band[1],
+                                            active_since=active_since)
+        if target_id is None:
+            target_id = self.pick_random_id(session, rng, active_since=active_since)
+        return target_id
+
+    def pick_for_attack(self, session, attack_power, rng=random, band=(0.5, 1.5), active_days=None):
+        """هدف در بازه قدرت مهاجم؛ در صورت نبود، یک هدف تصادفی"""
+        target_id = self.pick_id_for_attack(session, attack_power, rng, band, active_days)
+        target = session.get(User, target_id) if target_id is not None else None
+
+        # سطرهایی که هنوز با python leaderboard.py محاسبه نشده‌اند به‌تدریج تازه می‌شوند
+        if target is not None:
+            self.refresh_power([target])
+        return target
+
+    def pick_neighbor(self, session, kind, owner_id, rng=random, spread=5, band=(0.5, 1.5)):
+        """هدف تصادفی از کاربران هم‌رتبه در رتبه‌بندی قدرت (بدون کوئری بازه‌ای)
+
+        رتبه‌بندی فقط commit های SQLAlchemy همین پروسه را دیده است، پس فقط نامزدها را پیشنهاد می‌دهد:
+        قدرت مالک و نامزدها از نیروهای فعلی‌شان دوباره محاسبه و نامزدهای خارج از band کنار گذاشته می‌شوند.
+        """
+        candidate_ids = [entry_id for _, entry_kind, entry_id, _ in leaderboard.neighbors(kind, owner_id, spread)
+                         if entry_kind == "user" and (kind, owner_id) != ("user", entry_id)]
+        if not candidate_ids:
+            return None
+
+        owner = session.get(next(model for model, name in KINDS.items() if name == kind), owner_id)
+        users = session.query(User).filter(User.id.in_(candidate_ids)).order_by(User.id).all()
+        # ردیف‌های حذف‌شده از رتبه‌بندی برداشته می‌شوند؛ قدرت تغییرکرده با commit فراخواننده اعمال می‌شود
+        found = {user.id for user in users}
+        leaderboard.apply([("user", user_id, None) for user_id in candidate_ids if user_id not in found])
+        self.refresh_power(users + ([owner] if owner is not None else []))
+        if owner is not None and owner.power:
+            users = [user for user in users if band[0] * owner.power <= user.power <= band[1] * owner.power]
+        return rng.choice(users) if users else None
+
+    def refresh_power(self, users):
+        """به‌روزرسانی ستون power (قدرت دفاعی) برای چند کاربر با یک محاسبه دسته‌ای"""
+        for user, power in zip(users, compute_powers(users)):
+            if user.power != power:
+                user.power = power
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database.py هنگام import فایل game.db را در پوشه جاری می‌سازد
+os.chdir(tempfile.mkdtemp(prefix="tests-"))
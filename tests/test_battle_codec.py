@@ -0,0 +1,57 @@
+"""تست دیکشنری واحدها بین دو پروسه با یک دیتابیس مشترک"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base
+from battle_codec import UnitDictionary
+
+@pytest.fixture
+def sessions(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'game.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    created = []
+
+    def create():
+        session = factory()
+        created.append(session)
+        return session
+
+    yield create
+    for session in created:
+        session.close()
+    engine.dispose()
+
+def register(dictionary, session, units):
+    # در برنامه after_commit کش سراسری را به‌روز می‌کند؛ اینجا هر پروسه کش خودش را دارد
+    dictionary.register(session, [units])
+    entries = dict(session.info.get("unit_ids", {}))
+    session.commit()
+    dictionary.publish(entries)
+
+def test_decode_reloads_ids_registered_by_another_process(sessions):
+    first, second = UnitDictionary(), UnitDictionary()
+    first_session, second_session = sessions(), sessions()
+
+    # پروسه اول دو واحد ثبت و نیروها را با نسخه 2 فشرده می‌کند
+    register(first, first_session, {"ground": {"u0": 1, "u1": 1}})
+    blob = first.encode({"ground": {"u0": 3, "u1": 4}, "air": {}})
+    assert first.version == 2
+
+    # سپس سه واحد دیگر؛ پروسه دوم فقط همین‌ها را در register می‌بیند
+    register(first, first_session, {"ground": {"u2": 1, "u3": 1, "u4": 1}})
+    register(second, second_session, {"ground": {"u2": 1, "u3": 1, "u4": 1}})
+    assert second.version == 5
+    assert len(second.ids) == 3
+
+    # نسخه بایت‌ها از نسخه کش کوچک‌تر است ولی id های 1 و 2 در کش نیستند
+    assert second.decode(blob, second_session) == {"ground": {"u0": 3, "u1": 4}, "air": {}}
+    assert len(second.ids) == 5
+
+def test_decode_unknown_id_without_session_raises(sessions):
+    first = UnitDictionary()
+    register(first, sessions(), {"ground": {"u0": 1}})
+    blob = first.encode({"ground": {"u0": 1}})
+
+    with pytest.raises(KeyError):
+        UnitDictionary().decode(blob)
@@ -0,0 +1,296 @@
+"""تست صف ارسال پیام در برابر یک Bot API محلی"""
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import pytest
+import config
+import database
+from broadcaster import Broadcaster
+
+class FakeBotAPI:
+    """Bot API محلی؛ respond(token, params, attempt) وضعیت HTTP و parameters خطا را تعیین می‌کند"""
+
+    def __init__(self, respond=None):
+        api = self
+        self.respond = respond or (lambda token, params, attempt: (200, None))
+        self.sent = defaultdict(list)  # token -> [(زمان، chat_id، متن)]
+        self.attempts = defaultdict(int)  # token -> تعداد درخواست‌ها
+        self.failures = defaultdict(list)  # token -> [(زمان، وضعیت)]
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                token = self.path[len("/bot"):].partition("/")[0]
+                params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+                status, payload = api.handle(token, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def handle(self, token, params):
+        now = time.monotonic()
+        with self._lock:
+            attempt = self.attempts[token]
+            self.attempts[token] += 1
+        status, parameters = self.respond(token, params, attempt)
+        if status != 200:
+            with self._lock:
+                self.failures[token].append((now, status))
+            payload = {"ok": False, "error_code": status, "description": f"Error {status}"}
+            if parameters:
+                payload["parameters"] = parameters
+            return status, payload
+        chat_id = int(params["chat_id"])
+        with self._lock:
+            self.sent[token].append((now, chat_id, params["text"]))
+        return 200, {"ok": True, "result": {
+            "message_id": len(self.sent[token]), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": params["text"]
+        }}
+
+    def count(self, token=None):
+        with self._lock:
+            if token is not None:
+                return len(self.sent[token])
+            return sum(len(items) for items in self.sent.values())
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class LocalBroadcaster(Broadcaster):
+    """توکن هر ربات بدون دیتابیس SQLAlchemy"""
+
+    def _lookup_token(self, bot_id):
+        return token(bot_id)
+
+def token(bot_id):
+    return f"{bot_id}:test-token"
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def outbox_rows():
+    return database.get_connection().execute("SELECT id, owner FROM outbox").fetchall()
+
+@pytest.fixture(autouse=True)
+def outbox_db(tmp_path):
+    database.pool.close_all()
+    database.pool.path = str(tmp_path / "game.db")
+    database.init_db()
+    yield
+    database.pool.close_all()
+
+@pytest.fixture
+def api(monkeypatch):
+    servers = []
+
+    def start(respond=None):
+        server = FakeBotAPI(respond)
+        monkeypatch.setattr(config, "TELEGRAM_API_URL", server.url)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+@pytest.fixture
+def broadcasters():
+    created = []
+
+    def create(**kwargs):
+        kwargs.setdefault("bot_rate", 1000)
+        kwargs.setdefault("bot_burst", 1000)
+        kwargs.setdefault("global_rate", 1000)
+        kwargs.setdefault("lease", 3)
+        broadcaster = LocalBroadcaster(None, **kwargs)
+        created.append(broadcaster)
+        return broadcaster
+
+    yield create
+    for broadcaster in created:
+        broadcaster.stop()
+
+def test_per_bot_rate_limit(api, broadcasters):
+    server = api()
+    broadcaster = broadcasters(bot_rate=20, bot_burst=2)
+    broadcaster.start()
+    started = time.monotonic()
+    broadcaster.enqueue_many([(1, chat_id, "hello") for chat_id in range(12)])
+
+    assert wait_for(lambda: server.count(token(1)) == 12)
+    # 2 پیام اول از burst، 10 پیام بعدی با نرخ 20 در ثانیه
+    assert server.sent[token(1)][-1][0] - started >= 10 / 20 * 0.9
+
+def test_global_rate_limit(api, broadcasters):
+    server = api()
+    broadcaster = broadcasters(global_rate=40)
+    broadcaster.start()
+    started = time.monotonic()
+    broadcaster.enqueue_many([(bot_id, chat_id, "hello") for bot_id in range(1, 5) for chat_id in range(25)])
+
+    assert wait_for(lambda: server.count() == 100)
+    finished = max(sent_at for items in server.sent.values() for sent_at, _, _ in items)
+    # 40 پیام از ظرفیت سراسری، 60 پیام بعدی با نرخ 40 در ثانیه
+    assert finished - started >= 60 / 40 * 0.9
+    # ربات‌ها به نوبت سرویس می‌گیرند
+    assert all(server.count(token(bot_id)) == 25 for bot_id in range(1, 5))
+
+def test_retry_after_pauses_only_that_bot(api, broadcasters):
+    def respond(bot_token, params, attempt):
+        if bot_token == token(1) and attempt == 0:
+            return 429, {"retry_after": 1}
+        return 200, None
+
+    server = api(respond)
+    # یک درخواست همزمان تا پیام‌های بعدی ربات 1 پیش از رسیدن 429 فرستاده نشوند
+    broadcaster = broadcasters(concurrency=1)
+    broadcaster.start()
+    broadcaster.enqueue_many([(1, chat_id, "hello") for chat_id in range(3)] +
+                             [(2, chat_id, "hello") for chat_id in range(3)])
+
+    assert wait_for(lambda: server.count() == 6)
+    throttled_at = server.failures[token(1)][0][0]
+    assert broadcaster.stats()["throttled"] == 1
+    # ربات 1 تا پایان retry_after چیزی ارسال نمی‌کند، ربات 2 منتظر نمی‌ماند
+    assert min(sent_at for sent_at, _, _ in server.sent[token(1)]) - throttled_at >= 0.9
+    assert max(sent_at for sent_at, _, _ in server.sent[token(2)]) - throttled_at < 0.9
+    # پیام محدودشده دوباره و فقط یک بار ارسال می‌شود
+    assert sorted(chat_id for _, chat_id, _ in server.sent[token(1)]) == [0, 1, 2]
+
+def test_transient_errors_are_retried(api, broadcasters):
+    server = api(lambda bot_token, params, attempt: (500, None) if attempt < 2 else (200, None))
+    broadcaster = broadcasters(max_attempts=5, retry_base=0.05)
+    broadcaster.start()
+    broadcaster.enqueue(1, 42, "hello")
+
+    assert wait_for(lambda: server.count() == 1)
+    assert server.attempts[token(1)] == 3
+    assert broadcaster.stats()["retried"] == 2
+
+def test_retry_limit_drops_message(api, broadcasters):
+    server = api(lambda bot_token, params, attempt: (500, None))
+    broadcaster = broadcasters(max_attempts=3, retry_base=0.05, lease=0.9)
+    broadcaster.start()
+    broadcaster.enqueue(1, 42, "hello")
+
+    assert wait_for(lambda: broadcaster.stats()["dropped"] == 1)
+    assert server.attempts[token(1)] == 3
+    assert server.count() == 0
+    # پیام کنار گذاشته‌شده از outbox هم حذف می‌شود
+    assert wait_for(lambda: not outbox_rows())
+
+def test_forbidden_is_not_retried(api, broadcasters):
+    server = api(lambda bot_token, params, attempt: (403, None))
+    broadcaster = broadcasters(retry_base=0.05)
+    broadcaster.start()
+    broadcaster.enqueue(1, 42, "hello")
+
+    assert wait_for(lambda: broadcaster.stats()["dropped"] == 1)
+    assert server.attempts[token(1)] == 1
+
+def test_same_chat_messages_are_coalesced(api, broadcasters):
+    server = api()
+    broadcaster = broadcasters()
+    broadcaster.enqueue_many([(1, 42, "first"), (1, 42, "second"), (1, 7, "other")])
+    broadcaster.enqueue(1, 42, "third")
+    broadcaster.start()
+
+    assert wait_for(lambda: server.count() == 2)
+    texts = {chat_id: text for _, chat_id, text in server.sent[token(1)]}
+    assert texts[42] == "first\n\nsecond\n\nthird"
+    assert texts[7] == "other"
+
+def test_pending_messages_survive_restart(api, broadcasters):
+    server = api()
+    first = broadcasters()
+    first.enqueue_many([(1, 42, "hello"), (1, 43, "hello")])
+    first.stop()
+    # پروسه قبلی بدون stop از کار افتاده؛ پیام‌ها هنوز lease دارند
+    database.get_connection().execute("UPDATE outbox SET lease_until = 0")
+    database.get_connection().commit()
+
+    second = broadcasters()
+    second.start()
+    assert wait_for(lambda: server.count() == 2)
+    assert wait_for(lambda: not outbox_rows())
+
+def test_workers_do_not_send_each_others_messages(api, broadcasters):
+    server = api()
+    owner = broadcasters(lease=1)
+    owner.enqueue_many([(1, chat_id, "hello") for chat_id in range(5)])
+
+    # worker دیگر تا وقتی lease معتبر است پیام‌ها را برنمی‌دارد
+    other = broadcasters(lease=1)
+    other.start()
+    time.sleep(0.3)
+    assert server.count() == 0
+
+    # صاحب پیام‌ها بدون تمدید lease متوقف شده؛ بعد از انقضا worker دیگر آن‌ها را یک بار می‌فرستد
+    assert wait_for(lambda: server.count() == 5, timeout=5)
+    time.sleep(0.5)
+    assert sorted(chat_id for _, chat_id, _ in server.sent[token(1)]) == list(range(5))
+
+def test_released_messages_are_sent_once_by_many_workers(api, broadcasters):
+    server = api()
+    database.outbox_save([(1, chat_id, "hello") for chat_id in range(50)])
+
+    workers = [broadcasters() for _ in range(3)]
+    for worker in workers:
+        worker.start()
+
+    assert wait_for(lambda: server.count() == 50)
+    time.sleep(0.3)
+    assert sorted(chat_id for _, chat_id, _ in server.sent[token(1)]) == list(range(50))
+    assert sum(worker.stats()["claimed"] for worker in workers) == 50
+
+def test_failed_save_does_not_leave_unsent_messages(api, broadcasters, monkeypatch):
+    server = api()
+    broadcaster = broadcasters()
+    broadcaster.enqueue(1, 42, "first")
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    save = database.outbox_save
+    monkeypatch.setattr(database, "outbox_save", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        broadcaster.enqueue_many([(1, 42, "second"), (1, 7, "lost")])
+    monkeypatch.setattr(database, "outbox_save", save)
+
+    # اعلان بعدی همان چت در پیام جدید و ثبت‌شده قرار می‌گیرد، نه در پیامی که هرگز ارسال نمی‌شد
+    broadcaster.enqueue(1, 7, "third")
+    broadcaster.start()
+
+    assert wait_for(lambda: server.count() == 2)
+    texts = {chat_id: text for _, chat_id, text in server.sent[token(1)]}
+    assert texts == {42: "first", 7: "third"}
+    assert wait_for(lambda: not outbox_rows())
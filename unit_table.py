@@ -0,0 +1,147 @@
+import numpy as np
+import config
+
+def tech_bonus(tech_level):
+    return 1 + (tech_level * 0.05)  # 5% افزایش به ازای هر سطح
+
+class Army:
+    """نیروهای یک طرف جنگ؛ بردار تعداد و قدرت خام هر کدام فقط یک بار و در صورت نیاز محاسبه می‌شوند"""
+    __slots__ = ("table", "units", "_vector", "_power")
+
+    def __init__(self, table, units):
+        self.table = table
+        self.units = units
+        self._vector = None
+        self._power = {}
+
+    @property
+    def vector(self):
+        if self._vector is None:
+            self._vector = self.table.to_vector(self.units)
+        return self._vector
+
+    def power(self, action_type):
+        """قدرت بدون بونوس تکنولوژی"""
+        power = self._power.get(action_type)
+        if power is None:
+            if self._vector is not None:
+                power = float(self._vector @ self.table.stats(action_type))
+            else:
+                power = self.table.raw_power(self.units, action_type)
+            self._power[action_type] = power
+        return power
+
+class UnitTable:
+    """جدول کامپایل‌شده مشخصات واحدها"""
+
+    def __init__(self, units_config):
+        # هر واحد یک اندیس ثابت می‌گیرد (به ترتیب تعریف در کانفیگ)
+        # واحدهای جدید باید به انتهای کانفیگ اضافه شوند تا اندیس‌های قبلی تغییر نکنند
+        self.keys = []
+        self.index = {}
+        self.groups = {}  # نوع -> {نام: اندیس} (بدون ساختن tuple برای هر جستجو)
+        self.group_stats = {"attack": {}, "defense": {}}  # نوع -> {نام: قدرت}
+        attack = []
+        defense = []
+
+        for unit_type, unit_dict in units_config.items():
+            group = self.groups.setdefault(unit_type, {})
+            for unit_name, unit_info in unit_dict.items():
+                self.index[(unit_type, unit_name)] = group[unit_name] = len(self.keys)
+                self.keys.append((unit_type, unit_name))
+                attack.append(unit_info.get("attack", 0))
+                defense.append(unit_info.get("defense", 0))
+            for action_type, values in (("attack", attack), ("defense", defense)):
+                self.group_stats[action_type][unit_type] = {unit_name: values[i] for unit_name, i in group.items()}
+
+        self.attack = np.array(attack, dtype=np.float64)
+        self.defense = np.array(defense, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def stats(self, action_type):
+        """بردار قدرت برای حمله یا دفاع"""
+        return self.attack if action_type == "attack" else self.defense
+
+    def to_vector(self, units):
+        """تبدیل دیکشنری نیروها به بردار تعداد"""
+        # جمع در لیست پایتون؛ مقداردهی تک‌تک خانه‌های آرایه numpy کندتر است
+        counts = [0] * len(self.keys)
+        for unit_type, unit_dict in units.items():
+            group = self.groups.get(unit_type)
+            if group is None:
+                continue
+            for unit_name, count in unit_dict.items():
+                i = group.get(unit_name)
+                if i is not None:
+                    counts[i] += count
+        return np.array(counts, dtype=np.float64)
+
+    def army(self, units):
+        """Army برای یک دیکشنری نیروها (Army موجود همان برمی‌گردد)"""
+        return units if isinstance(units, Army) else Army(self, units)
+
+    def raw_power(self, units, action_type):
+        """قدرت یک ارتش بدون بونوس با یک پیمایش دیکشنری
+
+        برای یک ارتش با حدود 30 نوع واحد، ساختن بردار numpy از ضرب داخلی آن گران‌تر است؛
+        بردار فقط برای محاسبات دسته‌ای و امید تلفات در predict_battle ساخته می‌شود.
+        """
+        stats = self.group_stats[action_type]
+        power = 0
+        for unit_type, unit_dict in units.items():
+            group = stats.get(unit_type)
+            if group is None:
+                continue
+            for unit_name, count in unit_dict.items():
+                value = group.get(unit_name)
+                if value is not None:
+                    power += count * value
+        return float(power)
+
+    def to_matrix(self, armies):
+        """تبدیل لیست ارتش‌ها به ماتریس تعداد (هر سطر یک ارتش)"""
+        matrix = np.zeros((len(armies), len(self.keys)), dtype=np.float64)
+        for row, units in enumerate(armies):
+            for unit_type, unit_dict in (units or {}).items():
+                for unit_name, count in unit_dict.items():
+                    i = self.index.get((unit_type, unit_name))
+                    if i is not None:
+                        matrix[row, i] += count
+        return matrix
+
+    def to_dict(self, vector):
+        """تبدیل بردار به دیکشنری تو در تو (فقط مقادیر غیر صفر)"""
+        counts = vector.astype(np.int64).tolist()
+        units = {}
+        for unit_type, group in self.groups.items():
+            unit_dict = {unit_name: counts[i] for unit_name, i in group.items() if counts[i]}
+            if unit_dict:
+                units[unit_type] = unit_dict
+        return units
+
+    def power(self, vector, action_type, tech_level=0):
+        """قدرت یک ارتش با یک ضرب داخلی"""
+        return float(vector @ self.stats(action_type)) * tech_bonus(tech_level)
+
+    def power_batch(self, armies, action_type, tech_levels=None):
+        """قدرت تعداد زیادی ارتش در یک فراخوانی"""
+        matrix = armies if isinstance(armies, np.ndarray) else self.to_matrix(armies)
+        power = matrix @ self.stats(action_type)
+        if tech_levels is not None:
+            power = power * tech_bonus(np.asarray(tech_levels, dtype=np.float64))
+        return power
+
+    def losses(self, vector, loss_rate):
+        """بردار تلفات (گرد شده به پایین مثل int)"""
+        return np.floor(vector * loss_rate)
+
+_table = None
+
+def get_unit_table():
+    """جدول واحدها (یک بار ساخته می‌شود)"""
+    global _table
+    if _table is None:
+        _table = UnitTable(config.Config.UNITS)
+    return _table
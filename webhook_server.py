@@ -1,29 +1,49 @@
 from flask import Flask, request
-from child_bot import ChildBot
-from database import DatabaseManager
-import threading
+from database import DatabaseManager, player_cache
+from dispatcher import WebhookDispatcher
+from broadcaster import Broadcaster
+from leaderboard import leaderboard
 import logging
+import metrics
+import config
+from profiler import profile, profiler
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# ذخیره instance ربات‌های فعال
-active_bots = {}
+# یک dispatcher مشترک برای همه ربات‌های فرزند (بدون thread برای هر ربات)
+dispatcher = WebhookDispatcher(DatabaseManager())
+dispatcher.start()
+metrics.REGISTRY.register_gauges("dispatcher", "Webhook dispatcher state", dispatcher.stats)
+metrics.REGISTRY.register_gauges("player_cache", "Player cache state", player_cache.stats)
 
-def run_child_bot(bot_token, bot_id):
-    """اجرای ربات فرزند در thread جداگانه"""
-    bot = ChildBot(bot_token, bot_id)
-    active_bots[bot_id] = bot
-    bot.run()
+# صف ارسال پیام‌های ربات‌های فرزند (اعلان‌های AI و پیام‌های همگانی)
+broadcaster = Broadcaster(DatabaseManager())
+broadcaster.start()
+metrics.REGISTRY.register_gauges("broadcaster", "Outbound message queue state", broadcaster.stats)
+
+# رتبه‌بندی قدرت از ستون power (بدون محاسبه دوباره؛ مهاجرت یک‌باره با python leaderboard.py)
+session = DatabaseManager().get_session()
+try:
+    leaderboard.load(session, recompute=False)
+finally:
+    session.close()
+metrics.REGISTRY.register_gauges("leaderboard", "Power leaderboard state", leaderboard.stats)
 
 @app.route('/webhook/<bot_token>', methods=['POST'])
 def webhook(bot_token):
     """دریافت وب‌هوک از تلگرام"""
     try:
-        update = request.get_json()
-        # اینجا باید منطق پردازش update اضافه شود
-        # برای سادگی، فقط log می‌کنیم
-        logging.info(f"Received update for bot with token: {bot_token[:10]}...")
+        with profile("webhook_request"):
+            bot = dispatcher.resolve(bot_token)
+            if bot is None:
+                return 'Unknown bot', 404
+            
+            # پاسخ سریع؛ در صورت پر بودن صف تلگرام بعداً دوباره ارسال می‌کند
+            update = request.get_json()
+            status = dispatcher.submit(bot, update)
+        if status:
+            return 'Busy', status, {'Retry-After': '1'}
         return 'OK'
     except Exception as e:
         logging.error(f"Error processing webhook: {e}")
@@ -32,7 +52,32 @@ def webhook(bot_token):
 @app.route('/health')
 def health_check():
     """بررسی سلامت سرور"""
-    return {'status': 'healthy', 'active_bots': len(active_bots)}
+    return {'status': 'healthy', 'active_bots': len(dispatcher.bots), 'dispatcher': dispatcher.stats()}
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """متریک‌ها با قالب متنی Prometheus (فقط برای درخواست‌های محلی)"""
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return 'Forbidden', 403
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+@app.route('/profile', methods=['GET', 'POST'])
+def profile_control():
+    """روشن/خاموش کردن پروفایلر (فقط مالک، با توکن PROFILE_TOKEN)"""
+    if not config.PROFILE_TOKEN or request.headers.get('X-Profile-Token') != config.PROFILE_TOKEN:
+        return 'Not found', 404
+    if request.method == 'GET':
+        return profiler.status()
+    
+    try:
+        enabled = request.args.get('enabled')
+        return profiler.configure(
+            enabled=None if enabled is None else enabled == '1',
+            sample_rate=request.args.get('rate'),
+            mode=request.args.get('mode')
+        )
+    except ValueError as e:
+        return {'error': str(e)}, 400
 
 @app.route('/start_bot/<int:bot_id>')
 def start_bot(bot_id):
@@ -48,14 +93,10 @@ def start_bot(bot_id):
             return {'error': 'Bot not found'}, 404
         
         # بررسی اینکه ربات قبلاً اجرا نشده باشد
-        if bot_id not in active_bots:
-            # اجرای ربات در thread جدید
-            thread = threading.Thread(
-                target=run_child_bot,
-                args=(bot.bot_token, bot_id),
-                daemon=True
-            )
-            thread.start()
+        if bot_id not in dispatcher.tokens:
+            # ربات در اولین update ساخته می‌شود (lazy)؛ اینجا فقط وضعیت بررسی می‌شود
+            if bot.status != 'active':
+                return {'error': 'Bot is not active'}, 400
             
             return {
                 'success': True,